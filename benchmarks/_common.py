@@ -0,0 +1,162 @@
+"""
+Shared utilities of the benchmark scripts.
+
+The database benchmarks run against a real MongoDB server if ``--mongo-url`` is
+given, otherwise against an in-memory ``mongomock_motor`` collection
+(``pip install mongomock-motor``), with every round trip to the database
+delayed by ``--latency`` milliseconds to simulate the network.
+"""
+
+import asyncio
+import timeit
+
+from pymongo import UpdateOne
+
+__all__ = ['open_collection', 'RoundTripCounter', 'time_per_call']
+
+#: Methods of the collection to be counted as round trips.
+ROUND_TRIP_METHODS = (
+    'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+    'delete_one', 'delete_many', 'bulk_write', 'find_one_and_update',
+    'count_documents', 'aggregate', 'find',
+)
+
+
+def open_collection(mongo_url, name):
+    """
+    Open an empty collection for benchmarking.
+
+    Args:
+        mongo_url (str or None): The MongoDB URL.  If :obj:`None`, use an
+            in-memory ``mongomock_motor`` collection.
+        name (str): Name of the collection.
+
+    Returns:
+        The Motor (or Motor-like) collection.
+    """
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+        coll = client['mlstorage_benchmarks'][name]
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:  # pragma: no cover
+            raise RuntimeError('`mongomock-motor` is required to run the '
+                               'benchmarks without `--mongo-url`.')
+        coll = AsyncMongoMockClient()['mlstorage_benchmarks'][name]
+        _patch_mock_bulk_write(coll)
+    return coll
+
+
+def _patch_mock_bulk_write(coll):
+    # mongomock does not accept the `sort` argument passed to its bulk
+    # builder by recent pymongo versions, in which case the `UpdateOne`
+    # requests are run one by one (and still counted as one round trip).
+    # `UpdateOne` has no public accessors, so its `_filter` and `_doc`
+    # attributes are read, which exist since pymongo 3.0 (checked up to
+    # pymongo 4.18).
+    mock_bulk_write = coll.bulk_write
+    update_one = coll.update_one
+
+    async def bulk_write(requests, ordered=True):
+        requests = list(requests)
+        try:
+            return await mock_bulk_write(requests, ordered=ordered)
+        except TypeError:
+            if not all(isinstance(r, UpdateOne) for r in requests):
+                raise
+        for r in requests:
+            await update_one(r._filter, r._doc)
+
+    coll.bulk_write = bulk_write
+
+
+class _DelayedCursor(object):
+    """
+    Wraps a cursor, such that fetching its documents is delayed by
+    `latency` seconds without blocking the event loop.
+    """
+
+    def __init__(self, cursor, latency):
+        self._cursor = cursor
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        # keep the chained methods (e.g., `sort` and `limit`) wrapped
+        def method(*args, **kwargs):
+            ret = attr(*args, **kwargs)
+            return self if ret is self._cursor else ret
+        return method
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(self._latency)
+        async for doc in self._cursor:
+            yield doc
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self._latency)
+        return await self._cursor.to_list(length)
+
+
+class RoundTripCounter(object):
+    """
+    Count (and optionally delay) the round trips made via a collection.
+
+    The methods listed in :data:`ROUND_TRIP_METHODS` of the collection
+    are replaced by wrappers, which increase :attr:`count` and then sleep
+    for `latency` seconds before forwarding the call.  A ``find`` is
+    counted as one round trip, no matter how many batches it fetches.
+    """
+
+    def __init__(self, collection, latency=0.):
+        self.count = 0
+        self.latency = latency
+        for name in ROUND_TRIP_METHODS:
+            method = getattr(collection, name, None)
+            if method is not None:
+                setattr(collection, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        if name == 'find':
+            # `find` returns a cursor rather than a coroutine, thus the
+            # latency is added when the documents are fetched
+            def wrapper(*args, **kwargs):
+                self.count += 1
+                cursor = method(*args, **kwargs)
+                if self.latency:
+                    cursor = _DelayedCursor(cursor, self.latency)
+                return cursor
+        else:
+            async def wrapper(*args, **kwargs):
+                self.count += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                return await method(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        """Reset the round trip counter."""
+        self.count = 0
+
+
+def time_per_call(fn, number, repeat=5):
+    """
+    Measure the time of calling `fn`, by the best of `repeat` runs.
+
+    Args:
+        fn (() -> any): The function to be measured.
+        number (int): Number of calls in each run.
+        repeat (int): Number of runs. (default 5)
+
+    Returns:
+        float: The seconds per call.
+    """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
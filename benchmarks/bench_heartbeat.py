@@ -0,0 +1,93 @@
+"""
+Benchmark of writing experiment heartbeats.
+
+Compares one ``update_one`` per heartbeat (:meth:`MLDB.set_heartbeat`)
+against the coalescing :class:`HeartbeatWriter`, by sending `--beats`
+heartbeats of `--experiments` experiments with `--concurrency` concurrent
+clients, and reports the throughput and the number of database round
+trips of each.  Note the mock database is CPU-bound, such that the
+throughput is only meaningful against a real MongoDB server.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_heartbeat.py [--mongo-url URL]
+"""
+
+import asyncio
+import time
+
+import click
+
+from _common import open_collection, RoundTripCounter
+from mlstorage_server.heartbeat import HeartbeatWriter
+from mlstorage_server.mldb import MLDB
+
+
+async def send_beats(beat, ids, beats, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await beat(ids[i % len(ids)])
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(beats)])
+    return time.perf_counter() - start_time
+
+
+async def run(mongo_url, experiments, beats, concurrency, latency,
+              flush_interval):
+    coll = open_collection(mongo_url, 'bench_heartbeat')
+    await coll.delete_many({})
+    mldb = MLDB(coll)
+    ids = await mldb.create_many([{'name': 'exp-{}'.format(i)}
+                                  for i in range(experiments)])
+    counter = RoundTripCounter(coll, latency=latency)
+
+    # one `update_one` per heartbeat
+    seconds = await send_beats(mldb.set_heartbeat, ids, beats, concurrency)
+    click.echo('set_heartbeat:   {:8.0f} beats/s, {:6d} round trips'.
+               format(beats / seconds, counter.count))
+
+    # coalesced heartbeats, with the existence of experiments cached
+    writer = HeartbeatWriter(mldb, flush_interval=flush_interval)
+    for id in ids:
+        await writer.beat(id)
+    await writer.flush()
+    counter.reset()
+    start_time = time.perf_counter()
+    await send_beats(writer.beat, ids, beats, concurrency)
+    await writer.close()  # including the time of the final flush
+    seconds = time.perf_counter() - start_time
+    click.echo('HeartbeatWriter: {:8.0f} beats/s, {:6d} round trips'.
+               format(beats / seconds, counter.count))
+
+    await coll.delete_many({})
+
+
+@click.command()
+@click.option('--mongo-url', default=None,
+              help='MongoDB URL.  If not specified, use an in-memory '
+                   'mock database.')
+@click.option('--experiments', default=500, type=int,
+              help='Number of experiments.')
+@click.option('--beats', default=20000, type=int,
+              help='Number of heartbeats to send.')
+@click.option('--concurrency', default=64, type=int,
+              help='Number of concurrent clients.')
+@click.option('--latency', default=1., type=float,
+              help='Simulated latency of each database round trip, '
+                   'in milliseconds.')
+@click.option('--flush-interval', default=.2, type=float,
+              help='Flush interval of the HeartbeatWriter, in seconds.')
+def main(mongo_url, experiments, beats, concurrency, latency,
+         flush_interval):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(
+        mongo_url, experiments, beats, concurrency, latency / 1000.,
+        flush_interval
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark of deleting experiment subtrees.
+
+Builds a "wide" tree (a root with `--width` children, each having
+`--leaves` leaf children) and a "deep" tree (a chain of `--depth`
+experiments, each having `--leaves` leaf children), then marks each
+tree as deleted by :meth:`MLDB.mark_delete` and purges it by
+:meth:`MLDB.complete_deletion`, and reports the number of database round
+trips and the time taken.
+
+To compare with another version of the server (e.g., the one before
+subtrees were deleted in bulk), run this script with ``PYTHONPATH``
+pointing to a checkout of that version.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_mark_delete.py [--mongo-url URL]
+"""
+
+import asyncio
+import time
+
+import click
+from bson import ObjectId
+
+from _common import open_collection, RoundTripCounter
+from mlstorage_server.mldb import MLDB
+
+
+def make_tree(kind, width, depth, leaves):
+    root = ObjectId()
+    docs = [{'_id': root, 'name': 'root'}]
+
+    def add_children(parent_id, count):
+        children = [{'_id': ObjectId(), 'parent_id': parent_id}
+                    for _ in range(count)]
+        docs.extend(children)
+        return [c['_id'] for c in children]
+
+    if kind == 'wide':
+        for child_id in add_children(root, width):
+            add_children(child_id, leaves)
+    else:
+        parent_id = root
+        for _ in range(depth):
+            parent_id, = add_children(parent_id, 1)
+            add_children(parent_id, leaves)
+    return root, docs
+
+
+async def run_tree(mongo_url, kind, width, depth, leaves, latency):
+    coll = open_collection(mongo_url, 'bench_mark_delete')
+    await coll.delete_many({})
+    root, docs = make_tree(kind, width, depth, leaves)
+    await coll.insert_many(docs)
+    mldb = MLDB(coll)
+    counter = RoundTripCounter(coll, latency=latency)
+
+    start_time = time.perf_counter()
+    id_list = await mldb.mark_delete(root)
+    deleted = await mldb.complete_deletion(id_list)
+    seconds = time.perf_counter() - start_time
+    click.echo('{:<5s}: {:5d} docs, {:5d} marked, {:5d} deleted, '
+               '{:5d} round trips, {:.2f}s'.
+               format(kind, len(docs), len(id_list), deleted, counter.count,
+                      seconds))
+
+    await coll.delete_many({})
+
+
+@click.command()
+@click.option('--mongo-url', default=None,
+              help='MongoDB URL.  If not specified, use an in-memory '
+                   'mock database.')
+@click.option('--width', default=20, type=int,
+              help='Number of children of the root in the wide tree.')
+@click.option('--depth', default=50, type=int,
+              help='Depth of the deep tree.')
+@click.option('--leaves', default=20, type=int,
+              help='Number of leaf children of each inner experiment.')
+@click.option('--latency', default=.5, type=float,
+              help='Simulated latency of each database round trip, '
+                   'in milliseconds.')
+def main(mongo_url, width, depth, leaves, latency):
+    loop = asyncio.get_event_loop()
+    for kind in ('wide', 'deep'):
+        loop.run_until_complete(run_tree(
+            mongo_url, kind, width, depth, leaves, latency / 1000.))
+
+
+if __name__ == '__main__':
+    main()
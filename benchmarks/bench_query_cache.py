@@ -0,0 +1,42 @@
+"""
+Benchmark of compiling query strings into MongoDB filter dicts, with and
+without :data:`query_cache`.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_query_cache.py
+"""
+
+import click
+
+from _common import time_per_call
+from mlstorage_server.query import (build_filter_dict_from_query_string,
+                                    query_cache)
+
+#: Typical query strings sent by the dashboard.
+QUERY_STRINGS = [
+    'name:mnist foo exit_code:0 status:running',
+    'resnet tags:baseline',
+    'id:5b4b0f0c2b6a4a1b2c3d4e5f',
+]
+
+
+@click.command()
+@click.option('--number', default=1000, type=int,
+              help='Number of calls in each run.')
+def main(number):
+    for use_cache in (False, True):
+        query_cache.clear()
+        for query_string in QUERY_STRINGS:
+            seconds = time_per_call(
+                lambda: build_filter_dict_from_query_string(
+                    query_string, use_cache=use_cache),
+                number=number
+            )
+            click.echo('{:<8s} {:>8.1f} us  {}'.format(
+                'cached' if use_cache else 'uncached', seconds * 1e6,
+                query_string))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of importing the query module, and of parsing and compiling
+query strings.
+
+If `--baseline` is specified, the same is measured for another version of
+``query.py`` as well, e.g., the former pyparsing grammar, taken from a
+checkout before the hand-written parser (which requires ``pyparsing<3``).
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_query_parser.py \\
+        [--baseline /path/to/old/query.py]
+"""
+
+import importlib.util
+import subprocess
+import sys
+
+import click
+
+from _common import time_per_call
+
+#: Typical query strings sent by the dashboard.
+QUERY_STRINGS = [
+    'name:mnist foo exit_code:0 status:running',
+    'resnet tags:baseline',
+    '"some phrase" config.lr:0.1 description:"a b c"',
+]
+
+#: Script to measure the import time of a query module in a fresh process.
+IMPORT_SCRIPT = '''
+import importlib.util, sys, time
+start = time.perf_counter()
+if sys.argv[1]:
+    spec = importlib.util.spec_from_file_location('query', sys.argv[1])
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+else:
+    import mlstorage_server.query
+print(time.perf_counter() - start)
+'''
+
+
+def import_time(path, repeat):
+    # the modules shared by both versions (bson, dateutil) are included
+    return min(
+        float(subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT, path or '']).split()[-1])
+        for _ in range(repeat)
+    )
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location('baseline_query', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark(name, path, module, number, repeat):
+    click.echo('{}: import {:.0f} ms'.format(
+        name, import_time(path, repeat) * 1000))
+
+    def build():
+        for query_string in QUERY_STRINGS:
+            module.build_filter_dict_from_query_string(
+                query_string, use_cache=False)
+
+    seconds = time_per_call(build, number=number, repeat=repeat)
+    click.echo('{}: parse and compile {:.1f} us per query'.format(
+        name, seconds / len(QUERY_STRINGS) * 1e6))
+
+
+@click.command()
+@click.option('--baseline', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Path of another version of "query.py" to compare with.')
+@click.option('--number', default=1000, type=int,
+              help='Number of parses in each run.')
+@click.option('--repeat', default=5, type=int,
+              help='Number of runs.')
+def main(baseline, number, repeat):
+    from mlstorage_server import query
+    benchmark('current', None, query, number, repeat)
+
+    if baseline:
+        try:
+            module = load_module(baseline)
+        except ImportError as ex:
+            click.echo('baseline: skipped, cannot import: {}'.format(ex))
+        else:
+            benchmark('baseline', baseline, module, number, repeat)
+
+
+if __name__ == '__main__':
+    main()
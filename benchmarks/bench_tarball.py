@@ -0,0 +1,166 @@
+"""
+Benchmark of downloading the storage directory of an experiment as a
+tarball.
+
+Generates an experiment storage directory of `--big-files` random files
+of `--big-size` MiB each and `--small-files` small text files, serves it
+on a local HTTP server, downloads it for `--repeat` times, and reports
+the best throughput of:
+
+* "subprocess": the former pipeline, where a child Python process writes
+  the tarball by :mod:`tarfile` to a pipe, which is read in 8 KiB chunks
+  and copied to the response by the event loop.
+* "in-process": ``GET /v1/_tarball/{id}`` of :class:`ApiV1`, where the
+  tarball is written in a thread pool and streamed with backpressure.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/bench_tarball.py [--compression gzip]
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from _common import open_collection
+from mlstorage_server.api_v1 import ApiV1
+from mlstorage_server.filestore import FileStoreManager
+from mlstorage_server.mldb import MLDB
+
+#: Script of the child process in the "subprocess" pipeline.
+TAR_SCRIPT = '''
+import sys, tarfile
+with tarfile.open(fileobj=sys.stdout.buffer, mode='w|') as tf:
+    tf.add(sys.argv[1], arcname=sys.argv[2])
+'''
+
+
+def make_subprocess_tarball_handler(mldb):
+    async def handler(request):
+        id = request.match_info['id']
+        doc = await mldb.get(id)
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-c', TAR_SCRIPT, doc['storage_dir'], id,
+            stdout=asyncio.subprocess.PIPE
+        )
+        try:
+            resp = web.StreamResponse(
+                headers={'Content-Type': 'application/x-tar'})
+            await resp.prepare(request)
+            while True:
+                buf = await proc.stdout.read(8192)
+                if not buf:
+                    break
+                await resp.write(buf)
+            await resp.write_eof()
+            return resp
+        finally:
+            if proc.returncode is None:
+                proc.terminate()
+            await proc.wait()
+
+    return handler
+
+
+def make_storage_dir(path, big_files, big_size, small_files):
+    os.makedirs(os.path.join(path, 'sub'))
+    for i in range(big_files):
+        with open(os.path.join(path, 'big{}.bin'.format(i)), 'wb') as f:
+            f.write(os.urandom(big_size << 20))
+    for i in range(small_files):
+        with open(os.path.join(path, 'sub/small{}.txt'.format(i)),
+                  'wb') as f:
+            f.write(b'hello, world\n' * 50)
+
+
+async def download(client, url, query):
+    start_time = time.perf_counter()
+    resp = await client.get(url, params=query)
+    if resp.status != 200:
+        raise RuntimeError('HTTP {}: {}'.format(
+            resp.status, await resp.text()))
+    size = 0
+    while True:
+        chunk = await resp.content.read(1 << 20)
+        if not chunk:
+            break
+        size += len(chunk)
+    return time.perf_counter() - start_time, size
+
+
+async def run(mongo_url, storage_root, repeat, query):
+    loop = asyncio.get_event_loop()
+    coll = open_collection(mongo_url, 'bench_tarball')
+    await coll.delete_many({})
+    mldb = MLDB(coll)
+    id = await mldb.create(
+        'bench', {'storage_dir': os.path.join(storage_root, 'exp')})
+
+    app = web.Application()
+    ApiV1(mldb, FileStoreManager(storage_root, loop)).bind(app)
+    app.router.add_get('/_bench/subprocess_tarball/{id}',
+                       make_subprocess_tarball_handler(mldb))
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        pipelines = [('in-process', '/v1/_tarball/{}'.format(id), query)]
+        if not query:
+            # the former pipeline does not support compression
+            pipelines.insert(
+                0, ('subprocess', '/_bench/subprocess_tarball/{}'.format(id),
+                    {}))
+        for name, url, params in pipelines:
+            results = [await download(client, url, params)
+                       for _ in range(repeat)]
+            seconds, size = min(results)
+            click.echo('{:<10s}: {:.1f} MiB in {:.0f} ms: {:.0f} MiB/s'.
+                       format(name, size / 1048576., seconds * 1000,
+                              size / 1048576. / seconds))
+    finally:
+        await client.close()
+        await coll.delete_many({})
+
+
+@click.command()
+@click.option('--mongo-url', default=None,
+              help='MongoDB URL.  If not specified, use an in-memory '
+                   'mock database.')
+@click.option('--big-files', default=16, type=int,
+              help='Number of big random files.')
+@click.option('--big-size', default=16, type=int,
+              help='Size of each big random file, in MiB.')
+@click.option('--small-files', default=2000, type=int,
+              help='Number of small text files.')
+@click.option('--compression', default=None,
+              help='Compression of the tarball, e.g., "gzip".')
+@click.option('--level', default=None, type=int,
+              help='Compression level of the tarball.')
+@click.option('--repeat', default=3, type=int,
+              help='Number of times to download the tarball.')
+def main(mongo_url, big_files, big_size, small_files, compression, level,
+         repeat):
+    query = {}
+    if compression is not None:
+        query['compression'] = compression
+    if level is not None:
+        query['level'] = str(level)
+
+    storage_root = tempfile.mkdtemp()
+    try:
+        make_storage_dir(os.path.join(storage_root, 'exp'), big_files,
+                         big_size, small_files)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(mongo_url, storage_root, repeat, query))
+    finally:
+        shutil.rmtree(storage_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,35 @@
 import asyncio
+import codecs
 import functools
 import json
 import math
 import mimetypes
 import os
 import pymongo
-import sys
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
 from logging import getLogger
 
 from aiohttp import web, ClientSession
-
+from bson import json_util
+from pymongo.errors import ExecutionTimeout
+
+from mlstorage_server.archive import (ARCHIVE_FORMATS, COMPRESSIONS,
+                                      check_archive_options,
+                                      check_compression,
+                                      normalize_archive_paths,
+                                      stream_from_executor, write_tar,
+                                      write_zip)
+from mlstorage_server.changefeed import ChangeFeed
+from mlstorage_server.deletion import DeletionWorker
+from mlstorage_server.heartbeat import HeartbeatWriter
 from mlstorage_server.query import (build_filter_dict_from_query_string,
+                                    is_text_search, query_cache,
                                     BadQueryError)
 from mlstorage_server.schema import validate_experiment_id
-from mlstorage_server.mldb import MLDB
-from mlstorage_server.utils import query_string_get, path_info_get, JsonEncoder
+from mlstorage_server.mldb import MLDB, normalize_sort_by, encode_page_token
+from mlstorage_server.utils import (query_string_get, path_info_get,
+                                    JsonEncoder, TTLCache)
 
 __all__ = ['ApiV1']
 
@@ -33,6 +47,97 @@ def query_string_get_switch(request, name, default_value=False):
         return default_value
 
 
+def query_string_get_fields(request, name):
+    value = query_string_get(request, name, None)
+    if value is not None:
+        value = [('_id' if f == 'id' else f)
+                 for f in (f.strip() for f in value.split(',')) if f]
+    return value
+
+
+def build_projection(fields=None, exclude=None, required=()):
+    """
+    Build a MongoDB projection from the list of `fields` to include, or
+    the list of fields to `exclude`.
+
+    Args:
+        fields (list[str]): The fields to include.
+        exclude (list[str]): The fields to exclude.  Ignored if `fields`
+            is specified, since MongoDB does not allow to mix inclusion
+            and exclusion in one projection.
+        required (Iterable[str]): The fields which must be fetched.
+
+    Returns:
+        dict[str, int] or None: The projection, or :obj:`None` if all
+            fields should be fetched.
+    """
+    def is_required(f):
+        return any(f == r or r.startswith(f + '.') for r in required)
+
+    if fields:
+        projection = {f: 1 for f in fields}
+        projection.update({r: 1 for r in required})
+        # a field and its sub-field cannot be both included
+        for f in list(projection):
+            if any(f.startswith(g + '.') for g in projection):
+                projection.pop(f)
+        return projection
+    if exclude:
+        projection = {f: 0 for f in exclude if not is_required(f)}
+        return projection or None
+    return None
+
+
+def get_doc_projection(request):
+    # the storage dir is always fetched, since it is required by
+    # `add_storage_dir`
+    return build_projection(
+        query_string_get_fields(request, 'fields'),
+        query_string_get_fields(request, 'exclude'),
+        required=['storage_dir']
+    )
+
+
+async def get_query_filter(request):
+    """
+    Get the filter dict for querying experiments from `request`.
+
+    GET requests query all experiments.  POST requests with "text/plain"
+    content type take the body as a query string, while others take the
+    body as a JSON filter dict.
+
+    The all-field phrases in the query string are searched in the text
+    index by default.  If `search=regex`, they will instead be matched
+    against each field, which scans the whole collection.
+
+    Args:
+        request (web.Request): The request object.
+
+    Returns:
+        dict: The filter dict.
+
+    Raises:
+        BadQueryError: If the query string is a bad query.
+    """
+    search = query_string_get(request, 'search', 'text', str)
+    if search not in ('text', 'regex'):
+        raise web.HTTPBadRequest()
+
+    if request.method == 'GET':
+        filter_ = {}
+    elif request.headers.get('Content-Type', '').startswith('text/plain'):
+        filter_ = await request.text()
+    else:
+        filter_ = await request.json()
+
+    # build filter dict from query string
+    if isinstance(filter_, str):
+        filter_ = build_filter_dict_from_query_string(
+            filter_, full_text=(search == 'text'))
+        getLogger(__name__).info('Filter: %s', filter_)
+    return filter_
+
+
 async def get_doc_or_error(mldb, store_mgr, experiment_id, error_class=None):
     doc = await mldb.get(experiment_id)
     if doc is None:
@@ -44,12 +149,25 @@ async def get_doc_or_error(mldb, store_mgr, experiment_id, error_class=None):
     return add_storage_dir(store_mgr, doc)
 
 
-async def get_file_store(request, mldb, store_mgr):
-    id = path_info_get(request, 'id', validator=validate_experiment_id)
-    doc = await get_doc_or_error(
-        mldb, store_mgr, id, web.HTTPNotFound)
-    store = await store_mgr.open(id, doc)
-    return store
+def batch_item_error(ex):
+    if isinstance(ex, KeyError):
+        status = 404
+    elif isinstance(ex, (ValueError, TypeError)):
+        status = 400
+    else:
+        status = 500
+    message = str(ex.args[0]) if ex.args else ex.__class__.__name__
+    return {'error': {'status': status, 'message': message}}
+
+
+async def get_batch_body(request, max_size):
+    items = await request.json()
+    if not isinstance(items, list):
+        raise ValueError('The request body must be a JSON array.')
+    if len(items) > max_size:
+        raise ValueError('At most {} items are allowed in a batch.'.
+                         format(max_size))
+    return items
 
 
 def file_entry_to_dict(entry):
@@ -64,6 +182,20 @@ def file_entry_to_dict(entry):
     return ret
 
 
+def deletion_job_to_dict(job):
+    experiments = job.get('experiments') or []
+    return {
+        'id': job['_id'],
+        'experiment_id': job['experiment_id'],
+        'status': job['status'],
+        'create_time': job['create_time'],
+        'finish_time': job.get('finish_time'),
+        'experiments': [e['id'] for e in experiments],
+        'removed_count': len(job.get('removed', ())),
+        'errors': job.get('errors', []),
+    }
+
+
 def zip_file_entry_to_dict(entry):
     ret = {
         'name': entry.name,
@@ -74,6 +206,103 @@ def zip_file_entry_to_dict(entry):
     return ret
 
 
+class FileRangeResponse(web.StreamResponse):
+    """
+    Response serving `size` bytes of a file from `offset`, e.g., an
+    uncompressed member of a zip archive, with HTTP Range support.
+
+    Like :class:`web.FileResponse`, the content is sent by
+    ``loop.sendfile`` where supported, otherwise it is read in chunks
+    on the default executor.
+    """
+
+    def __init__(self, path, offset, size, chunk_size=262144, etag=None,
+                 headers=None):
+        super().__init__(headers=headers)
+        self._path = path
+        self._offset = offset
+        self._size = size
+        self._chunk_size = chunk_size
+        self._etag_value = etag
+
+    def _get_range(self, request):
+        # returns `(start, count)` of the requested range, or :obj:`None`
+        # if the range cannot be satisfied
+        try:
+            http_range = request.http_range
+        except ValueError:
+            return None
+        start, end = http_range.start, http_range.stop
+        if start is None and end is None:
+            return 0, self._size
+        if start is None:
+            start = 0
+        elif start < 0 and end is None:  # the last `-start` bytes
+            start = max(self._size + start, 0)
+        if start >= self._size:
+            return None
+        end = self._size if end is None else min(end, self._size)
+        return start, max(end - start, 0)
+
+    async def _sendfile(self, request, writer, fobj, offset, count):
+        loop = asyncio.get_event_loop()
+        transport = request.transport
+        if not self.compression and transport is not None and \
+                hasattr(loop, 'sendfile'):
+            try:
+                await writer.drain()
+                await loop.sendfile(transport, fobj, offset, count)
+                return
+            except NotImplementedError:
+                pass
+
+        def _read(first, n):
+            if first:
+                fobj.seek(offset)
+            return fobj.read(n)
+
+        first = True
+        while count > 0:
+            chunk = await loop.run_in_executor(
+                None, _read, first, min(self._chunk_size, count))
+            if not chunk:
+                break
+            first = False
+            count -= len(chunk)
+            await writer.write(chunk)
+
+    async def prepare(self, request):
+        self.headers['Accept-Ranges'] = 'bytes'
+        if self._etag_value is not None:
+            self.headers['ETag'] = '"{}"'.format(self._etag_value)
+
+        requested = 'Range' in request.headers
+        span = self._get_range(request)
+        if span is None:
+            self.set_status(416)
+            self.headers['Content-Range'] = 'bytes */{}'.format(self._size)
+            self.content_length = 0
+            return await super().prepare(request)
+        start, count = span
+        if requested:
+            self.set_status(206)
+            self.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, start + count - 1, self._size)
+        self.content_length = count
+
+        loop = asyncio.get_event_loop()
+        fobj = await loop.run_in_executor(None, open, self._path, 'rb')
+        try:
+            writer = await super().prepare(request)
+            if count > 0 and request.method != 'HEAD':
+                await self._sendfile(request, writer, fobj,
+                                     self._offset + start, count)
+                await self.write_eof()
+        finally:
+            await loop.run_in_executor(None, fobj.close)
+        return writer
+
+
 def strict_dumps(obj, dumps):
     def sub_filter(o):
         if isinstance(o, dict):
@@ -88,6 +317,35 @@ def strict_dumps(obj, dumps):
     return dumps(sub_filter(json.loads(dumps(obj))))
 
 
+def make_json_dumps(request, pretty=None):
+    """
+    Make the JSON serializer according to the GET parameters of `request`.
+
+    Args:
+        request (web.Request): The request object.
+        pretty (bool): Whether or not to generate human readable JSON text?
+            If not specified, will be determined by `pretty` parameter.
+
+    Returns:
+        (any) -> str: The JSON serializer.
+    """
+    if pretty is None:
+        pretty = query_string_get_switch(request, 'pretty', False)
+    use_timestamp = query_string_get_switch(request, 'timestamp', False)
+    strict = query_string_get_switch(request, 'strict', False)
+    dumps = functools.partial(
+        json.dumps,
+        cls=JsonEncoder,
+        indent=2 if pretty else None,
+        sort_keys=pretty,
+        separators=(', ', ': ') if pretty else (',', ':'),
+        use_timestamp=use_timestamp
+    )
+    if strict:
+        dumps = functools.partial(strict_dumps, dumps=dumps)
+    return dumps
+
+
 def json_api(method):
     """
     Wrap `method` as a JSON API endpoint.
@@ -101,6 +359,9 @@ def json_api(method):
         async def xxx(self, request):
             ...
 
+    Additional response headers can be specified by `method` by setting
+    ``request['response_headers']`` to a dict.
+
     Raises:
         web.HTTPNotFound: If `method` raises :class:`KeyError`.
         web.HTTPBadRequest: If `method` raises :class:`ValueError` or
@@ -108,19 +369,7 @@ def json_api(method):
     """
     @functools.wraps(method)
     async def wrapper(self, request):
-        pretty = query_string_get_switch(request, 'pretty', False)
-        use_timestamp = query_string_get_switch(request, 'timestamp', False)
-        strict = query_string_get_switch(request, 'strict', False)
-        dumps = functools.partial(
-            json.dumps,
-            cls=JsonEncoder,
-            indent=2 if pretty else None,
-            sort_keys=pretty,
-            separators=(', ', ': ') if pretty else (',', ':'),
-            use_timestamp=use_timestamp
-        )
-        if strict:
-            dumps = functools.partial(strict_dumps, dumps=dumps)
+        dumps = make_json_dumps(request)
         try:
             ret = await method(self, request)
         except (KeyError, FileNotFoundError):
@@ -129,7 +378,8 @@ def json_api(method):
             raise web.HTTPBadRequest()
         else:
             if not isinstance(ret, (web.Response, web.StreamResponse)):
-                ret = web.json_response(ret, dumps=dumps)
+                ret = web.json_response(
+                    ret, dumps=dumps, headers=request.get('response_headers'))
         return ret
     return wrapper
 
@@ -149,6 +399,14 @@ class ApiV1(object):
         """
         self._mldb = mldb
         self._store_mgr = store_mgr
+        self._facets_cache = TTLCache(
+            self.FACETS_CACHE_SIZE, self.FACETS_CACHE_TTL)
+        self._heartbeat_writer = HeartbeatWriter(mldb)
+        self._deletion_worker = DeletionWorker(mldb, store_mgr)
+        self._storage_dir_cache = TTLCache(
+            self.STORAGE_DIR_CACHE_SIZE, self.STORAGE_DIR_CACHE_TTL)
+        self._change_feed = ChangeFeed(mldb)
+        self._archive_executor = None
 
     @property
     def mldb(self):
@@ -158,6 +416,31 @@ class ApiV1(object):
     def store_mgr(self):
         return self._store_mgr
 
+    @property
+    def heartbeat_writer(self):
+        return self._heartbeat_writer
+
+    @property
+    def deletion_worker(self):
+        return self._deletion_worker
+
+    @property
+    def storage_dir_cache(self):
+        return self._storage_dir_cache
+
+    @property
+    def change_feed(self):
+        return self._change_feed
+
+    @property
+    def archive_executor(self):
+        # archives are written by a dedicated executor, such that slow
+        # downloads cannot starve the file operations of `store_mgr`
+        if self._archive_executor is None:
+            self._archive_executor = ThreadPoolExecutor(
+                max_workers=self.ARCHIVE_MAX_WORKERS)
+        return self._archive_executor
+
     def bind(self, app):
         """
         Bind this handler to the given `app`.
@@ -173,26 +456,59 @@ class ApiV1(object):
         app.add_routes([
             # GET handlers for experiments
             web.get(url('/_query'), self.handle_query),
+            web.get(url('/_count'), self.handle_count),
+            web.get(url('/_explain'), self.handle_explain),
+            web.get(url('/_aggregate'), self.handle_aggregate),
+            web.get(url('/_facets'), self.handle_facets),
+            web.get(url('/_cache_stats'), self.handle_cache_stats),
             web.get(url('/_get/{id}'), self.handle_get),
+            web.get(url('/_subscribe'), self.handle_subscribe),
+            web.get(url('/_batch_get'), self.handle_batch_get),
             web.get(url('/_tarball/{id}'), self.handle_tarball),
 
             # POST handlers for experiments
             web.post(url('/_heartbeat/{id}'), self.handle_heartbeat),
             web.post(url('/_delete/{id}'), self.handle_delete),
+            web.get(url('/_delete_job/{id}'), self.handle_delete_job),
             web.post(url('/_query'), self.handle_query),
+            web.post(url('/_count'), self.handle_count),
+            web.post(url('/_explain'), self.handle_explain),
+            web.post(url('/_aggregate'), self.handle_aggregate),
+            web.post(url('/_facets'), self.handle_facets),
             web.post(url('/_create'), self.handle_create),
+            web.post(url('/_batch_get'), self.handle_batch_get),
+            web.post(url('/_batch_create'), self.handle_batch_create),
+            web.post(url('/_batch_update'), self.handle_batch_update),
             web.post(url('/_update/{id}'), self.handle_update),
             web.post(url('/_update_fs_size/{id}'), self.handle_update_fs_size),
             web.post(url('/_set_finished/{id}'), self.handle_set_finished),
             web.post(url('/_kill/{id}'), self.handle_kill),
+            web.post(url('/_archive/{id}'), self.handle_archive),
 
             # GET handlers for files
             web.get(url('/_listdir/{id}'), self.handle_listdir),
             web.get(url('/_listdir/{id}/{path}'), self.handle_listdir),
             web.get(url('/_listzip/{id}/{path}'), self.handle_listzip),
+            web.get(url('/_archive/{id}'), self.handle_archive),
+            web.get(url('/_archive/{id}/{path}'), self.handle_archive),
             web.get(url('/_getfile/{id}/{path}'), self.handle_getfile),
+            web.get(url('/_tail/{id}/{path}'), self.handle_tail),
             web.get(url('/_getzipentry/{id}/{path}'), self.handle_getzipentry),
         ])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+    async def _on_startup(self, app):
+        # resume the deletion jobs left by previous runs
+        self.deletion_worker.start()
+
+    async def _on_cleanup(self, app):
+        await self.heartbeat_writer.close()
+        await self.deletion_worker.close()
+        await self.change_feed.close()
+        if self._archive_executor is not None:
+            self._archive_executor.shutdown(wait=False)
+            self._archive_executor = None
 
     NOT_CORE_FIELDS = ['exc_info']
 
@@ -202,24 +518,76 @@ class ApiV1(object):
         API endpoint for querying experiments.
 
         Usage:
-            GET /v1/_query[?skip=0&limit=10&sort=[+/-]field&pretty=0]
-            POST /v1/_query[?skip=0&limit=10&sort=[+/-]field&pretty=0] {...}
+            GET /v1/_query[?skip=0&limit=10&sort=[+/-]field&after=...]
+            POST /v1/_query[?skip=0&limit=10&sort=[+/-]field&after=...] {...}
+
+        The fetched fields can be selected by `fields=a,b.c,...`, or
+        `exclude=a,b.c,...`.  `core=1` excludes the not-core fields (i.e.,
+        "exc_info").  The selection is done by a MongoDB projection, such
+        that the unselected fields are never transferred from the database.
+
+        If `limit` is specified and a full page is returned, the page token
+        of the last document will be sent in the "X-Next-Page" header.
+        Pass it as `after` to fetch the next page with the same filter and
+        sort ordering, which is much cheaper than `skip` on deep pages.
+
+        If the filter contains a ``$text`` search (see `search` argument of
+        :func:`get_query_filter`) and `sort` is not specified, the documents
+        will be sorted by their relevance "text_score", and `after` is not
+        supported.
+
+        If `format=ndjson`, the documents will be streamed as newline
+        delimited JSON, one document per line, as soon as they are fetched
+        from MongoDB in batches of `batch_size` documents.  This mode is
+        suggested for fetching a large number of documents.
+
+        If `explain=1`, the query plan will be returned instead of the
+        documents, see `/v1/_explain`.
 
         Returns:
             List of experiment documents.
         """
+        explain = query_string_get_switch(request, 'explain', False)
+        return await self._query(request, explain=explain)
+
+    @json_api
+    async def handle_explain(self, request):
+        """
+        API endpoint for explaining the query plan of `/v1/_query`.
+
+        Usage:
+            GET /v1/_explain[?skip=0&limit=10&sort=[+/-]field&after=...]
+            POST /v1/_explain[?skip=0&limit=10&sort=[+/-]field&after=...] {...}
+
+        Returns:
+            dict: The winning plan ("winning_plan"), the indexes it uses
+                ("indexes"), the number of returned documents ("n_returned"),
+                index keys and documents examined ("keys_examined" and
+                "docs_examined"), and the execution time in milliseconds
+                ("execution_time_ms").
+        """
+        return await self._query(request, explain=True)
+
+    async def _query(self, request, explain):
         skip = query_string_get(request, 'skip', 0, int)
         limit = query_string_get(request, 'limit', None, int)
         sort_by = query_string_get(request, 'sort', None, str)
+        after = query_string_get(request, 'after', None, str)
         core_fields_only = query_string_get_switch(request, 'core', False)
+        fields = query_string_get_fields(request, 'fields')
+        exclude = query_string_get_fields(request, 'exclude') or []
+        output_format = query_string_get(request, 'format', 'json', str)
+        batch_size = query_string_get(request, 'batch_size', None, int)
 
+        if output_format not in ('json', 'ndjson'):
+            raise web.HTTPBadRequest()
         if core_fields_only:
-            def filter_fields(doc):
-                return {k: v for k, v in doc.items()
-                        if k not in self.NOT_CORE_FIELDS}
-        else:
-            def filter_fields(doc):
-                return doc
+            exclude.extend(self.NOT_CORE_FIELDS)
+            if fields:
+                fields = [f for f in fields
+                          if f.split('.', 1)[0] not in self.NOT_CORE_FIELDS]
+                if not fields:
+                    raise web.HTTPBadRequest()
 
         if sort_by:
             order = pymongo.ASCENDING
@@ -235,33 +603,280 @@ class ApiV1(object):
         else:
             sort_by = None
 
-        if request.method == 'GET':
-            filter_ = {}
-        elif request.headers.get('Content-Type', '').startswith('text/plain'):
-            filter_ = await request.text()
-        else:
-            filter_ = await request.json()
+        try:
+            filter_ = await get_query_filter(request)
+        except BadQueryError:
+            if explain:
+                raise web.HTTPBadRequest()
+            getLogger(__name__).info('Bad query, return empty response.')
+            if output_format == 'ndjson':
+                return web.Response(content_type='application/x-ndjson')
+            return []
+
+        # sort by relevance for text search
+        text_score_sort = is_text_search(filter_) and not sort_by
+        if text_score_sort:
+            sort_by = [('text_score', {'$meta': 'textScore'})]
+
+        # the storage dir and the sort keys are always fetched, since they
+        # are required by `add_storage_dir` and `encode_page_token`
+        normalized_sort_by = normalize_sort_by(sort_by or MLDB.DEFAULT_SORT_BY)
+        projection = build_projection(
+            fields, exclude,
+            required=['storage_dir'] + [k for k, d in normalized_sort_by
+                                        if not isinstance(d, dict)]
+        )
+        if text_score_sort:
+            projection = dict(projection or ())
+            projection['text_score'] = {'$meta': 'textScore'}
 
-        # build filter dict from query string
-        if isinstance(filter_, str):
+        if explain:
             try:
-                filter_ = build_filter_dict_from_query_string(filter_)
-                getLogger(__name__).info('Filter: %s', filter_)
-            except BadQueryError:
-                getLogger(__name__).info('Bad query, return empty response.')
-                return []
+                return await self.mldb.explain_docs(
+                    filter_, skip, limit, sort_by=sort_by, after=after,
+                    projection=projection
+                )
+            except ValueError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to explain the query.', exc_info=True)
+                raise web.HTTPInternalServerError()
+
+        if output_format == 'ndjson':
+            return await self._stream_query(
+                request, filter_, skip, limit, sort_by, after, projection,
+                batch_size=batch_size or self.NDJSON_BATCH_SIZE
+            )
 
         data = []
+        next_page = None
         try:
             async for doc in self.mldb.iter_docs(
-                    filter_, skip, limit, sort_by=sort_by):
-                data.append(filter_fields(add_storage_dir(self.store_mgr, doc)))
+                    filter_, skip, limit, sort_by=sort_by, after=after,
+                    projection=projection):
+                # encode the token before `add_storage_dir` overwrites the
+                # stored "storage_dir", which might be a sort key
+                if limit and len(data) + 1 >= limit and not text_score_sort:
+                    next_page = encode_page_token(doc, normalized_sort_by)
+                data.append(add_storage_dir(self.store_mgr, doc))
+            if next_page is not None:
+                request['response_headers'] = {'X-Next-Page': next_page}
             return data
+        except ValueError:
+            raise
         except Exception:
             getLogger(__name__).warning(
                 'Failed to load experiment.', exc_info=True)
             raise web.HTTPInternalServerError()
 
+    @json_api
+    async def handle_aggregate(self, request):
+        """
+        API endpoint for computing the statistics of experiment metrics.
+
+        Usage:
+            GET /v1/_aggregate?metrics=result.a,...[&group_by=config.lr
+                &percentiles=25,50,75&max_groups=1000]
+            POST /v1/_aggregate?metrics=result.a,...[&group_by=config.lr
+                &percentiles=25,50,75&max_groups=1000] {...}
+
+        The filter is specified in the same way as `/v1/_query`.
+        The percentiles of each group are computed from a capped number
+        of its metric values, reported as "sampled", see
+        :meth:`MLDB.aggregate_metrics`.
+
+        Returns:
+            list[dict]: The statistics of each group, ordered by the group
+                key, ``{"group": ..., "count": ..., "metrics": {metric:
+                {"count": ..., "min": ..., "max": ..., "mean": ...,
+                "sampled": ..., "p25": ..., ...}}}``.
+        """
+        metrics = query_string_get_fields(request, 'metrics')
+        group_by = query_string_get(request, 'group_by', None, str)
+        percentiles = query_string_get(
+            request, 'percentiles', [25., 50., 75.],
+            lambda v: [float(q) for q in v.split(',') if q.strip()]
+        )
+        max_groups = query_string_get(request, 'max_groups', 1000, int)
+        if not metrics:
+            raise web.HTTPBadRequest()
+
+        try:
+            filter_ = await get_query_filter(request)
+        except BadQueryError:
+            getLogger(__name__).info('Bad query, return empty response.')
+            return []
+
+        try:
+            return await self.mldb.aggregate_metrics(
+                metrics, filter_, group_by=group_by, percentiles=percentiles,
+                max_groups=max_groups
+            )
+        except ValueError:
+            raise
+        except Exception:
+            getLogger(__name__).warning(
+                'Failed to aggregate experiments.', exc_info=True)
+            raise web.HTTPInternalServerError()
+
+    #: Default fields and limits of `/v1/_facets`
+    DEFAULT_FACETS = 'status,tags:10,exc_info.hostname:10,name:10'
+    #: Maximum number of cached `/v1/_facets` results
+    FACETS_CACHE_SIZE = 256
+    #: Seconds to cache the `/v1/_facets` results
+    FACETS_CACHE_TTL = 10
+
+    @json_api
+    async def handle_facets(self, request):
+        """
+        API endpoint for counting the most frequent values of fields.
+
+        Usage:
+            GET /v1/_facets[?facets=status,tags:10,exc_info.hostname:10]
+            POST /v1/_facets[?facets=status,tags:10,exc_info.hostname:10]
+                {...}
+
+        The filter is specified in the same way as `/v1/_query`.  Each facet
+        is a field name, optionally followed by the maximum number of values
+        to count (default 10).  The results are cached for a few seconds.
+
+        Returns:
+            dict[str, list[dict]]: The values and counts of each field,
+                in DESCENDING order of the counts, ``{field: [{"value": ...,
+                "count": ...}, ...]}``.
+        """
+        def parse_facets(value):
+            ret = {}
+            for f in value.split(','):
+                key, _, limit = f.strip().partition(':')
+                if key:
+                    ret[key] = int(limit) if limit else 10
+            return ret
+
+        facets = query_string_get(request, 'facets', self.DEFAULT_FACETS,
+                                  parse_facets)
+        if isinstance(facets, str):
+            facets = parse_facets(facets)
+        if not facets:
+            raise web.HTTPBadRequest()
+
+        try:
+            filter_ = await get_query_filter(request)
+        except BadQueryError:
+            getLogger(__name__).info('Bad query, return empty response.')
+            return {key: [] for key in facets}
+
+        cache_key = json_util.dumps([filter_, sorted(facets.items())],
+                                    sort_keys=True)
+        ret = self._facets_cache.get(cache_key)
+        if ret is None:
+            try:
+                ret = await self.mldb.facet_counts(facets, filter_)
+            except ValueError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to count the facets.', exc_info=True)
+                raise web.HTTPInternalServerError()
+            self._facets_cache.put(cache_key, ret)
+        request['response_headers'] = {
+            'Cache-Control': 'private, max-age={}'.format(
+                self.FACETS_CACHE_TTL)
+        }
+        return ret
+
+    #: Default MongoDB cursor batch size for streaming query results
+    NDJSON_BATCH_SIZE = 1000
+
+    async def _stream_query(self, request, filter_, skip, limit, sort_by,
+                            after, projection, batch_size):
+        dumps = make_json_dumps(request, pretty=False)
+        it = self.mldb.iter_docs(
+            filter_, skip, limit, sort_by=sort_by, after=after,
+            projection=projection, batch_size=batch_size
+        )
+
+        # close the generator (and thus the cursor) even if the client
+        # disconnects in the middle of the stream
+        try:
+            # fetch the first document before sending the response headers,
+            # such that errors in the query can still be reported properly
+            try:
+                first_doc = await it.__anext__()
+            except StopAsyncIteration:
+                return web.Response(content_type='application/x-ndjson')
+            except ValueError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to load experiment.', exc_info=True)
+                raise web.HTTPInternalServerError()
+
+            resp = web.StreamResponse(
+                headers={'Content-Type': 'application/x-ndjson'})
+            await resp.prepare(request)
+            await resp.write(
+                (dumps(add_storage_dir(self.store_mgr, first_doc)) + '\n').
+                encode('utf-8')
+            )
+            try:
+                async for doc in it:
+                    await resp.write(
+                        (dumps(add_storage_dir(self.store_mgr, doc)) + '\n').
+                        encode('utf-8')
+                    )
+            except Exception:
+                # the response has been started, thus the only way to report
+                # the error is to abort the connection
+                getLogger(__name__).warning(
+                    'Failed to stream experiments.', exc_info=True)
+                raise
+            await resp.write_eof()
+            return resp
+        finally:
+            await it.aclose()
+
+    @json_api
+    async def handle_count(self, request):
+        """
+        API endpoint for counting experiments.
+
+        Usage:
+            GET /v1/_count[?exact=0&maxTimeMS=...]
+            POST /v1/_count[?exact=0&maxTimeMS=...] {...}
+
+        The filter is specified in the same way as `/v1/_query`.  If there
+        is no filter, the count will be estimated from the collection
+        metadata, unless `exact=1`.  If `maxTimeMS` is specified and the
+        counting takes longer than it, 503 will be responded.
+
+        Returns:
+            dict: ``{"count": ..., "estimated": ...}``
+        """
+        exact = query_string_get_switch(request, 'exact', False)
+        max_time_ms = query_string_get(request, 'maxTimeMS', None, int)
+
+        try:
+            filter_ = await get_query_filter(request)
+        except BadQueryError:
+            getLogger(__name__).info('Bad query, return zero count.')
+            return {'count': 0, 'estimated': False}
+
+        estimated = not exact and not filter_
+        try:
+            count = await self.mldb.count_docs(
+                filter_, estimated=estimated, max_time_ms=max_time_ms)
+        except ExecutionTimeout:
+            getLogger(__name__).info('Counting exceeded maxTimeMS: %s',
+                                     filter_)
+            raise web.HTTPServiceUnavailable()
+        except Exception:
+            getLogger(__name__).warning(
+                'Failed to count experiments.', exc_info=True)
+            raise web.HTTPInternalServerError()
+        return {'count': count, 'estimated': estimated}
+
     @json_api
     async def handle_get(self, request):
         """
@@ -277,41 +892,108 @@ class ApiV1(object):
         return await get_doc_or_error(
             self.mldb, self.store_mgr, id, web.HTTPNotFound)
 
+    #: Seconds between two keep-alive comments of `/v1/_subscribe`
+    SUBSCRIBE_KEEPALIVE = 15
+
+    async def handle_subscribe(self, request):
+        """
+        API endpoint for subscribing to the changes of experiments, as a
+        stream of Server-Sent Events.
+
+        Usage:
+            GET /v1/_subscribe?ids=[id1],[id2],...
+
+        If `ids` is not specified, all experiments are watched.  Each event
+        is named by its "op", with the data ``{"op": ..., "id": ...,
+        "fields": {...}, "removed": [...]}``, see :class:`ChangeFeed`.
+        The clients should load the experiments first, then apply the
+        changed fields.  A "reload" event is sent, and the stream is
+        closed, if the client is too slow to consume the events.
+        """
+        try:
+            ids = [validate_experiment_id(i) for i in
+                   query_string_get(request, 'ids', '').split(',') if i]
+        except ValueError:
+            raise web.HTTPBadRequest()
+        dumps = make_json_dumps(request, pretty=False)
+        resp = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await resp.prepare(request)
+
+        subscription = self.change_feed.subscribe(ids)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(), self.SUBSCRIBE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await resp.write(b': keepalive\n\n')
+                    continue
+                if event is None:
+                    await resp.write(b'event: reload\ndata: {}\n\n')
+                    break
+                await resp.write('event: {}\ndata: {}\n\n'.format(
+                    event['op'], dumps(event)).encode('utf-8'))
+        finally:
+            self.change_feed.unsubscribe(subscription)
+        return resp
+
+    #: Maximum number of archives being written at the same time
+    ARCHIVE_MAX_WORKERS = 8
+
+    #: Number of bytes of each chunk of archive responses
+    ARCHIVE_CHUNK_SIZE = 262144
+
+    #: Maximum number of chunks buffered for each archive response
+    ARCHIVE_MAX_QUEUED = 8
+
     async def handle_tarball(self, request):
         """
         API endpoint for downloading all files of an experiment as a tarball.
 
         Usage:
-            GET /v1/_tarball/[id]
+            GET /v1/_tarball/[id][?compression=none|gzip|zstd&level=...]
+
+        The tarball is written in-process by a worker thread, and streamed
+        to the client as it is being written.  The worker thread is paused
+        while the client is not consuming the response, and stopped if the
+        client disconnects.  "zstd" compression requires the optional
+        `zstandard` package, i.e., the "zstd" extra of this package.
         """
         id = path_info_get(request, 'id', validator=validate_experiment_id)
-        doc = await get_doc_or_error(self.mldb, self.store_mgr, id,
-                                     error_class=web.HTTPNotFound)
-        root_path = doc['storage_dir']
-        if not os.path.isdir(root_path):
+        compression = query_string_get(request, 'compression', 'none')
+        level = query_string_get(request, 'level', None, int)
+        try:
+            check_compression(compression, level)
+        except ValueError as ex:
+            raise web.HTTPBadRequest(text=str(ex))
+        suffix, content_type, _ = COMPRESSIONS[compression]
+
+        root_path = await self._get_storage_dir(id)
+        if not (await self.store_mgr.loop.run_in_executor(
+                self.store_mgr.executor, os.path.isdir, root_path)):
             raise web.HTTPNotFound()
-        tar_script = os.path.join(
-            os.path.split(os.path.abspath(__file__))[0], 'tar.py')
-        proc = await asyncio.create_subprocess_exec(
-            sys.executable, tar_script, root_path, str(id),
-            stdout=asyncio.subprocess.PIPE
+
+        resp = web.StreamResponse(headers={
+            'Content-Type': content_type or 'application/x-tar',
+            'Content-Disposition': 'attachment; filename={}.tar{}'.format(
+                id, suffix)
+        })
+        await resp.prepare(request)
+        await stream_from_executor(
+            resp,
+            functools.partial(write_tar, root_path=root_path,
+                              arc_name=str(id), compression=compression,
+                              level=level),
+            self.archive_executor,
+            chunk_size=self.ARCHIVE_CHUNK_SIZE,
+            max_queued=self.ARCHIVE_MAX_QUEUED
         )
-        try:
-            resp = web.StreamResponse(headers={
-                'Content-Type': 'application/x-tar',
-                'Content-Disposition': 'attachment; filename={}.tar'.format(id)
-            })
-            await resp.prepare(request)
-            while True:
-                buf = await proc.stdout.read(8192)
-                if not buf:
-                    break
-                await resp.write(buf)
-            await resp.write_eof()
-        finally:
-            if proc.returncode is None:
-                proc.terminate()
-                _ = proc.wait()
+        await resp.write_eof()
+        return resp
 
     @json_api
     async def handle_heartbeat(self, request):
@@ -321,11 +1003,14 @@ class ApiV1(object):
         Usage:
             POST /v1/_heartbeat/[id]
 
+        The heartbeats are buffered and written to MongoDB in batches,
+        see :class:`HeartbeatWriter`.
+
         Returns:
             dict: An empty dict ``{}``.
         """
         id = path_info_get(request, 'id', validator=validate_experiment_id)
-        await self.mldb.set_heartbeat(id)
+        await self.heartbeat_writer.beat(id)
         return {}
 
     @json_api
@@ -345,21 +1030,115 @@ class ApiV1(object):
         id = await self.mldb.create(doc_fields['name'], doc_fields)
         return await get_doc_or_error(self.mldb, self.store_mgr, id)
 
+    #: Maximum number of items in a `/v1/_batch_*` request
+    BATCH_MAX_SIZE = 1000
+
+    async def _batch_docs(self, results):
+        # fetch the documents of successful items by one ``$in`` query
+        docs = await self.mldb.get_many(
+            [r for r in results if not isinstance(r, Exception)])
+        ret = []
+        for r in results:
+            if isinstance(r, Exception):
+                ret.append(batch_item_error(r))
+            elif r not in docs:
+                ret.append(batch_item_error(
+                    KeyError('Experiment not exist: {!r}'.format(r))))
+            else:
+                ret.append({'doc': add_storage_dir(self.store_mgr, docs[r])})
+        return ret
+
+    @json_api
+    async def handle_batch_get(self, request):
+        """
+        API endpoint for getting experiment documents in batch.
+
+        Usage:
+            GET /v1/_batch_get?ids=[id1],[id2],...
+            POST /v1/_batch_get [id1, id2, ...]
+
+        Returns:
+            A list of ``{"doc": ...}`` or ``{"error": {"status": ...,
+            "message": ...}}``, one for each of the requested IDs.
+        """
+        if request.method == 'GET':
+            ids = [i for i in query_string_get(request, 'ids', '').split(',')
+                   if i]
+            if len(ids) > self.BATCH_MAX_SIZE:
+                raise ValueError('Too many IDs.')
+        else:
+            ids = await get_batch_body(request, self.BATCH_MAX_SIZE)
+        results = []
+        for id in ids:
+            try:
+                results.append(validate_experiment_id(id))
+            except ValueError as ex:
+                results.append(ex)
+        return await self._batch_docs(results)
+
+    @json_api
+    async def handle_batch_create(self, request):
+        """
+        API endpoint for creating experiments in batch.
+
+        Usage:
+            POST /v1/_batch_create [{"name": ..., ...}, ...]
+
+        Returns:
+            A list of ``{"doc": ...}`` or ``{"error": {"status": ...,
+            "message": ...}}``, one for each of the requested experiments.
+        """
+        doc_fields_list = await get_batch_body(request, self.BATCH_MAX_SIZE)
+        results = await self.mldb.create_many(doc_fields_list)
+        return await self._batch_docs(results)
+
+    @json_api
+    async def handle_batch_update(self, request):
+        """
+        API endpoint for updating experiment documents in batch.
+
+        Usage:
+            POST /v1/_batch_update [{"id": ..., ...}, ...]
+
+        Returns:
+            A list of ``{"doc": ...}`` or ``{"error": {"status": ...,
+            "message": ...}}``, one for each of the requested updates.
+        """
+        items = await get_batch_body(request, self.BATCH_MAX_SIZE)
+        updates = []
+        for item in items:
+            if isinstance(item, dict):
+                updates.append((item.get('id', item.get('_id')), item))
+            else:
+                updates.append((None, None))
+        errors = await self.mldb.update_many(updates)
+        results = []
+        for (id, _), err in zip(updates, errors):
+            results.append(err if err is not None
+                           else validate_experiment_id(id))
+        self._invalidate_storage_dirs(
+            r for r in results if not isinstance(r, Exception))
+        return await self._batch_docs(results)
+
     @json_api
     async def handle_update(self, request):
         """
         API endpoint for updating experiment document.
 
         Usage:
-            POST /v1/_update/[id] {...}
+            POST /v1/_update/[id]?fields=...&exclude=... {...}
 
         Returns:
             The updated experiment document.
         """
         id = path_info_get(request, 'id', validator=validate_experiment_id)
         doc_fields = await request.json()
-        await self.mldb.update(id, doc_fields)
-        return await get_doc_or_error(self.mldb, self.store_mgr, id)
+        doc = await self.mldb.update(
+            id, doc_fields, return_doc=True,
+            projection=get_doc_projection(request)
+        )
+        self._invalidate_storage_dirs([id])
+        return add_storage_dir(self.store_mgr, doc)
 
     @json_api
     async def handle_update_fs_size(self, request):
@@ -367,7 +1146,7 @@ class ApiV1(object):
         API endpoint for updating the storage file system size.
 
         Usage:
-            POST /v1/_update_fs_size/[id]
+            POST /v1/_update_fs_size/[id]?fields=...&exclude=...
 
         Returns:
             The updated experiment document.
@@ -380,8 +1159,11 @@ class ApiV1(object):
             raise web.HTTPNotFound()
         store = await self.store_mgr.open(id, doc)
         fs_size = await store.compute_fs_size('/')
-        await self.mldb.update(id, {'storage_size': fs_size})
-        return await get_doc_or_error(self.mldb, self.store_mgr, id)
+        doc = await self.mldb.update(
+            id, {'storage_size': fs_size}, return_doc=True,
+            projection=get_doc_projection(request)
+        )
+        return add_storage_dir(self.store_mgr, doc)
 
     @json_api
     async def handle_set_finished(self, request):
@@ -389,7 +1171,8 @@ class ApiV1(object):
         API endpoint for setting the status of an experiment to be finished.
 
         Usage:
-            POST /v1/_set_finished/[id] {"status": ..., ...}
+            POST /v1/_set_finished/[id]?fields=...&exclude=...
+                {"status": ..., ...}
 
         Returns:
             The updated experiment document.
@@ -398,8 +1181,12 @@ class ApiV1(object):
         doc_fields = await request.json()
         if 'status' not in doc_fields:
             raise web.HTTPBadRequest()
-        await self.mldb.set_finished(id, doc_fields['status'], doc_fields)
-        return await get_doc_or_error(self.mldb, self.store_mgr, id)
+        doc = await self.mldb.set_finished(
+            id, doc_fields['status'], doc_fields, return_doc=True,
+            projection=get_doc_projection(request)
+        )
+        self._invalidate_storage_dirs([id])
+        return add_storage_dir(self.store_mgr, doc)
 
     @json_api
     async def handle_kill(self, request):
@@ -443,34 +1230,103 @@ class ApiV1(object):
     @json_api
     async def handle_delete(self, request):
         """
-        API endpoint for deleting an experiment.
+        API endpoint for deleting an experiment and all its children.
+
+        The experiments are marked as deleted at once, while their storage
+        directories and documents are removed by a background job.
 
         Usage:
             POST /v1/_delete/[id]
 
         Returns:
-            The IDs of the deleted experiments.
+            HTTP 202, with the deletion job, see `/v1/_delete_job`.
         """
-        async def delete_one(the_id):
-            doc = await self.mldb.get(the_id)
-            try:
-                await self.store_mgr.delete(the_id, doc)
-            except Exception:
-                getLogger(__name__).debug(
-                    'Failed to delete the storage for experiment %s', the_id,
-                    exc_info=True
-                )
-
         id = path_info_get(request, 'id', validator=validate_experiment_id)
-        delete_ids = sorted(set(await self.mldb.mark_delete(id)))
-        if not delete_ids:
+        job = await self.deletion_worker.submit(id)
+        delete_ids = [e['id'] for e in job['experiments']]
+        self.heartbeat_writer.forget(delete_ids)
+        self._invalidate_storage_dirs(delete_ids)
+        return web.json_response(
+            deletion_job_to_dict(job), status=202,
+            dumps=make_json_dumps(request)
+        )
+
+    @json_api
+    async def handle_delete_job(self, request):
+        """
+        API endpoint for getting the status of a deletion job.
+
+        Usage:
+            GET /v1/_delete_job/[job_id]
+
+        Returns:
+            ``{"id": ..., "experiment_id": ..., "status": ...,
+            "create_time": ..., "finish_time": ..., "experiments": [...],
+            "removed_count": ..., "errors": [...]}``, where "status" is
+            one of "PENDING", "RUNNING" and "COMPLETED".
+        """
+        job_id = path_info_get(request, 'id', validator=validate_experiment_id)
+        job = await self.deletion_worker.get(job_id)
+        if job is None:
             raise web.HTTPNotFound()
-        await asyncio.gather(*[
-            delete_one(delete_id)
-            for delete_id in delete_ids
-        ])
-        await self.mldb.complete_deletion(delete_ids)
-        return delete_ids
+        return deletion_job_to_dict(job)
+
+    #: Maximum number of cached experiment storage dirs
+    STORAGE_DIR_CACHE_SIZE = 10000
+    #: Seconds to cache the experiment storage dirs
+    STORAGE_DIR_CACHE_TTL = 10
+
+    async def _get_storage_dir(self, id):
+        # the cache entries are `(storage_dir, deleted)`, where non-existing
+        # experiments are cached as `(None, True)`
+        entry = self.storage_dir_cache.get(id)
+        if entry is None:
+            doc = await self.mldb.get(
+                id, projection={'storage_dir': 1, 'deleted': 1},
+                include_deleted=True
+            )
+            if doc is None:
+                entry = (None, True)
+            else:
+                entry = (self.store_mgr.get_path(id, doc),
+                         bool(doc.get('deleted', False)))
+            self.storage_dir_cache.put(id, entry)
+        storage_dir, deleted = entry
+        if deleted:
+            raise web.HTTPNotFound()
+        return storage_dir
+
+    def _invalidate_storage_dirs(self, id_list):
+        for id in id_list:
+            self.storage_dir_cache.pop(validate_experiment_id(id))
+
+    async def _open_file_store(self, request):
+        id = path_info_get(request, 'id', validator=validate_experiment_id)
+        storage_dir = await self._get_storage_dir(id)
+        return await self.store_mgr.open(id, {'storage_dir': storage_dir})
+
+    @json_api
+    async def handle_cache_stats(self, request):
+        """
+        API endpoint for getting the statistics of the in-process caches.
+
+        Usage:
+            GET /v1/_cache_stats
+
+        Returns:
+            ``{[cache]: {"size": ..., "hits": ..., "misses": ...}}``.
+        """
+        caches = {
+            'storage_dir': self.storage_dir_cache,
+            'facets': self._facets_cache,
+            'query': query_cache,
+            'zip_index': self.store_mgr.zip_index_cache,
+        }
+        return {
+            name: {'size': len(cache), 'hits': cache.hits,
+                   'misses': cache.misses}
+            for name, cache in caches.items()
+        }
 
     @json_api
     async def handle_listdir(self, request):
@@ -484,7 +1340,7 @@ class ApiV1(object):
             The list of entries.
         """
         path = path_info_get(request, 'path', '')
-        store = await get_file_store(request, self.mldb, self.store_mgr)
+        store = await self._open_file_store(request)
         ret = []
         for e in (await store.listdir_and_stat(path)):
             ret.append(file_entry_to_dict(e))
@@ -496,15 +1352,22 @@ class ApiV1(object):
         API endpoint for listing a zip archive.
 
         Usage:
-            GET /v1/_listzip/[id]/[path]
+            GET /v1/_listzip/[id]/[path]?prefix=...&skip=...&limit=...
 
         Returns:
-            The list of entries.
+            The list of entries, whose names start with `prefix` if
+            specified, paged by `skip` and `limit`.
         """
         path = path_info_get(request, 'path', '')
-        store = await get_file_store(request, self.mldb, self.store_mgr)
+        prefix = query_string_get(request, 'prefix', None, str)
+        skip = query_string_get(request, 'skip', 0, int)
+        limit = query_string_get(request, 'limit', None, int)
+        if skip < 0 or (limit is not None and limit < 0):
+            raise web.HTTPBadRequest()
+        store = await self._open_file_store(request)
         ret = []
-        for e in (await store.list_zip_and_stat(path)):
+        for e in (await store.list_zip_and_stat(
+                path, prefix=prefix, skip=skip, limit=limit)):
             ret.append(zip_file_entry_to_dict(e))
         return ret
 
@@ -520,7 +1383,7 @@ class ApiV1(object):
             The file content.
         """
         path = path_info_get(request, 'path', '')
-        store = await get_file_store(request, self.mldb, self.store_mgr)
+        store = await self._open_file_store(request)
         if not (await store.isfile(path)):
             raise web.HTTPNotFound()
         headers = {}
@@ -530,6 +1393,198 @@ class ApiV1(object):
             headers['Content-Type'] = 'text/plain; charset=utf-8'
         return web.FileResponse(store.resolve_path(path), headers=headers)
 
+    #: Default and maximum number of bytes returned by `/v1/_tail`
+    TAIL_MAX_BYTES = 1048576
+    TAIL_MAX_BYTES_LIMIT = 16777216
+    #: Maximum seconds of `/v1/_tail` long-polls
+    TAIL_MAX_WAIT = 60
+    #: Seconds between two checks of the file growth by `/v1/_tail`
+    TAIL_POLL_INTERVAL = 0.5
+
+    @json_api
+    async def handle_tail(self, request):
+        """
+        API endpoint for following a growing file, e.g., "console.log".
+
+        Usage:
+            GET /v1/_tail/[id]/[path]?offset=...&lines=...&max_bytes=...
+                &wait=...&format=raw|sse
+
+        Read at most `max_bytes` bytes from the byte `offset`, or if `offset`
+        is not specified, the last `lines` lines.  If the file has been
+        truncated below `offset`, read from the beginning.  With `wait`,
+        the request waits at most this number of seconds for the file to
+        grow beyond `offset` (long-poll).
+
+        Returns:
+            The raw bytes, with headers "X-Tail-Offset" (where the bytes
+            start), "X-Tail-Next-Offset" (the `offset` of the next request)
+            and "X-Tail-Size" (the file size).  If `format` is "sse", the
+            file is followed until the client disconnects, by a stream of
+            Server-Sent Events named "data", with the data ``{"offset": ...,
+            "next_offset": ..., "size": ..., "text": ...}``.
+        """
+        path = path_info_get(request, 'path', '')
+        offset = query_string_get(request, 'offset', None, int)
+        lines = query_string_get(request, 'lines', None, int)
+        max_bytes = min(
+            query_string_get(request, 'max_bytes', self.TAIL_MAX_BYTES, int),
+            self.TAIL_MAX_BYTES_LIMIT
+        )
+        wait = min(query_string_get(request, 'wait', 0., float),
+                   self.TAIL_MAX_WAIT)
+        output_format = query_string_get(request, 'format', 'raw', str)
+        if output_format not in ('raw', 'sse') or max_bytes <= 0 or \
+                (offset is not None and offset < 0):
+            raise web.HTTPBadRequest()
+
+        store = await self._open_file_store(request)
+        if not (await store.isfile(path)):
+            raise web.HTTPNotFound()
+        if output_format == 'sse':
+            return await self._stream_tail(
+                request, store, path, offset, lines, max_bytes)
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + wait
+        while True:
+            start, data, size = await store.read_tail(
+                path, offset=offset, lines=lines, max_bytes=max_bytes)
+            if data or start != offset or loop.time() >= deadline:
+                break
+            await asyncio.sleep(self.TAIL_POLL_INTERVAL)
+
+        if path.endswith('.log'):
+            content_type, charset = 'text/plain', 'utf-8'
+        else:
+            content_type, charset = 'application/octet-stream', None
+        return web.Response(
+            body=data, content_type=content_type, charset=charset,
+            headers={
+                'X-Tail-Offset': str(start),
+                'X-Tail-Next-Offset': str(start + len(data)),
+                'X-Tail-Size': str(size),
+                'Cache-Control': 'no-cache',
+            }
+        )
+
+    async def _stream_tail(self, request, store, path, offset, lines,
+                           max_bytes):
+        dumps = make_json_dumps(request, pretty=False)
+        resp = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await resp.prepare(request)
+
+        # decode incrementally, since a chunk may end within a character
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        loop = asyncio.get_event_loop()
+        last_write = loop.time()
+        while True:
+            try:
+                start, data, size = await store.read_tail(
+                    path, offset=offset, lines=lines, max_bytes=max_bytes)
+            except FileNotFoundError:
+                break
+            if start != offset:
+                decoder.reset()
+            if data or start != offset:
+                offset = start + len(data)
+                await resp.write('event: data\ndata: {}\n\n'.format(dumps({
+                    'offset': start,
+                    'next_offset': offset,
+                    'size': size,
+                    'text': decoder.decode(data),
+                })).encode('utf-8'))
+                last_write = loop.time()
+            elif loop.time() - last_write >= self.SUBSCRIBE_KEEPALIVE:
+                await resp.write(b': keepalive\n\n')
+                last_write = loop.time()
+            # keep reading without waiting while the file is far ahead
+            if offset >= size:
+                await asyncio.sleep(self.TAIL_POLL_INTERVAL)
+        return resp
+
+    #: Maximum number of paths in a `POST /v1/_archive` request
+    ARCHIVE_MAX_PATHS = 10000
+
+    @json_api
+    async def handle_archive(self, request):
+        """
+        API endpoint for downloading selected files of an experiment as an
+        archive.
+
+        Usage:
+            GET /v1/_archive/[id]/[path][?format=zip|tar&level=...]
+            POST /v1/_archive/[id][?format=zip|tar&level=...] ["path", ...]
+
+        The archive contains `path`, or the POSTed relative paths, along
+        with everything inside the selected directories, under a root
+        directory named by the experiment ID.  Zip archives (the default)
+        compress each file by deflate at `level`, except already
+        compressed files, e.g., "*.png" and "*.npz", which are stored.
+        Tarballs can be compressed as a whole by the `compression`
+        parameter, see `/v1/_tarball`.
+
+        The archive is written incrementally by a worker thread and
+        streamed to the client, without temporary files.
+        """
+        if request.method == 'POST':
+            paths = await get_batch_body(request, self.ARCHIVE_MAX_PATHS)
+        else:
+            paths = [path_info_get(request, 'path', '')]
+        paths = normalize_archive_paths(paths)
+        archive_format = query_string_get(request, 'format', 'zip')
+        compression = query_string_get(request, 'compression', 'none')
+        level = query_string_get(request, 'level', None, int)
+        try:
+            check_archive_options(archive_format, compression, level)
+        except ValueError as ex:
+            raise web.HTTPBadRequest(text=str(ex))
+
+        store = await self._open_file_store(request)
+
+        def check_paths():
+            for path in paths:
+                if not os.path.exists(store.resolve_path(path)):
+                    raise FileNotFoundError(path)
+        await self.store_mgr.loop.run_in_executor(
+            self.store_mgr.executor, check_paths)
+
+        id = path_info_get(request, 'id', validator=validate_experiment_id)
+        suffix, content_type = ARCHIVE_FORMATS[archive_format]
+        if archive_format == 'zip':
+            writer_fn = functools.partial(
+                write_zip, root_path=store.storage_dir, arc_name=str(id),
+                paths=paths, level=level
+            )
+        else:
+            suffix += COMPRESSIONS[compression][0]
+            content_type = COMPRESSIONS[compression][1] or content_type
+            writer_fn = functools.partial(
+                write_tar, root_path=store.storage_dir, arc_name=str(id),
+                paths=paths, compression=compression, level=level
+            )
+
+        resp = web.StreamResponse(headers={
+            'Content-Type': content_type,
+            'Content-Disposition': 'attachment; filename={}{}'.format(
+                id, suffix)
+        })
+        await resp.prepare(request)
+        await stream_from_executor(
+            resp, writer_fn, self.archive_executor,
+            chunk_size=self.ARCHIVE_CHUNK_SIZE,
+            max_queued=self.ARCHIVE_MAX_QUEUED
+        )
+        await resp.write_eof()
+        return resp
+
+    #: Number of bytes of each chunk of `/v1/_getzipentry` responses
+    ZIP_ENTRY_CHUNK_SIZE = 262144
+
     @json_api
     async def handle_getzipentry(self, request):
         """
@@ -538,6 +1593,10 @@ class ApiV1(object):
         Usage:
             GET /v1/_getzipentry/[id]/[path]?arc_name=[arc_name]
 
+        Uncompressed entries are sent directly from the archive file, and
+        support HTTP Range requests.  Compressed entries are decompressed
+        and streamed.
+
         Returns:
             The file content.
         """
@@ -545,14 +1604,42 @@ class ApiV1(object):
         arc_name = query_string_get(request, 'arc_name', '')
         if not arc_name:
             raise web.HTTPBadRequest()
-        store = await get_file_store(request, self.mldb, self.store_mgr)
+        store = await self._open_file_store(request)
         if not (await store.isfile(path)):
             raise web.HTTPNotFound()
-        content = await store.read_zip_entry(path, arc_name)
         _type, _enc = mimetypes.guess_type(arc_name)
-        return web.Response(
-            body=content,
-            status=200,
-            content_type=_type or 'application/octet-stream',
-            charset=_enc or None
-        )
+
+        # serve uncompressed entries directly from the archive file
+        location = await store.locate_stored_zip_entry(path, arc_name)
+        if location is not None:
+            abspath, data_offset, info = location
+            resp = FileRangeResponse(
+                abspath, data_offset, info.file_size,
+                etag='{:x}-{:x}-{:x}'.format(
+                    data_offset, info.file_size, info.CRC)
+            )
+            resp.content_type = _type or 'application/octet-stream'
+            if _enc:
+                resp.charset = _enc
+            return resp
+
+        reader = await store.open_zip_entry(path, arc_name)
+        try:
+            resp = web.StreamResponse()
+            resp.content_type = _type or 'application/octet-stream'
+            if _enc:
+                resp.charset = _enc
+            resp.content_length = reader.size
+            resp.headers['Accept-Ranges'] = 'none'
+            await resp.prepare(request)
+            # each write waits for the transport to drain, thus at most
+            # one chunk is buffered per request
+            while True:
+                chunk = await reader.read(self.ZIP_ENTRY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await resp.write(chunk)
+            await resp.write_eof()
+        finally:
+            await reader.close()
+        return resp
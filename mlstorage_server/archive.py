@@ -0,0 +1,413 @@
+import asyncio
+import gzip
+import os
+import stat
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from logging import getLogger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from mlstorage_server.schema import validate_relpath
+
+__all__ = [
+    'ARCHIVE_FORMATS', 'COMPRESSIONS', 'COMPRESSED_SUFFIXES',
+    'ArchiveCancelled', 'QueueWriter', 'check_compression',
+    'check_archive_options', 'open_compressed', 'normalize_archive_paths',
+    'write_tar', 'write_zip', 'stream_from_executor',
+]
+
+#: Supported compressions, to their file name suffixes, content types,
+#: and ranges of compression levels
+COMPRESSIONS = {
+    'none': ('', None, None),
+    'gzip': ('.gz', 'application/gzip', (0, 9)),
+    'zstd': ('.zst', 'application/zstd', (1, 22)),
+}
+
+#: Supported archive formats, to their file name suffixes and content types
+ARCHIVE_FORMATS = {
+    'tar': ('.tar', 'application/x-tar'),
+    'zip': ('.zip', 'application/zip'),
+}
+
+#: Suffixes of the files which are already compressed, and are thus
+#: stored without compression in zip archives
+COMPRESSED_SUFFIXES = frozenset([
+    '.7z', '.bz2', '.gif', '.gz', '.jpeg', '.jpg', '.mp3', '.mp4', '.npz',
+    '.png', '.tgz', '.webm', '.webp', '.whl', '.xz', '.zip', '.zst',
+])
+
+
+class ArchiveCancelled(Exception):
+    """Raised in the writer thread when the streaming has been cancelled."""
+
+
+class QueueWriter(object):
+    """
+    Write-only file object, which passes the written bytes from a worker
+    thread to an asyncio queue in chunks.
+
+    Writes block the worker thread while the queue is full, such that a
+    slow consumer slows down the writer instead of buffering the data
+    in memory.
+    """
+
+    def __init__(self, loop, queue, chunk_size=262144):
+        """
+        Construct a new :class:`QueueWriter`.
+
+        Args:
+            loop: The asyncio event loop, where `queue` belongs to.
+            queue (asyncio.Queue): The bounded queue of chunks.
+            chunk_size (int): Number of bytes to buffer before passing a
+                chunk to the queue. (default 256 KiB)
+        """
+        self._loop = loop
+        self._queue = queue
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+        self._position = 0
+
+    def _put(self, item):
+        if self._cancelled.is_set():
+            raise ArchiveCancelled()
+        asyncio.run_coroutine_threadsafe(
+            self._queue.put(item), self._loop).result()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        """Write `data`, blocking while the queue is full."""
+        if self._cancelled.is_set():
+            raise ArchiveCancelled()
+        self._buffer.extend(data)
+        self._position += len(data)
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        """Pass the buffered bytes to the queue."""
+        if self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            self._put(chunk)
+
+    def close(self):
+        """Flush the buffered bytes.  The queue is not closed."""
+        self.flush()
+
+    def put_eof(self):
+        """Pass :obj:`None` to the queue, as the end of the stream."""
+        try:
+            self._put(None)
+        except ArchiveCancelled:
+            pass
+
+    def cancel(self):
+        """
+        Cancel the writer from the event loop.
+
+        Subsequent writes in the worker thread raise
+        :class:`ArchiveCancelled`.  The queue is drained, such that a
+        worker thread being blocked by the full queue can proceed.
+        """
+        self._cancelled.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+def check_compression(compression, level=None):
+    """
+    Check whether or not `compression` and `level` are supported.
+
+    Args:
+        compression (str): The compression.
+        level (int): The compression level, or :obj:`None` for the
+            default level of the compression.
+
+    Raises:
+        ValueError: If `compression` or `level` is not supported.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unsupported compression: {!r}'.format(compression))
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires the "zstd" extra: '
+                         'pip install "mlstorage-server[zstd]"')
+    levels = COMPRESSIONS[compression][2]
+    if level is not None and \
+            (levels is None or not levels[0] <= level <= levels[1]):
+        raise ValueError('Invalid level for {} compression: {!r}'.
+                         format(compression, level))
+
+
+def check_archive_options(archive_format, compression='none', level=None):
+    """
+    Check whether or not the options of an archive are supported.
+
+    Tarballs can be compressed as a whole, see :func:`check_compression`,
+    while zip archives only take the deflate `level` of their entries,
+    from 0 to 9.
+
+    Args:
+        archive_format ({"tar", "zip"}): The archive format.
+        compression (str): The compression of tarballs.
+        level (int): The compression level, or :obj:`None` for the
+            default level.
+
+    Raises:
+        ValueError: If any of the options is not supported.
+    """
+    if archive_format == 'tar':
+        check_compression(compression, level)
+    elif archive_format == 'zip':
+        if compression != 'none':
+            raise ValueError('Zip archives cannot be compressed as a whole.')
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError('Invalid level for zip archives: {!r}'.
+                             format(level))
+    else:
+        raise ValueError('Unsupported archive format: {!r}'.
+                         format(archive_format))
+
+
+def open_compressed(fileobj, compression='none', level=None):
+    """
+    Wrap `fileobj` with a compressor.
+
+    Args:
+        fileobj: The file object to write the compressed bytes.
+        compression ({"none", "gzip", "zstd"}): The compression.
+        level (int): The compression level, or :obj:`None` for the
+            default level of the compression.
+
+    Returns:
+        The file object to write the uncompressed bytes, which must be
+        closed to finish the compressed stream.  Closing it does not close
+        `fileobj`, except for its buffers being flushed.
+
+    Raises:
+        ValueError: If `compression` or `level` is not supported.
+    """
+    check_compression(compression, level)
+    if compression == 'none':
+        return fileobj
+    if compression == 'gzip':
+        return gzip.GzipFile(
+            fileobj=fileobj, mode='wb', mtime=0,
+            compresslevel=6 if level is None else level
+        )
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    return compressor.stream_writer(fileobj, closefd=False)
+
+
+def normalize_archive_paths(paths):
+    """
+    Normalize the relative paths to pack into an archive.
+
+    Each path is validated by :func:`validate_relpath`.  Duplicated paths,
+    and the paths inside any other selected directory, are removed.
+
+    Args:
+        paths (Iterable[str]): The relative paths, where "" selects the
+            whole root directory.
+
+    Returns:
+        list[str]: The normalized paths, in their original order.
+
+    Raises:
+        ValueError: If any of the paths is invalid, or no path is given.
+        TypeError: If any of the paths is not a str.
+    """
+    paths = [validate_relpath(p) for p in paths]
+    if not paths:
+        raise ValueError('No path is selected.')
+    selected = set(paths)
+    seen = set()
+    ret = []
+    for path in paths:
+        if path in seen:
+            continue
+        seen.add(path)
+        parent = path
+        while parent:
+            parent = parent.rpartition('/')[0]
+            if parent in selected:
+                break
+        else:
+            ret.append(path)
+    return ret
+
+
+def _arc_path(arc_name, path):
+    return arc_name + '/' + path if path else arc_name
+
+
+def _walk_selection(root_path, paths):
+    # yield `(abspath, path)` of the selected files and directories, and of
+    # everything inside the selected directories.  Symbolic links are
+    # yielded as they are, and are never followed, like `tarfile`.
+    for path in paths:
+        abspath = root_path + os.sep + path if path else root_path
+        if (path and os.path.islink(abspath)) or not os.path.isdir(abspath):
+            yield abspath, path
+            continue
+        for dirpath, dirnames, filenames in os.walk(abspath):
+            rel = os.path.relpath(dirpath, root_path).replace(os.sep, '/')
+            rel = '' if rel == '.' else rel
+            if rel:
+                yield dirpath, rel
+            # `os.walk` does not descend into linked directories, thus
+            # yield them along with the files
+            links = [n for n in dirnames
+                     if os.path.islink(dirpath + os.sep + n)]
+            dirnames[:] = sorted(n for n in dirnames if n not in links)
+            for name in sorted(filenames + links):
+                yield (dirpath + os.sep + name,
+                       rel + '/' + name if rel else name)
+
+
+def write_tar(fileobj, root_path, arc_name, paths=None, compression='none',
+              level=None, buffer_size=1048576):
+    """
+    Write the tarball of `root_path` to `fileobj`, in stream mode.
+
+    Args:
+        fileobj: The file object to write the tarball.
+        root_path (str): The directory to pack.
+        arc_name (str): The name of `root_path` in the tarball.
+        paths (list[str]): If specified, only pack these normalized
+            relative paths within `root_path`, see
+            :func:`normalize_archive_paths`.
+        compression ({"none", "gzip", "zstd"}): The compression.
+        level (int): The compression level.
+        buffer_size (int): Size of the buffer for copying file contents.
+            (default 1 MiB)
+    """
+    out = open_compressed(fileobj, compression, level)
+    try:
+        with tarfile.open(fileobj=out, mode='w|',
+                          bufsize=buffer_size) as tf:
+            tf.copybufsize = buffer_size
+            for path in (paths or ['']):
+                abspath = root_path + os.sep + path if path else root_path
+                tf.add(abspath, arcname=_arc_path(arc_name, path))
+    finally:
+        if out is not fileobj:
+            out.close()
+    fileobj.close()
+
+
+def _write_zip_symlink(zf, abspath, arc_name):
+    # store the link target as the content, with the link mode in the
+    # external attributes, the same as Info-ZIP does
+    st = os.lstat(abspath)
+    info = zipfile.ZipInfo(arc_name, time.localtime(st.st_mtime)[:6])
+    info.create_system = 3  # unix
+    info.external_attr = (stat.S_IFLNK | 0o777) << 16
+    zf.writestr(info, os.readlink(abspath))
+
+
+def write_zip(fileobj, root_path, arc_name, paths=None, level=None):
+    """
+    Write the zip archive of `root_path` to `fileobj`.
+
+    `fileobj` need not be seekable, in which case the sizes and CRCs of
+    the entries are written after their data.  The files are compressed
+    by deflate, except those with :data:`COMPRESSED_SUFFIXES`, which are
+    stored as they are.  Symbolic links are stored as links, like in the
+    tarballs, with the link targets as their contents.  Files removed
+    while writing the archive are skipped.
+
+    Args:
+        fileobj: The file object to write the zip archive.
+        root_path (str): The directory to pack.
+        arc_name (str): The name of `root_path` in the zip archive.
+        paths (list[str]): If specified, only pack these normalized
+            relative paths within `root_path`, see
+            :func:`normalize_archive_paths`.
+        level (int): The deflate compression level, from 0 to 9.
+            Requires Python 3.7 or later, and is ignored on earlier
+            versions, where the default level of zlib is used.
+    """
+    kwargs = {}
+    if level is not None and sys.version_info >= (3, 7):
+        kwargs['compresslevel'] = level
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED,
+                         **kwargs) as zf:
+        for abspath, path in _walk_selection(root_path, paths or ['']):
+            compress_type = None
+            if os.path.splitext(path)[1].lower() in COMPRESSED_SUFFIXES:
+                compress_type = zipfile.ZIP_STORED
+            try:
+                if os.path.islink(abspath):
+                    _write_zip_symlink(
+                        zf, abspath, _arc_path(arc_name, path))
+                else:
+                    zf.write(abspath, _arc_path(arc_name, path),
+                             compress_type=compress_type)
+            except FileNotFoundError:
+                pass
+    fileobj.close()
+
+
+async def stream_from_executor(resp, writer_fn, executor, chunk_size=262144,
+                               max_queued=8):
+    """
+    Run `writer_fn` in `executor`, and stream the bytes it writes to the
+    prepared response `resp`.
+
+    At most `max_queued` chunks of `chunk_size` bytes are buffered between
+    the writer thread and the response.  If the streaming is interrupted,
+    e.g., by the client disconnecting, the writer thread is cancelled at
+    its next write.
+
+    Args:
+        resp (web.StreamResponse): The prepared response.
+        writer_fn ((file) -> None): The function writing the content to
+            the file object, which must close the file object at the end.
+        executor (Executor): The executor to run `writer_fn`.
+        chunk_size (int): Number of bytes of each chunk. (default 256 KiB)
+        max_queued (int): Maximum number of queued chunks. (default 8)
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(max_queued)
+    out = QueueWriter(loop, queue, chunk_size=chunk_size)
+
+    def run():
+        try:
+            writer_fn(out)
+        finally:
+            out.put_eof()
+
+    def retrieve_exception(f):
+        if not f.cancelled() and f.exception() is not None and \
+                not isinstance(f.exception(), ArchiveCancelled):
+            getLogger(__name__).warning(
+                'Failed to write the stream.', exc_info=f.exception())
+
+    future = loop.run_in_executor(executor, run)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            await resp.write(chunk)
+    except BaseException:
+        out.cancel()
+        future.add_done_callback(retrieve_exception)
+        raise
+    else:
+        await future
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+
+__all__ = ['TTLCache']
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache, whose entries expire after a time-to-live.
+
+    This cache is not thread-safe, and is intended to be used within
+    the asyncio event loop.
+    """
+
+    def __init__(self, max_size, ttl, timer=time.monotonic):
+        """
+        Construct a new :class:`TTLCache`.
+
+        Args:
+            max_size (int): Maximum number of entries.
+            ttl (float): Time-to-live of the entries, in seconds.
+            timer (() -> float): The clock for expiring the entries.
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict()  # key -> (expire_time, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_size(self):
+        """Get the maximum number of entries."""
+        return self._max_size
+
+    @property
+    def ttl(self):
+        """Get the time-to-live of the entries, in seconds."""
+        return self._ttl
+
+    def get(self, key, default_value=None):
+        """
+        Get the value of `key`.
+
+        Args:
+            key: The key.
+            default_value: The value to return if `key` does not exist,
+                or has expired.
+
+        Returns:
+            The value of `key`, or `default_value`.
+        """
+        entry = self._entries.get(key, None)
+        if entry is not None:
+            if entry[0] > self._timer():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        self.misses += 1
+        return default_value
+
+    def put(self, key, value):
+        """Put the `value` of `key` into the cache."""
+        self._entries[key] = (self._timer() + self._ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Remove `key` from the cache, if it exists."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._entries.clear()
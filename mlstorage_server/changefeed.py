@@ -0,0 +1,418 @@
+import asyncio
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+__all__ = ['ChangeFeed', 'Subscription']
+
+
+def get_changed_fields(old_doc, new_doc):
+    """
+    Compare the top-level fields of two experiment documents.
+
+    Args:
+        old_doc (dict): The old document.
+        new_doc (dict): The new document.
+
+    Returns:
+        (dict, list[str]): The changed or added fields, and the names of
+            the removed fields.
+    """
+    missing = object()
+    fields = {k: v for k, v in new_doc.items()
+              if old_doc.get(k, missing) != v}
+    removed = [k for k in old_doc if k not in new_doc]
+    return fields, removed
+
+
+class Subscription(object):
+    """
+    A subscriber of :class:`ChangeFeed`, with a bounded queue of events.
+
+    If the queue overflows, i.e., the subscriber is too slow to consume
+    its events, the queued events are dropped and :obj:`None` is queued,
+    notifying the subscriber to reload the experiments.
+    """
+
+    def __init__(self, ids=None, max_queued=1000):
+        """
+        Construct a new :class:`Subscription`.
+
+        Args:
+            ids (Iterable[ObjectId]): IDs of the experiments to watch.
+                If not specified, watch all experiments.
+            max_queued (int): Maximum number of queued events.
+                (default 1000)
+        """
+        self._ids = frozenset(ids) if ids else None
+        self._queue = asyncio.Queue(max_queued)
+        self._overflowed = False
+
+    @property
+    def ids(self):
+        """Get the watched experiment IDs, or :obj:`None` for all."""
+        return self._ids
+
+    @property
+    def overflowed(self):
+        """Whether or not the queue has overflowed?"""
+        return self._overflowed
+
+    def matches(self, event):
+        """Whether or not `event` should be sent to this subscriber?"""
+        return self._ids is None or event['id'] in self._ids
+
+    def put(self, event):
+        """Queue an `event`, without blocking."""
+        if self._overflowed:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._overflowed = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    async def get(self):
+        """
+        Get the next event.
+
+        Returns:
+            dict or None: The event, or :obj:`None` if the queue has
+                overflowed.
+        """
+        return await self._queue.get()
+
+
+class ChangeFeed(object):
+    """
+    Shared feed of the changes of experiment documents.
+
+    One feed watches the collection for all of its subscribers, and fans
+    the events out to them.  Each event is a dict of::
+
+        {"op": "insert" | "update" | "delete", "id": ...,
+         "fields": {...}, "removed": [...]}
+
+    where "fields" are the changed top-level fields (or the dotted paths
+    reported by MongoDB change streams), and "removed" are the names of
+    the removed fields.  Setting the deletion flag is reported as
+    "delete".
+
+    The changes are watched by a MongoDB change stream, which requires a
+    replica set or a sharded cluster.  On a standalone server (or a local
+    stand-in such as mongomock), the feed falls back to polling the watched
+    experiments, plus the experiments with recent heartbeats if any
+    subscriber watches all experiments, and diffing them against the last
+    seen documents.  Changes of experiments which are neither explicitly
+    watched nor heartbeating are not reported in polling mode.  The
+    heartbeating experiments are fetched without the large fields in
+    `poll_exclude_fields`, whose changes are thus only reported for the
+    explicitly watched experiments in polling mode.
+
+    In polling mode, the first poll (made as soon as the feed starts) only
+    records the documents without reporting anything.  Afterwards, an
+    experiment seen for the first time is not reported if it has just been
+    watched by a new subscriber, or otherwise reported as "insert" if it
+    has been created since the previous poll, or as "update" of all its
+    fields if it has just started heartbeating again.
+
+    If a change stream cannot be resumed, e.g., its resume token has
+    fallen off the oplog, :obj:`None` is sent to all subscribers, notifying
+    them to reload the experiments, and a new change stream is opened.
+
+    The feed only runs while there are subscribers.
+    """
+
+    #: Feed modes
+    AUTO = 'auto'
+    CHANGE_STREAM = 'change_stream'
+    POLLING = 'polling'
+
+    #: Error codes of the change streams which cannot be resumed:
+    #: InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+    UNRESUMABLE_ERROR_CODES = (260, 280, 286)
+
+    def __init__(self, mldb, mode=AUTO, poll_interval=2., max_queued=1000,
+                 retry_interval=5.,
+                 poll_exclude_fields=('config', 'exc_info', 'result')):
+        """
+        Construct a new :class:`ChangeFeed`.
+
+        Args:
+            mldb (MLDB): The database instance.
+            mode ({"auto", "change_stream", "polling"}): How to watch the
+                changes.  "auto" uses change streams if supported by the
+                server, or polling otherwise. (default "auto")
+            poll_interval (float): Seconds between two polls in polling
+                mode. (default 2)
+            max_queued (int): Maximum number of queued events of each
+                subscriber. (default 1000)
+            retry_interval (float): Seconds to wait before re-opening a
+                failed change stream. (default 5)
+            poll_exclude_fields (Iterable[str]): Top-level fields not to
+                fetch for the heartbeating experiments in polling mode.
+                (default ``('config', 'exc_info', 'result')``)
+        """
+        if mode not in (self.AUTO, self.CHANGE_STREAM, self.POLLING):
+            raise ValueError('Invalid `mode`: {!r}'.format(mode))
+        self._mldb = mldb
+        self._mode = mode
+        self._poll_interval = poll_interval
+        self._max_queued = max_queued
+        self._retry_interval = retry_interval
+        self._poll_exclude_fields = frozenset(poll_exclude_fields)
+        self._subscriptions = set()
+        self._task = None
+
+    @property
+    def mldb(self):
+        """Get the database instance."""
+        return self._mldb
+
+    @property
+    def mode(self):
+        """Get the feed mode."""
+        return self._mode
+
+    @property
+    def subscriptions(self):
+        """Get the active subscriptions."""
+        return frozenset(self._subscriptions)
+
+    def subscribe(self, ids=None):
+        """
+        Subscribe to the changes of experiments.
+
+        Args:
+            ids (Iterable[ObjectId]): IDs of the experiments to watch.
+                If not specified, watch all experiments.
+
+        Returns:
+            Subscription: The subscription, which must be released by
+                :meth:`unsubscribe`.
+        """
+        subscription = Subscription(ids, max_queued=self._max_queued)
+        self._subscriptions.add(subscription)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Release a `subscription`."""
+        self._subscriptions.discard(subscription)
+        if not self._subscriptions and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reload_all(self):
+        """Notify all subscribers to reload the experiments."""
+        for subscription in list(self._subscriptions):
+            subscription.put(None)
+
+    def publish(self, event):
+        """Send an `event` to the matching subscribers."""
+        for subscription in list(self._subscriptions):
+            if subscription.matches(event):
+                subscription.put(event)
+
+    async def close(self):
+        """Stop the feed, and release all subscriptions."""
+        for subscription in list(self._subscriptions):
+            subscription.put(None)
+        self._subscriptions.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _supports_change_streams(self):
+        try:
+            client = self.mldb.collection.database.client
+            info = await client.admin.command('isMaster')
+        except Exception:
+            return False
+        return 'setName' in info or info.get('msg') == 'isdbgrid'
+
+    async def _run(self):
+        mode = self._mode
+        if mode == self.AUTO:
+            mode = (self.CHANGE_STREAM
+                    if await self._supports_change_streams()
+                    else self.POLLING)
+        if mode == self.CHANGE_STREAM:
+            try:
+                await self._watch()
+            except OperationFailure:
+                if self._mode != self.AUTO:
+                    raise
+                getLogger(__name__).info(
+                    'Change streams are not available, fall back to '
+                    'polling.', exc_info=True
+                )
+        await self._poll()
+
+    @staticmethod
+    def _change_to_event(change):
+        op = change['operationType']
+        id = change['documentKey']['_id']
+        event = {'op': op, 'id': id, 'fields': {}, 'removed': []}
+        if op in ('insert', 'replace'):
+            event['op'] = 'insert' if op == 'insert' else 'update'
+            doc = dict(change.get('fullDocument') or ())
+            doc.pop('_id', None)
+            event['fields'] = doc
+        elif op == 'update':
+            desc = change.get('updateDescription') or {}
+            event['fields'] = desc.get('updatedFields') or {}
+            event['removed'] = desc.get('removedFields') or []
+        if event['fields'].get('deleted') is True:
+            event['op'] = 'delete'
+        return event
+
+    async def _watch(self):
+        pipeline = [{'$match': {'operationType': {
+            '$in': ['insert', 'update', 'replace', 'delete']}}}]
+        resume_token = None
+        while True:
+            try:
+                async with self.mldb.collection.watch(
+                        pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.publish(self._change_to_event(change))
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as ex:
+                if ex.code in self.UNRESUMABLE_ERROR_CODES and \
+                        resume_token is not None:
+                    # the missed changes are lost, start over
+                    getLogger(__name__).warning(
+                        'Change stream cannot be resumed, open a new one.',
+                        exc_info=True
+                    )
+                    resume_token = None
+                    self.reload_all()
+                    continue
+                # the server does not support change streams at all
+                if ex.code in (40573, 40324) or resume_token is None:
+                    raise
+                getLogger(__name__).warning(
+                    'Change stream failed, re-open it.', exc_info=True)
+            except Exception:
+                getLogger(__name__).warning(
+                    'Change stream failed, re-open it.', exc_info=True)
+            await asyncio.sleep(self._retry_interval)
+
+    async def _poll(self):
+        snapshot = {}  # id -> last seen document
+        # ids whose last seen documents lack the excluded fields
+        partial_snapshot_ids = set()
+        excluded = self._poll_exclude_fields
+        since = datetime.utcnow()
+        # heartbeats may be written later than their time, see
+        # `HeartbeatWriter`, thus the recent polls are overlapped
+        lag = timedelta(seconds=self._poll_interval + 5.)
+        seeded = False
+        last_ids = set()  # the explicitly watched ids of the previous poll
+        last_watch_all = False
+        wait = False  # the first poll is made immediately
+        while True:
+            if wait:
+                await asyncio.sleep(self._poll_interval)
+            wait = True
+            try:
+                poll_time = datetime.utcnow()
+                ids = set()
+                watch_all = False
+                for subscription in self._subscriptions:
+                    if subscription.ids is None:
+                        watch_all = True
+                    else:
+                        ids.update(subscription.ids)
+
+                docs = {}
+                partial_ids = set()  # fetched without the excluded fields
+                if ids:
+                    cursor = self.mldb.collection.find(
+                        {'_id': {'$in': list(ids)}})
+                    async for doc in cursor:
+                        docs[doc['_id']] = doc
+                if watch_all:
+                    cursor = self.mldb.collection.find(
+                        {'heartbeat': {'$gte': since - lag}},
+                        {k: 0 for k in excluded} or None
+                    )
+                    async for doc in cursor:
+                        if doc['_id'] not in docs:
+                            docs[doc['_id']] = doc
+                            partial_ids.add(doc['_id'])
+
+                new_snapshot = {}
+                new_partial_snapshot_ids = set()
+                for id, doc in docs.items():
+                    doc.pop('_id', None)
+                    if id in snapshot:
+                        op = 'delete' if doc.get('deleted') else 'update'
+                        old_doc = snapshot[id]
+                    elif not seeded or \
+                            (id in partial_ids and not last_watch_all) or \
+                            (id in ids and id not in last_ids):
+                        op = None  # just watched, record it only
+                    elif id in ids or (
+                            isinstance(id, ObjectId) and
+                            id.generation_time.replace(tzinfo=None) >=
+                            since - lag):
+                        op = 'insert'
+                        old_doc = {}
+                    else:
+                        op = 'update'  # just started heartbeating again
+                        old_doc = {}
+
+                    if op is not None:
+                        new_doc = doc
+                        if id in partial_ids or \
+                                id in partial_snapshot_ids:
+                            # diff the fields known in both documents only
+                            old_doc = {k: v for k, v in old_doc.items()
+                                       if k not in excluded}
+                            new_doc = {k: v for k, v in doc.items()
+                                       if k not in excluded}
+                        fields, removed = get_changed_fields(
+                            old_doc, new_doc)
+                        if fields or removed:
+                            self.publish({
+                                'op': op, 'id': id, 'fields': fields,
+                                'removed': removed,
+                            })
+
+                    if id in partial_ids:
+                        # keep the last seen values of the excluded fields
+                        if id in snapshot and \
+                                id not in partial_snapshot_ids:
+                            doc.update((k, v) for k, v in snapshot[id].items()
+                                       if k in excluded)
+                        else:
+                            new_partial_snapshot_ids.add(id)
+                    new_snapshot[id] = doc
+                for id in ids:
+                    if id not in docs and id in snapshot:
+                        self.publish({'op': 'delete', 'id': id,
+                                      'fields': {}, 'removed': []})
+                snapshot = new_snapshot
+                partial_snapshot_ids = new_partial_snapshot_ids
+                since = poll_time
+                last_ids = ids
+                last_watch_all = watch_all
+                seeded = True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to poll the experiment changes.', exc_info=True)
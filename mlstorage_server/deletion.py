@@ -0,0 +1,321 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from bson import ObjectId
+from pymongo import IndexModel, ReturnDocument
+
+from mlstorage_server.mldb import diff_mongo_indexes
+from mlstorage_server.schema import validate_experiment_id
+
+__all__ = ['DeletionWorker']
+
+
+class DeletionWorker(object):
+    """
+    Background worker for deleting experiments.
+
+    A deletion job is persisted in the ``[coll_name].deletion_jobs``
+    collection as soon as it is submitted, and the experiments are marked
+    as deleted, such that they disappear from queries immediately.  The
+    storage directories are captured at the same time, before the documents
+    are purged.  The worker then removes the storage directories with a
+    dedicated bounded executor and throttled I/O, and finally purges the
+    experiment documents.
+
+    Jobs are claimed by leases, so the jobs of a crashed or stopped server
+    are resumed by any server sharing the same database, once their
+    leases expire.  The lease of a running job is renewed periodically,
+    however long its storage directories take to remove.  A newly
+    submitted job is inserted as ``PREPARING`` with a lease, such that
+    no worker claims it before its storage directories are captured,
+    unless the submitting server crashes in between.
+    """
+
+    #: Job status values
+    PREPARING = 'PREPARING'
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+
+    #: The planned indexes of the deletion jobs collection
+    INDEXES = [
+        IndexModel([('status', 1), ('lease_until', 1)]),
+        # completed jobs are kept for 7 days
+        IndexModel([('finish_time', 1)], expireAfterSeconds=7 * 86400),
+    ]
+
+    def __init__(self, mldb, store_mgr, max_concurrency=2,
+                 max_ops_per_sec=2000., poll_interval=10., lease_seconds=300.):
+        """
+        Construct a new :class:`DeletionWorker`.
+
+        Args:
+            mldb (MLDB): The database instance.
+            store_mgr (FileStoreManager): The file store manager.
+            max_concurrency (int): Maximum number of storage directories to
+                remove at the same time. (default 2)
+            max_ops_per_sec (float): Maximum number of files or directories
+                to remove per second, by each of the concurrent removals.
+                :obj:`None` to disable throttling. (default 2000)
+            poll_interval (float): Seconds between two polls for the jobs
+                submitted by other servers, or with expired leases.
+                (default 10)
+            lease_seconds (float): Seconds for a server to own a running
+                job without making any progress. (default 300)
+        """
+        self._mldb = mldb
+        self._store_mgr = store_mgr
+        self._max_concurrency = max_concurrency
+        self._max_ops_per_sec = max_ops_per_sec
+        self._poll_interval = poll_interval
+        self._lease_seconds = lease_seconds
+        self._collection = mldb.collection.database[
+            mldb.collection.name + '.deletion_jobs']
+        self._owner = ObjectId()  # identifies the leases of this worker
+        self._executor = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._indexes_ensured = False
+
+    @property
+    def mldb(self):
+        """Get the database instance."""
+        return self._mldb
+
+    @property
+    def store_mgr(self):
+        """Get the file store manager."""
+        return self._store_mgr
+
+    @property
+    def collection(self):
+        """Get the MongoDB collection of the deletion jobs."""
+        return self._collection
+
+    async def ensure_indexes(self):
+        """Ensure the indexes in :attr:`INDEXES` having been created."""
+        if not self._indexes_ensured:
+            missing, _ = await diff_mongo_indexes(
+                self.collection, self.INDEXES)
+            if missing:
+                _ = await self.collection.create_indexes(missing)
+            self._indexes_ensured = True
+
+    async def _prepare(self, job):
+        # mark the subtree and capture the storage dirs, if not done
+        if job.get('experiments') is None:
+            id_list = await self.mldb.mark_delete(job['experiment_id'])
+            experiments = []
+            if id_list:
+                cursor = self.mldb.collection.find(
+                    {'_id': {'$in': id_list}}, {'storage_dir': 1})
+                async for doc in cursor:
+                    experiments.append({
+                        'id': doc['_id'],
+                        'storage_dir': self.store_mgr.get_path(
+                            doc['_id'], doc),
+                    })
+            job = await self.collection.find_one_and_update(
+                {'_id': job['_id']},
+                {'$set': {'experiments': experiments}},
+                return_document=ReturnDocument.AFTER
+            )
+        return job
+
+    async def submit(self, id):
+        """
+        Submit a job to delete an experiment and all its children.
+
+        Args:
+            id (str or ObjectId): ID of the experiment.
+
+        Returns:
+            dict: The job document.
+
+        Raises:
+            KeyError: If the experiment with `id` does not exist.
+        """
+        id = validate_experiment_id(id)
+        await self.ensure_indexes()
+
+        # persist the job before marking, such that a crash in between
+        # does not leave marked but never purged experiments
+        job = {
+            '_id': ObjectId(),
+            'experiment_id': id,
+            'status': self.PREPARING,
+            'create_time': datetime.utcnow(),
+            'lease_until': self._new_lease(),
+            'owner': self._owner,
+        }
+        await self.collection.insert_one(job)
+        job = await self._prepare(job)
+        if not job['experiments']:
+            await self.collection.delete_one({'_id': job['_id']})
+            raise KeyError('Experiment not exist: {!r}'.format(id))
+        job = await self.collection.find_one_and_update(
+            {'_id': job['_id']},
+            {'$set': {'status': self.PENDING},
+             '$unset': {'lease_until': '', 'owner': ''}},
+            return_document=ReturnDocument.AFTER
+        )
+
+        self.start()
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id):
+        """
+        Get a job document by `job_id`.
+
+        Args:
+            job_id (str or ObjectId): ID of the job.
+
+        Returns:
+            dict or None: The job document, or :obj:`None` if the job
+                does not exist.
+        """
+        return await self.collection.find_one(
+            {'_id': validate_experiment_id(job_id)})
+
+    def _new_lease(self):
+        return datetime.utcnow() + timedelta(seconds=self._lease_seconds)
+
+    async def _claim(self):
+        return await self.collection.find_one_and_update(
+            {'$or': [{'status': self.PENDING},
+                     {'status': {'$in': [self.PREPARING, self.RUNNING]},
+                      'lease_until': {'$lt': datetime.utcnow()}}]},
+            {'$set': {'status': self.RUNNING,
+                      'lease_until': self._new_lease(),
+                      'owner': self._owner}},
+            sort=[('_id', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_lease(self, job_id):
+        """Renew the lease of a job, returning whether it is still owned."""
+        result = await self.collection.update_one(
+            {'_id': job_id, 'owner': self._owner},
+            {'$set': {'lease_until': self._new_lease()}}
+        )
+        return result.matched_count > 0
+
+    async def _keep_lease(self, job_id):
+        # renew the lease well before it expires, until the lease is lost
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3.)
+            try:
+                if not (await self._renew_lease(job_id)):
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to renew the lease of deletion job %s.', job_id,
+                    exc_info=True
+                )
+
+    async def _run_job(self, job):
+        job = await self._prepare(job)
+        experiments = job['experiments']
+        done = set(job.get('removed', ()))
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def remove(experiment):
+            async with semaphore:
+                update = {'$addToSet': {'removed': experiment['id']}}
+                try:
+                    await self.store_mgr.delete(
+                        experiment['id'], experiment, executor=self._executor,
+                        max_ops_per_sec=self._max_ops_per_sec
+                    )
+                except Exception as ex:
+                    getLogger(__name__).warning(
+                        'Failed to delete the storage for experiment %s',
+                        experiment['id'], exc_info=True
+                    )
+                    update['$push'] = {'errors': {
+                        'id': experiment['id'],
+                        'message': str(ex),
+                    }}
+                # record the progress and renew the lease
+                update['$set'] = {'lease_until': self._new_lease()}
+                await self.collection.update_one(
+                    {'_id': job['_id'], 'owner': self._owner}, update)
+
+        keeper = asyncio.ensure_future(self._keep_lease(job['_id']))
+        removal = asyncio.ensure_future(asyncio.gather(*[
+            remove(e) for e in experiments if e['id'] not in done]))
+        try:
+            await asyncio.wait([keeper, removal],
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not removal.done():
+                # the lease is lost, leave the job to its new owner
+                removal.cancel()
+                getLogger(__name__).warning(
+                    'Lost the lease of deletion job %s.', job['_id'])
+                return
+            await removal
+        finally:
+            keeper.cancel()
+            removal.cancel()
+
+        if not (await self._renew_lease(job['_id'])):
+            return
+        await self.mldb.complete_deletion([e['id'] for e in experiments])
+        await self.collection.update_one(
+            {'_id': job['_id'], 'owner': self._owner},
+            {'$set': {'status': self.COMPLETED,
+                      'finish_time': datetime.utcnow()},
+             '$unset': {'lease_until': '', 'owner': ''}}
+        )
+
+    async def _run_loop(self):
+        while True:
+            # clear the event before claiming, such that a job submitted
+            # while claiming still wakes up the worker
+            self._wakeup.clear()
+            try:
+                job = await self._claim()
+                if job is not None:
+                    await self._run_job(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                getLogger(__name__).warning(
+                    'Failed to run the deletion job.', exc_info=True)
+
+            # wait for new jobs, or poll again
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Start the worker, if it is not started."""
+        if self._task is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_concurrency)
+            self._task = asyncio.ensure_future(self._run_loop())
+
+    async def close(self):
+        """
+        Stop the worker.
+
+        The running job is left in the database, and will be resumed once
+        its lease expires.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._executor.shutdown(wait=False)
+            self._executor = None
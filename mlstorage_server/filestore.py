@@ -1,8 +1,11 @@
 import os
-import shutil
 import stat
+import struct
+import threading
+import time
 import zipfile
 from asyncio import AbstractEventLoop
+from collections import OrderedDict
 from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import datetime
 
@@ -11,15 +14,225 @@ from aiofile import AIOFile
 from mlstorage_server.schema import validate_experiment_id, validate_relpath
 
 __all__ = [
-    'FileStoreManager', 'FileEntry', 'ZipFileEntry', 'FileStore'
+    'FileStoreManager', 'FileEntry', 'ZipFileEntry', 'ZipEntryReader',
+    'ZipIndex', 'ZipIndexCache', 'FileStore', 'remove_tree',
 ]
 
 
+def remove_tree(path, max_ops_per_sec=None):
+    """
+    Remove the directory `path` recursively, like :func:`shutil.rmtree`.
+
+    Args:
+        path (str): The directory to remove.
+        max_ops_per_sec (float): If specified, sleep between the removals
+            of files and directories, such that at most this number of them
+            are removed per second.  This prevents a large removal from
+            saturating the storage.
+
+    Returns:
+        int: Number of the removed files and directories.
+    """
+    start_time = time.monotonic()
+    ops = [0]
+
+    def remove(fn, p):
+        try:
+            fn(p)
+        except FileNotFoundError:
+            pass
+        ops[0] += 1
+        if max_ops_per_sec:
+            delay = ops[0] / max_ops_per_sec - (time.monotonic() - start_time)
+            if delay > 0:
+                time.sleep(delay)
+
+    # symbolic links to directories are listed in `dirs` but not followed
+    for parent, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            remove(os.unlink, os.path.join(parent, name))
+        for name in dirs:
+            p = os.path.join(parent, name)
+            remove(os.unlink if os.path.islink(p) else os.rmdir, p)
+    remove(os.rmdir, path)
+    return ops[0]
+
+
+def get_zip_data_offset(f, info):
+    """
+    Get the offset of the data of a zip archive entry.
+
+    The data follows the local file header, whose name and extra field
+    may differ from those in the central directory.
+
+    Args:
+        f: The archive file object, opened in binary mode.
+        info (zipfile.ZipInfo): Zip entry information object.
+
+    Returns:
+        int: The offset of the entry data.
+    """
+    f.seek(info.header_offset)
+    header = f.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or \
+            header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(
+            'Bad local file header: {!r}'.format(info.filename))
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    name_length, extra_length = fields[10], fields[11]
+    return (info.header_offset + zipfile.sizeFileHeader +
+            name_length + extra_length)
+
+
+class ZipIndex(object):
+    """The parsed central directory of a zip archive."""
+
+    __slots__ = ('infos', 'name_to_info')
+
+    def __init__(self, infos):
+        """
+        Construct a new :class:`ZipIndex`.
+
+        Args:
+            infos (list[zipfile.ZipInfo]): The entry information objects.
+        """
+        self.infos = infos
+        self.name_to_info = {i.filename: i for i in infos}
+
+    def __len__(self):
+        return len(self.infos)
+
+    def getinfo(self, name):
+        """
+        Get the information object of entry `name`.
+
+        Raises:
+            KeyError: If `name` does not exist in the archive.
+        """
+        return self.name_to_info[name]
+
+    def open(self, abspath, name):
+        """
+        Open entry `name` for reading its decompressed content, without
+        parsing the central directory again.
+
+        Args:
+            abspath (str): The absolute path of the archive.
+            name (str): The archive entry name.
+
+        Returns:
+            (file, zipfile.ZipInfo): The entry file object, which must be
+                closed after use, and the entry information object.
+
+        Raises:
+            KeyError: If `name` does not exist in the archive.
+        """
+        info = self.getinfo(name)
+        if info.flag_bits & 0x1:
+            raise RuntimeError('Encrypted zip entry is not supported: '
+                               '{!r}'.format(name))
+        f = open(abspath, 'rb')
+        try:
+            f.seek(get_zip_data_offset(f, info))
+            # `ZipExtFile` is not a public API.  Its signature
+            # `(fileobj, mode, zipinfo, decrypter or pwd, close_fileobj)`
+            # is the same from Python 3.5 to 3.13, the supported versions.
+            return zipfile.ZipExtFile(f, 'r', info, None, True), info
+        except TypeError:
+            f.close()
+        except BaseException:
+            f.close()
+            raise
+
+        # fall back to the public API if the signature has changed, which
+        # parses the central directory again
+        with zipfile.ZipFile(abspath, 'r') as zf:
+            return zf.open(info), info
+
+
+class ZipIndexCache(object):
+    """
+    Bounded LRU cache of :class:`ZipIndex`, keyed by the absolute path,
+    the modification time and the size of archives, such that modified
+    archives are parsed again.
+
+    This cache is thread-safe, and is intended to be used within the
+    executor of :class:`FileStoreManager`.
+    """
+
+    def __init__(self, max_archives=64, max_entries=100000):
+        """
+        Construct a new :class:`ZipIndexCache`.
+
+        Args:
+            max_archives (int): Maximum number of cached archives.
+                (default 64)
+            max_entries (int): Maximum total number of entries of the
+                cached archives.  Each entry takes a few hundred bytes.
+                (default 100000)
+        """
+        self._max_archives = max_archives
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._indices = OrderedDict()  # (abspath, mtime_ns, size) -> index
+        self._entry_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._indices)
+
+    def _evict(self, key):
+        self._entry_count -= len(self._indices.pop(key))
+
+    def get(self, abspath):
+        """
+        Get the :class:`ZipIndex` of archive `abspath`, parsing it if it
+        is not cached or has been modified.
+
+        Args:
+            abspath (str): The absolute path of the archive.
+
+        Returns:
+            ZipIndex: The parsed central directory.
+        """
+        st = os.stat(abspath)
+        key = (abspath, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            index = self._indices.get(key)
+            if index is not None:
+                self._indices.move_to_end(key)
+                self.hits += 1
+                return index
+            self.misses += 1
+
+        with zipfile.ZipFile(abspath, 'r') as zf:
+            index = ZipIndex(zf.infolist())
+
+        with self._lock:
+            for k in [k for k in self._indices if k[0] == abspath]:
+                self._evict(k)
+            self._indices[key] = index
+            self._entry_count += len(index)
+            while len(self._indices) > 1 and (
+                    len(self._indices) > self._max_archives or
+                    self._entry_count > self._max_entries):
+                self._evict(next(iter(self._indices)))
+        return index
+
+    def clear(self):
+        """Remove all cached archives."""
+        with self._lock:
+            self._indices.clear()
+            self._entry_count = 0
+
+
 class FileStoreManager(object):
     """Manage the directories for storing experiment generated files."""
 
     def __init__(self, storage_root, loop, executor=None,
-                 default_thread_workers=16):
+                 default_thread_workers=16, zip_index_max_archives=64,
+                 zip_index_max_entries=100000):
         """
         Construct a new :class:`FileStoreManager`.
 
@@ -32,12 +245,21 @@ class FileStoreManager(object):
                 `default_thread_workers` number of workers.
             default_thread_workers (int): Default number of threads for
                 creating the default `executor`. (default 16)
+            zip_index_max_archives (int): Maximum number of cached zip
+                archive central directories. (default 64)
+            zip_index_max_entries (int): Maximum total number of entries
+                of the cached zip archive central directories.
+                (default 100000)
         """
         if executor is None:
             executor = ThreadPoolExecutor(max_workers=default_thread_workers)
         self._storage_root = os.path.abspath(storage_root)
         self._loop = loop
         self._executor = executor
+        self._zip_index_cache = ZipIndexCache(
+            max_archives=zip_index_max_archives,
+            max_entries=zip_index_max_entries
+        )
 
     @property
     def storage_root(self):
@@ -54,6 +276,11 @@ class FileStoreManager(object):
         """Get the executor for performing file-system related operations."""
         return self._executor
 
+    @property
+    def zip_index_cache(self):
+        """Get the cache of parsed zip archive central directories."""
+        return self._zip_index_cache
+
     def get_path(self, experiment_id, experiment_doc=None):
         """
         Get the path of the storage directory of the specified experiment.
@@ -95,7 +322,8 @@ class FileStoreManager(object):
         storage_dir = self.get_path(experiment_id, experiment_doc)
         return FileStore(self, storage_dir)
 
-    async def delete(self, experiment_id, experiment_doc=None):
+    async def delete(self, experiment_id, experiment_doc=None,
+                     executor=None, max_ops_per_sec=None):
         """
         Delete the storage directory of the specified experiment.
 
@@ -105,12 +333,22 @@ class FileStoreManager(object):
                 MongoDB.  If specified, will use its "storage_dir" as
                 the directory to open, instead of the default location.
                 (default :obj:`None`)
+            executor (Executor): The executor for removing the directory.
+                If not specified, will use :attr:`executor`.
+            max_ops_per_sec (float): Throttle the removal, see
+                :func:`remove_tree`.
+
+        Returns:
+            int: Number of the removed files and directories.
         """
         def _sync_delete():
             storage_dir = self.get_path(experiment_id, experiment_doc)
-            if os.path.exists(storage_dir):
-                shutil.rmtree(storage_dir)
-        await self.loop.run_in_executor(self.executor, _sync_delete)
+            if os.path.isdir(storage_dir) and \
+                    not os.path.islink(storage_dir):
+                return remove_tree(storage_dir, max_ops_per_sec)
+            return 0
+        return await self.loop.run_in_executor(
+            executor or self.executor, _sync_delete)
 
 
 class FileEntry(object):
@@ -179,6 +417,59 @@ class ZipFileEntry(object):
         return self.info.file_size
 
 
+class ZipEntryReader(object):
+    """
+    Asynchronous reader of the decompressed content of a zip archive entry.
+
+    The entry is opened, read and closed in the executor of
+    :class:`FileStoreManager`, one call at a time.
+    """
+
+    def __init__(self, manager, entry_file, info):
+        """
+        Construct a new :class:`ZipEntryReader`.
+
+        Use :meth:`FileStore.open_zip_entry` instead of constructing it
+        directly.
+
+        Args:
+            manager (FileStoreManager): The file store manager.
+            entry_file: The opened entry file object.
+            info (zipfile.ZipInfo): Zip entry information object.
+        """
+        self._manager = manager
+        self._entry_file = entry_file
+        self._info = info
+
+    @property
+    def info(self):
+        """Get the zip entry information object."""
+        return self._info
+
+    @property
+    def size(self):
+        """Get the decompressed size of the entry."""
+        return self._info.file_size
+
+    async def read(self, size):
+        """
+        Read at most `size` bytes.
+
+        Args:
+            size (int): Maximum number of bytes to read.
+
+        Returns:
+            bytes: The content, or empty bytes at the end of the entry.
+        """
+        return await self._manager.loop.run_in_executor(
+            self._manager.executor, self._entry_file.read, size)
+
+    async def close(self):
+        """Close the entry and the archive."""
+        await self._manager.loop.run_in_executor(
+            self._manager.executor, self._entry_file.close)
+
+
 class FileStore(object):
     """
     Storing the generated files of an experiment.
@@ -257,24 +548,36 @@ class FileStore(object):
         return await self.manager.loop.run_in_executor(
             self.manager.executor, _sync_list_and_stat)
 
-    async def list_zip_and_stat(self, path):
+    async def list_zip_and_stat(self, path, prefix=None, skip=0,
+                                limit=None):
         """
         List the entries in zip archive `path`, and get their stats.
 
         Args:
             path (str): The relative path of the zip archive within this
                 :class:`FileStore`.
+            prefix (str): If specified, only list the entries whose names
+                start with this prefix.
+            skip (int): Number of entries to skip. (default 0)
+            limit (int): Maximum number of entries to list.
 
         Returns:
             list[FileEntry]: The entries in zip archive `path`.
         """
         def _sync_list_and_stat():
             ret = []
-            with zipfile.ZipFile(abspath, 'r') as zf:
-                for zi in zf.infolist():
-                    assert(isinstance(zi, zipfile.ZipInfo))
-                    if not zi.filename.endswith('/'):
-                        ret.append(ZipFileEntry(zi.filename, path, zi))
+            index = self.manager.zip_index_cache.get(abspath)
+            n_skipped = 0
+            for zi in index.infos:
+                if zi.filename.endswith('/') or \
+                        (prefix and not zi.filename.startswith(prefix)):
+                    continue
+                if n_skipped < skip:
+                    n_skipped += 1
+                    continue
+                if limit is not None and len(ret) >= limit:
+                    break
+                ret.append(ZipFileEntry(zi.filename, path, zi))
             return ret
         path = validate_relpath(path)
         abspath = (self.storage_dir if not path
@@ -282,9 +585,73 @@ class FileStore(object):
         return await self.manager.loop.run_in_executor(
             self.manager.executor, _sync_list_and_stat)
 
-    async def read_zip_entry(self, path, arc_name):
+    async def read_tail(self, path, offset=None, lines=None,
+                        max_bytes=1048576):
         """
-        Read the content of an entry `arc_name` in zip archive `path`.
+        Read the content of file `path` from a byte `offset`, or the last
+        `lines` of it, e.g., to follow a growing log file.
+
+        Args:
+            path (str): The relative path within this :class:`FileStore`.
+            offset (int): The byte offset to start reading.  If it exceeds
+                the file size, e.g., the file has been truncated, read from
+                the beginning.
+            lines (int): If `offset` is not specified, read the last this
+                number of lines.  If neither is specified, read from the
+                beginning.
+            max_bytes (int): Maximum number of bytes to read.
+                (default 1 MiB)
+
+        Returns:
+            (int, bytes, int): The actual offset where the content starts,
+                the content, and the file size.
+        """
+        def _read_tail():
+            with open(abspath, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if offset is not None:
+                    start = offset if offset <= size else 0
+                elif lines is not None:
+                    start = self._find_tail_lines(f, size, lines, max_bytes)
+                else:
+                    start = 0
+                f.seek(start)
+                return start, f.read(min(size - start, max_bytes)), size
+
+        abspath = self.resolve_path(path)
+        return await self.manager.loop.run_in_executor(
+            self.manager.executor, _read_tail)
+
+    @staticmethod
+    def _find_tail_lines(f, size, lines, max_bytes, block_size=65536):
+        # scan backwards for the start of the last `lines` lines, at most
+        # `max_bytes` from the end of the file
+        if lines <= 0:
+            return size
+        count = 0
+        start = size
+        limit = max(0, size - max_bytes)
+        while start > limit:
+            block_start = max(limit, start - block_size)
+            f.seek(block_start)
+            block = f.read(start - block_start)
+            pos = len(block)
+            # the line break at the end of the file does not count
+            if start == size and block.endswith(b'\n'):
+                pos -= 1
+            while True:
+                pos = block.rfind(b'\n', 0, pos)
+                if pos < 0:
+                    break
+                count += 1
+                if count >= lines:
+                    return block_start + pos + 1
+            start = block_start
+        return start
+
+    async def open_zip_entry(self, path, arc_name):
+        """
+        Open an entry `arc_name` in zip archive `path` for streaming.
 
         Args:
             path (str): The relative path of the zip archive within this
@@ -292,17 +659,55 @@ class FileStore(object):
             arc_name (str): The archive entry name.
 
         Returns:
-            bytes: The content of the zip entry.
+            ZipEntryReader: The reader of the entry, which must be closed
+                after use.
+
+        Raises:
+            KeyError: If `arc_name` does not exist in the archive.
+        """
+        def _open_entry():
+            index = self.manager.zip_index_cache.get(abspath)
+            f, info = index.open(abspath, arc_name)
+            return ZipEntryReader(self.manager, f, info)
+        path = validate_relpath(path)
+        abspath = (self.storage_dir if not path
+                   else self.storage_dir + os.sep + path)
+        return await self.manager.loop.run_in_executor(
+            self.manager.executor, _open_entry)
+
+    async def locate_stored_zip_entry(self, path, arc_name):
         """
-        def _read_entry():
-            with zipfile.ZipFile(abspath, 'r') as zf:
-                with zf.open(arc_name, 'r') as f:
-                    return f.read()
+        Locate the raw data of an uncompressed (``ZIP_STORED``) entry
+        `arc_name` in zip archive `path`, such that it can be served
+        directly from the archive file.
+
+        Args:
+            path (str): The relative path of the zip archive within this
+                :class:`FileStore`.
+            arc_name (str): The archive entry name.
+
+        Returns:
+            (str, int, zipfile.ZipInfo) or None: The absolute path of the
+                archive, the offset of the entry data, and the entry
+                information object; or :obj:`None` if the entry is
+                compressed or encrypted.
+
+        Raises:
+            KeyError: If `arc_name` does not exist in the archive.
+        """
+        def _locate():
+            info = self.manager.zip_index_cache.get(abspath).getinfo(arc_name)
+            if info.compress_type != zipfile.ZIP_STORED or \
+                    info.flag_bits & 0x1:
+                return None
+            with open(abspath, 'rb') as f:
+                data_offset = get_zip_data_offset(f, info)
+            return abspath, data_offset, info
         path = validate_relpath(path)
         abspath = (self.storage_dir if not path
                    else self.storage_dir + os.sep + path)
         return await self.manager.loop.run_in_executor(
-            self.manager.executor, _read_entry)
+            self.manager.executor, _locate)
 
     async def compute_fs_size(self, path):
         """
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime
+from logging import getLogger
+
+from pymongo import UpdateOne
+
+from mlstorage_server.schema import validate_experiment_id
+from mlstorage_server.utils import TTLCache
+
+__all__ = ['HeartbeatWriter']
+
+
+class HeartbeatWriter(object):
+    """
+    Coalescing writer of experiment heartbeats.
+
+    The latest heartbeat time of each experiment is buffered in memory,
+    and all the buffered heartbeats are written to MongoDB by one unordered
+    ``bulk_write``, every `flush_interval` seconds, or as soon as there are
+    `max_pending` experiments buffered.  The heartbeats are written with
+    ``$max``, such that a delayed heartbeat never overwrites a later one,
+    e.g., the one set by :meth:`MLDB.set_finished`.
+
+    The existence of the experiments are checked against MongoDB only
+    when they are not in a small cache of known IDs.
+    """
+
+    def __init__(self, mldb, flush_interval=1., max_pending=1000,
+                 known_ids_size=100000, known_ids_ttl=60.):
+        """
+        Construct a new :class:`HeartbeatWriter`.
+
+        Args:
+            mldb (MLDB): The database instance.
+            flush_interval (float): Seconds between two flushes. (default 1)
+            max_pending (int): Flush immediately if there are this number
+                of experiments buffered. (default 1000)
+            known_ids_size (int): Maximum number of cached existing
+                experiment IDs. (default 100000)
+            known_ids_ttl (float): Seconds to cache an existing experiment
+                ID. (default 60)
+        """
+        self._mldb = mldb
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._known_ids = TTLCache(known_ids_size, known_ids_ttl)
+        self._pending = {}
+        self._flush_task = None
+        self._closed = False
+
+    @property
+    def mldb(self):
+        """Get the database instance."""
+        return self._mldb
+
+    @property
+    def known_ids(self):
+        """Get the cache of known experiment IDs."""
+        return self._known_ids
+
+    async def beat(self, id):
+        """
+        Set the heartbeat time of an experiment to now.
+
+        Args:
+            id (str or ObjectId): ID of the experiment.
+
+        Raises:
+            KeyError: If the experiment with `id` does not exist.
+        """
+        id = validate_experiment_id(id)
+        if self._known_ids.get(id) is None:
+            doc = await self.mldb.collection.find_one(
+                {'_id': id, 'deleted': {'$ne': True}}, {'_id': 1})
+            if doc is None:
+                raise KeyError('Experiment not exist: {!r}'.format(id))
+            self._known_ids.put(id, True)
+
+        self._pending[id] = datetime.utcnow()
+        if len(self._pending) >= self._max_pending:
+            await self.flush()
+        elif self._flush_task is None and not self._closed:
+            self._flush_task = asyncio.ensure_future(self._run_flush_loop())
+
+    def forget(self, id_list):
+        """
+        Forget the experiments in `id_list`, e.g., when they are deleted.
+
+        Args:
+            id_list (Iterable[ObjectId]): IDs of the experiments.
+        """
+        for id in id_list:
+            id = validate_experiment_id(id)
+            self._known_ids.pop(id)
+            self._pending.pop(id, None)
+
+    async def flush(self):
+        """Write all the buffered heartbeats to MongoDB."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        requests = [
+            UpdateOne({'_id': id, 'deleted': {'$ne': True}},
+                      {'$max': {'heartbeat': heartbeat}})
+            for id, heartbeat in pending.items()
+        ]
+        try:
+            await self.mldb.collection.bulk_write(requests, ordered=False)
+        except Exception:
+            getLogger(__name__).warning(
+                'Failed to write %d heartbeats.', len(requests),
+                exc_info=True
+            )
+
+    async def _run_flush_loop(self):
+        try:
+            while not self._closed:
+                await asyncio.sleep(self._flush_interval)
+                # do not lose the swapped heartbeats if cancelled
+                await asyncio.shield(self.flush())
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        """Stop the periodic flushes, and write the buffered heartbeats."""
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
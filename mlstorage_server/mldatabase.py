@@ -66,5 +66,27 @@ def mldatabase_export(ctx, pretty, use_timestamp, include_deleted, export_file):
         f.write(docs_json)
 
 
+@mldatabase.group('indexes')
+def mldatabase_indexes():
+    """Manage the indexes of the experiment collection."""
+
+
+@mldatabase_indexes.command('sync')
+@click.option('--dry-run', required=False, default=False, is_flag=True,
+              help='Only print the differences, without applying them.')
+@click.pass_context
+def mldatabase_indexes_sync(ctx, dry_run):
+    """Create the planned indexes, and drop the others."""
+    loop = asyncio.get_event_loop()
+    to_create, to_drop = loop.run_until_complete(
+        ctx.obj['mldb'].sync_indexes(dry_run=dry_run))
+    for name in to_create:
+        click.echo('+ {}'.format(name))
+    for name in to_drop:
+        click.echo('- {}'.format(name))
+    if not to_create and not to_drop:
+        click.echo('Indexes are up to date.')
+
+
 if __name__ == '__main__':
     mldatabase()
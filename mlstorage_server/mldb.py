@@ -1,13 +1,19 @@
 import asyncio
+import base64
+import binascii
+import time
 from datetime import datetime
+from logging import getLogger
 
 import pymongo
-from bson import ObjectId
+from bson import BSON, ObjectId, json_util
 from motor.motor_asyncio import AsyncIOMotorCollection
-from pymongo import IndexModel
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from mlstorage_server.schema import (validate_experiment_doc,
                                      validate_experiment_id)
+from mlstorage_server.utils import TTLCache
 
 __all__ = ['MLDB']
 
@@ -35,44 +41,250 @@ def from_database_experiment_doc(experiment_doc):
     return experiment_doc
 
 
-async def ensure_mongo_indexes(collection, *indexes, full_text=False):
+def exclude_deleted(filter):
+    """Add the condition excluding deleted documents to `filter`."""
+    filter = dict(filter or ())
+    if not filter:
+        return {'deleted': {'$ne': True}}
+    return {'$and': [filter, {'deleted': {'$ne': True}}]}
+
+
+def percentile(sorted_values, q):
+    """
+    Compute the `q`-th percentile of `sorted_values`, by linear
+    interpolation between the closest ranks.
+
+    Args:
+        sorted_values (list[float]): The sorted, non-empty values.
+        q (float): The percentile, within ``[0, 100]``.
+
+    Returns:
+        float: The percentile.
+    """
+    pos = (len(sorted_values) - 1) * q / 100.
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + \
+        (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def get_query_shape(filter, sort_by=None):
+    """
+    Get the shape of a query, i.e., its filter with the values replaced
+    by their type names, along with its sort ordering.
+
+    Args:
+        filter: The filter for querying experiment documents.
+        sort_by: The sort ordering.
+
+    Returns:
+        str: The query shape, e.g.,
+            ``"{'name': {'$in': 'list'}} [('heartbeat', -1)]"``.
+    """
+    def shape(value):
+        if isinstance(value, dict):
+            return {k: shape(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)) and value and \
+                all(isinstance(v, dict) for v in value):
+            return [shape(v) for v in value]
+        return type(value).__name__
+
+    return '{!r} {!r}'.format(shape(filter or {}), sort_by)
+
+
+def get_doc_field(doc, key):
+    """Get the value of a dotted `key` from `doc`, or :obj:`None`."""
+    for k in key.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(k, None)
+    return doc
+
+
+def normalize_sort_by(sort_by):
+    """
+    Normalize the sort ordering for keyset pagination.
+
+    "id" is translated into "_id", and "_id" is appended as the final
+    tie-breaker (in the direction of the last key, or ascending if the last
+    key is sorted by ``$meta``), such that the ordering becomes a total
+    order over the experiment documents.
+
+    Args:
+        sort_by (list[(str, int)]): The sort ordering.
+
+    Returns:
+        list[(str, int)]: The normalized sort ordering.
+    """
+    ret = []
+    for key, direction in sort_by:
+        if key == 'id':
+            key = '_id'
+        ret.append((key, direction))
+        if key == '_id':
+            break
+    else:
+        direction = pymongo.ASCENDING
+        if ret and ret[-1][1] in (pymongo.ASCENDING, pymongo.DESCENDING):
+            direction = ret[-1][1]
+        ret.append(('_id', direction))
+    return ret
+
+
+def encode_page_token(doc, sort_by):
     """
-    Ensure the specified MongoDB `collection` has given `indexes`.
+    Encode the position of `doc` in the sort ordering as an opaque token.
+
+    Args:
+        doc (dict): The last experiment document of a page.
+        sort_by (list[(str, int)]): The normalized sort ordering.
+
+    Returns:
+        str: The page token, which can be passed as `after` argument
+            to :meth:`MLDB.iter_docs` for fetching the next page.
+    """
+    keys = [[key, direction, get_doc_field(doc, key)]
+            for key, direction in sort_by]
+    payload = json_util.dumps(keys).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('utf-8').rstrip('=')
+
+
+def decode_page_token(token, sort_by):
+    """
+    Decode a page token generated by :func:`encode_page_token`.
+
+    Args:
+        token (str): The page token.
+        sort_by (list[(str, int)]): The normalized sort ordering, which
+            must match the ordering the token was generated with.
+
+    Returns:
+        list: The sort key values of the last document of previous page.
+
+    Raises:
+        ValueError: If `token` is malformed, or does not match `sort_by`.
+    """
+    try:
+        token = str(token)
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        keys = json_util.loads(payload.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError('Invalid page token: {!r}'.format(token))
+    if not isinstance(keys, list) or \
+            not all(isinstance(k, list) and len(k) == 3 and
+                    isinstance(k[0], str) for k in keys) or \
+            [tuple(k[:2]) for k in keys] != list(sort_by):
+        raise ValueError('Page token does not match the sort ordering: '
+                         '{!r}'.format(token))
+    return [k[2] for k in keys]
+
+
+def build_keyset_filter(sort_by, values):
+    """
+    Build the filter matching documents strictly after the sort key `values`.
+
+    Args:
+        sort_by (list[(str, int)]): The normalized sort ordering.
+        values (list): The sort key values of the last seen document.
+
+    Returns:
+        dict: The MongoDB filter.
+    """
+    def after(key, direction, value):
+        # MongoDB sorts null and missing values before any other value
+        if value is None:
+            if direction == pymongo.DESCENDING:
+                return None
+            return {key: {'$ne': None}}
+        if direction == pymongo.DESCENDING:
+            return {'$or': [{key: {'$lt': value}}, {key: None}]}
+        return {key: {'$gt': value}}
+
+    branches = []
+    for i, (key, direction) in enumerate(sort_by):
+        cond = after(key, direction, values[i])
+        if cond is not None:
+            branch = [{k: v} for (k, _), v in zip(sort_by[:i], values[:i])]
+            branch.append(cond)
+            branches.append(branch[0] if len(branch) == 1
+                            else {'$and': branch})
+    if not branches:
+        return {'_id': {'$exists': False}}
+    return branches[0] if len(branches) == 1 else {'$or': branches}
+
+
+def _index_matches(model, index_info):
+    """Check whether the existing index `index_info` matches `model`."""
+    doc = model.document
+    if pymongo.TEXT in doc['key'].values():
+        # a collection can have at most one text index, and its key pattern
+        # is stored as ``[('_fts', 'text'), ('_ftsx', 1)]`` by MongoDB
+        return index_info.get('textIndexVersion', None) is not None
+    if list(doc['key'].items()) != list(index_info['key']):
+        return False
+    for option in ('unique', 'sparse', 'partialFilterExpression'):
+        if doc.get(option, None) != index_info.get(option, None):
+            return False
+    return True
+
+
+async def diff_mongo_indexes(collection, index_models):
+    """
+    Compare the indexes of MongoDB `collection` with `index_models`.
 
     Args:
         collection (AsyncIOMotorCollection): The MongoDB collection.
-        \*indexes (list[(str, int)]): List of indices plans
-            ``list[(key, direction)]``.
-        full_text (bool): Whether or not to create a full-text index?
+        index_models (list[IndexModel]): The planned indexes.
 
-    Notes:
-        This method is NOT concurrently safe.
+    Returns:
+        (list[IndexModel], list[str]): The planned indexes which do not
+            exist, and the names of the existing indexes which are not
+            planned (the "_id" index excluded).
     """
-    if indexes:
-        created_flag = [False] * len(indexes)
-        information = await collection.index_information()
-        has_full_text = False
-
-        # inspect the indices
-        for _, index_info in information.items():
-            for i, index_to_create in enumerate(indexes):
-                if index_to_create == index_info['key']:
-                    created_flag[i] = True
-                elif index_info.get('textIndexVersion', None) is not None:
-                    has_full_text = True
-
-        # prepare for the indices
-        index_models = []
-        for i, (created, index_to_create) in \
-                enumerate(zip(created_flag, indexes)):
-            if not created:
-                index_models.append(IndexModel(index_to_create))
-        if full_text and not has_full_text:
-            index_models.append(('$**', 'text'))
-
-        # create the indices
-        if index_models:
-            _ = await collection.create_indexes(index_models)
+    information = await collection.index_information()
+    missing = [m for m in index_models
+               if not any(_index_matches(m, info)
+                          for info in information.values())]
+    extra = [name for name, info in information.items()
+             if name != '_id_' and
+             not any(_index_matches(m, info) for m in index_models)]
+    return missing, extra
+
+
+def summarize_explain(explain):
+    """
+    Summarize the result of ``cursor.explain()``.
+
+    Args:
+        explain (dict): The explain result, with execution statistics.
+
+    Returns:
+        dict: The summary, with the winning plan, the names of the indexes
+            used by the winning plan, the number of returned documents, the
+            number of examined index keys and documents, and the execution
+            time in milliseconds.
+    """
+    def index_names(plan):
+        if isinstance(plan, dict):
+            if 'indexName' in plan:
+                yield plan['indexName']
+            for v in plan.values():
+                yield from index_names(v)
+        elif isinstance(plan, list):
+            for v in plan:
+                yield from index_names(v)
+
+    planner = explain.get('queryPlanner', {})
+    stats = explain.get('executionStats', {})
+    winning_plan = planner.get('winningPlan', None)
+    return {
+        'winning_plan': winning_plan,
+        'indexes': sorted(set(index_names(winning_plan))),
+        'n_returned': stats.get('nReturned', None),
+        'keys_examined': stats.get('totalKeysExamined', None),
+        'docs_examined': stats.get('totalDocsExamined', None),
+        'execution_time_ms': stats.get('executionTimeMillis', None),
+    }
 
 
 class MLDB(object):
@@ -121,15 +333,81 @@ class MLDB(object):
     Additional fields will be stored in MongoDB as-is.
     """
 
-    def __init__(self, collection):
+    #: The default sort ordering of :meth:`iter_docs`
+    DEFAULT_SORT_BY = [('heartbeat', pymongo.DESCENDING)]
+
+    #: The planned indexes of the collection.  Most queries filter by one
+    #: field, exclude the deleted documents and sort by "heartbeat", thus
+    #: compound indexes of these fields with "heartbeat" are created.
+    #: The sort indexes end with "_id", the tie-breaker appended by
+    #: :func:`normalize_sort_by`, such that the sort can use them.
+    #: "deleted" is not indexed, since ``{'deleted': {'$ne': True}}``
+    #: matches two ranges of such an index, which cannot provide the
+    #: order of "heartbeat".
+    INDEXES = [
+        IndexModel([('parent_id', pymongo.ASCENDING),
+                    ('heartbeat', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('name', pymongo.ASCENDING),
+                    ('heartbeat', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('status', pymongo.ASCENDING),
+                    ('heartbeat', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('tags', pymongo.ASCENDING)]),
+        IndexModel([('fingerprint', pymongo.ASCENDING)]),
+        IndexModel([('args', pymongo.ASCENDING)]),
+        IndexModel([('start_time', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('stop_time', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('heartbeat', pymongo.DESCENDING),
+                    ('_id', pymongo.DESCENDING)]),
+        IndexModel([('$**', pymongo.TEXT)]),
+    ]
+
+    #: Seconds not to explain again the slow queries of the same shape
+    SLOW_QUERY_EXPLAIN_TTL = 600
+
+    #: Maximum number of query shapes remembered as explained
+    SLOW_QUERY_SHAPES_CACHE_SIZE = 1000
+
+    #: Maximum number of slow queries being explained at the same time
+    SLOW_QUERY_MAX_EXPLAINS = 1
+
+    def __init__(self, collection, slow_query_ms=None,
+                 slow_query_ratio=None, slow_query_sample_every=None):
         """
         Construct a new :class:`MLDB`.
 
         Args:
             collection (AsyncIOMotorCollection): The MongoDB collection,
                  where to store the experiment documents.
+            slow_query_ms (float): If specified, queries of :meth:`iter_docs`
+                spending more than this number of milliseconds in MongoDB
+                will be logged, and explained in background.  Each query
+                shape is explained at most once every
+                :attr:`SLOW_QUERY_EXPLAIN_TTL` seconds, and at most
+                :attr:`SLOW_QUERY_MAX_EXPLAINS` queries are explained at
+                the same time, since explaining re-runs the query.
+            slow_query_ratio (float): If specified, explained queries which
+                examine more than this number of index keys or documents per
+                returned document will be logged, along with their plans.
+            slow_query_sample_every (int): If specified along with
+                `slow_query_ratio`, every this number of queries of
+                :meth:`iter_docs` will be explained in background as well,
+                no matter how long they take, such that fast queries with
+                a high examined/returned ratio can also be logged.  The
+                same limits as the slow queries apply.
         """
         self._collection = collection
+        self._slow_query_ms = slow_query_ms
+        self._slow_query_ratio = slow_query_ratio
+        self._slow_query_sample_every = slow_query_sample_every
+        self._query_counter = 0
+        self._explained_shapes = TTLCache(
+            self.SLOW_QUERY_SHAPES_CACHE_SIZE, self.SLOW_QUERY_EXPLAIN_TTL)
+        self._explain_tasks = set()
 
         # flag to indicate whether or not ensure index has been called
         self._indexes_ensured = False
@@ -145,53 +423,89 @@ class MLDB(object):
         return self._collection
 
     async def ensure_indexes(self):
-        """Ensure the indexes of document fields having been created."""
+        """
+        Ensure the indexes in :attr:`INDEXES` having been created.
+
+        Existing indexes which are not planned will not be dropped,
+        use :meth:`sync_indexes` to do so.
+
+        Notes:
+            This method is NOT concurrently safe.
+        """
         if not self._indexes_ensured:
-            await ensure_mongo_indexes(
-                self.collection,
-                [('parent_id', pymongo.ASCENDING)],
-                [('name', pymongo.ASCENDING)],
-                [('tags', pymongo.ASCENDING)],
-                [('status', pymongo.ASCENDING)],
-                [('fingerprint', pymongo.ASCENDING)],
-                [('args', pymongo.ASCENDING)],
-                [('deleted', pymongo.ASCENDING)],
-                [('start_time', pymongo.DESCENDING)],
-                [('stop_time', pymongo.DESCENDING)],
-                [('heartbeat', pymongo.DESCENDING)],
-            )
+            missing, _ = await diff_mongo_indexes(
+                self.collection, self.INDEXES)
+            if missing:
+                _ = await self.collection.create_indexes(missing)
             self._indexes_ensured = True
 
-    async def get(self, id):
+    async def sync_indexes(self, dry_run=False):
+        """
+        Make the indexes of the collection match :attr:`INDEXES`, creating
+        the missing indexes and dropping the indexes not planned.
+
+        Args:
+            dry_run (bool): If :obj:`True`, only compare the indexes,
+                without actually creating or dropping any of them.
+
+        Returns:
+            (list[str], list[str]): The names of the indexes to be created,
+                and the names of the indexes to be dropped.
+        """
+        missing, extra = await diff_mongo_indexes(
+            self.collection, self.INDEXES)
+        if not dry_run:
+            for name in extra:
+                await self.collection.drop_index(name)
+            if missing:
+                _ = await self.collection.create_indexes(missing)
+            self._indexes_ensured = True
+        return [m.document['name'] for m in missing], extra
+
+    async def get(self, id, projection=None, include_deleted=False):
         """
         Get an experiment document by `id`.
 
         Args:
             id (str or ObjectId): ID of the experiment.
+            projection (dict): The projection of the returned document.
+            include_deleted (bool): Whether or not to return the document
+                even if its deletion flag has been set? (default
+                :obj:`False`)
 
         Returns:
             dict or None: The experiment document, or :obj:`None` if the
                 experiment does not exist or its deletion flag has been set.
         """
+        filter_ = {'_id': validate_experiment_id(id)}
+        if not include_deleted:
+            filter_['deleted'] = {'$ne': True}
         return from_database_experiment_doc(
-            await self.collection.find_one(
-             {'_id': validate_experiment_id(id), 'deleted': {'$ne': True}}))
+            await self.collection.find_one(filter_, projection))
 
-    async def create(self, name, doc_fields=None):
+    async def get_many(self, id_list):
         """
-        Create an experiment document.
+        Get experiment documents by one ``$in`` query.
 
         Args:
-            name (str): Name of the experiment.
-            doc_fields: Other fields of the experiment document.
-                The following fields will be set by default if absent:
-                *  start_time: set to ``datetime.utcnow()``.
-                *  heartbeat: set to `start_time`.
-                *  status: set to "RUNNING".
+            id_list (Iterable[str or ObjectId]): IDs of the experiments.
 
         Returns:
-            ObjectId: The ID of the inserted document.
+            dict[ObjectId, dict]: The experiment documents, indexed by IDs.
+                Experiments which do not exist or whose deletion flags
+                have been set are absent from the dict.
         """
+        id_list = list({validate_experiment_id(i) for i in id_list})
+        ret = {}
+        if id_list:
+            cursor = self.collection.find(
+                {'_id': {'$in': id_list}, 'deleted': {'$ne': True}})
+            async for doc in cursor:
+                ret[doc['_id']] = from_database_experiment_doc(doc)
+        return ret
+
+    @staticmethod
+    def _make_new_doc(name, doc_fields):
         doc_fields = validate_experiment_doc(
             pop_experiment_id(dict(doc_fields or ())))
         doc_fields['name'] = name
@@ -201,24 +515,100 @@ class MLDB(object):
             doc_fields['heartbeat'] = doc_fields['start_time']
         if 'status' not in doc_fields:
             doc_fields['status'] = 'RUNNING'
+        return doc_fields
+
+    async def create(self, name, doc_fields=None):
+        """
+        Create an experiment document.
+
+        Args:
+            name (str): Name of the experiment.
+            doc_fields: Other fields of the experiment document.
+                The following fields will be set by default if absent:
+                *  start_time: set to ``datetime.utcnow()``.
+                *  heartbeat: set to `start_time`.
+                *  status: set to "RUNNING".
+
+        Returns:
+            ObjectId: The ID of the inserted document.
+        """
+        doc_fields = self._make_new_doc(name, doc_fields)
         await self.ensure_indexes()
         return (await self.collection.insert_one(doc_fields)).inserted_id
 
-    async def _update(self, id, doc_fields):
+    async def create_many(self, doc_fields_list):
+        """
+        Create experiment documents by one unordered ``insert_many``.
+
+        Args:
+            doc_fields_list (list[dict]): Fields of the experiment documents.
+                Each of them must have the "name" field.  Other fields are
+                set by default as :meth:`create` does.
+
+        Returns:
+            list[ObjectId or Exception]: The ID of each inserted document,
+                or the error raised by validating or inserting it.
+        """
+        ret = [None] * len(doc_fields_list)
+        indices = []
+        docs = []
+        for i, doc_fields in enumerate(doc_fields_list):
+            try:
+                if not isinstance(doc_fields, dict) or \
+                        'name' not in doc_fields:
+                    raise ValueError('`name` is required.')
+                doc = self._make_new_doc(doc_fields['name'], doc_fields)
+                doc['_id'] = ObjectId()
+            except (ValueError, TypeError) as ex:
+                ret[i] = ex
+            else:
+                ret[i] = doc['_id']
+                indices.append(i)
+                docs.append(doc)
+
+        if docs:
+            await self.ensure_indexes()
+            try:
+                await self.collection.insert_many(docs, ordered=False)
+            except BulkWriteError as ex:
+                for err in ex.details.get('writeErrors', ()):
+                    ret[indices[err['index']]] = \
+                        RuntimeError(err.get('errmsg', 'Write error.'))
+        return ret
+
+    async def _update(self, id, doc_fields, return_doc=False,
+                      projection=None):
+        filter_ = {'_id': id, 'deleted': {'$ne': True}}
+        if return_doc:
+            # update and fetch the document in one round trip
+            doc = await self.collection.find_one_and_update(
+                filter_, {'$set': doc_fields}, projection=projection,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                raise KeyError('Experiment not exist: {!r}'.format(id))
+            return from_database_experiment_doc(doc)
         result = await self.collection.update_one(
-            {'_id': id, 'deleted': {'$ne': True}},
-            {'$set': doc_fields}
-        )
+            filter_, {'$set': doc_fields})
         if result.matched_count < 1:
             raise KeyError('Experiment not exist: {!r}'.format(id))
 
-    async def update(self, id, doc_fields):
+    async def update(self, id, doc_fields, return_doc=False,
+                     projection=None):
         """
         Update an experiment document in ``[coll_name].runs``.
 
         Args:
             id (str or ObjectId): ID of the experiment.
             doc_fields: Fields of the experiment document to be updated.
+            return_doc (bool): Whether or not to return the updated
+                document, fetched in the same round trip by
+                ``find_one_and_update``. (default :obj:`False`)
+            projection (dict): The projection of the returned document.
+
+        Returns:
+            dict or None: The updated document if `return_doc` is
+                :obj:`True`, otherwise :obj:`None`.
 
         Raises:
             KeyError: If the experiment with `id` does not exist.
@@ -228,7 +618,70 @@ class MLDB(object):
             pop_experiment_id(dict(doc_fields or ())))
         await self.ensure_indexes()
         if doc_fields:
-            return await self._update(id, doc_fields)
+            return await self._update(id, doc_fields, return_doc=return_doc,
+                                      projection=projection)
+        elif return_doc:
+            doc = await self.collection.find_one(
+                {'_id': id, 'deleted': {'$ne': True}}, projection)
+            if doc is None:
+                raise KeyError('Experiment not exist: {!r}'.format(id))
+            return from_database_experiment_doc(doc)
+
+    async def update_many(self, updates):
+        """
+        Update experiment documents by one unordered ``bulk_write``.
+
+        Args:
+            updates (list[(str or ObjectId, dict)]): The IDs of the
+                experiments, and the fields to be updated.
+
+        Returns:
+            list[Exception or None]: :obj:`None` for each updated experiment,
+                or the error raised by validating or updating it.
+                :class:`KeyError` is used for non-existing experiments.
+        """
+        ret = [None] * len(updates)
+        indices = []
+        req_indices = []
+        requests = []
+        for i, (id, doc_fields) in enumerate(updates):
+            try:
+                id = validate_experiment_id(id)
+                doc_fields = validate_experiment_doc(
+                    pop_experiment_id(dict(doc_fields or ())))
+            except (ValueError, TypeError) as ex:
+                ret[i] = ex
+            else:
+                indices.append((i, id))
+                if doc_fields:
+                    req_indices.append(i)
+                    requests.append(UpdateOne(
+                        {'_id': id, 'deleted': {'$ne': True}},
+                        {'$set': doc_fields}
+                    ))
+
+        if requests:
+            await self.ensure_indexes()
+            try:
+                await self.collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as ex:
+                for err in ex.details.get('writeErrors', ()):
+                    ret[req_indices[err['index']]] = \
+                        RuntimeError(err.get('errmsg', 'Write error.'))
+
+        # bulk write results only carry the total matched count, thus the
+        # non-existing experiments are found by another ``$in`` query
+        if indices:
+            cursor = self.collection.find(
+                {'_id': {'$in': list({id for _, id in indices})},
+                 'deleted': {'$ne': True}},
+                {'_id': 1}
+            )
+            existing = {doc['_id'] async for doc in cursor}
+            for i, id in indices:
+                if ret[i] is None and id not in existing:
+                    ret[i] = KeyError('Experiment not exist: {!r}'.format(id))
+        return ret
 
     async def set_heartbeat(self, id, doc_fields=None):
         """
@@ -247,7 +700,8 @@ class MLDB(object):
         await self.ensure_indexes()
         return await self._update(id, doc_fields)
 
-    async def set_finished(self, id, status, doc_fields=None):
+    async def set_finished(self, id, status, doc_fields=None,
+                           return_doc=False, projection=None):
         """
         Set the status of an experiment to "COMPLETED" or "FAILED".
 
@@ -257,6 +711,13 @@ class MLDB(object):
             id (str or ObjectId): ID of the experiment.
             status ({"COMPLETED", "FAILED"}): The final experiment status.
             doc_fields: Other fields to be updated, optional.
+            return_doc (bool): Whether or not to return the updated
+                document, see :meth:`update`. (default :obj:`False`)
+            projection (dict): The projection of the returned document.
+
+        Returns:
+            dict or None: The updated document if `return_doc` is
+                :obj:`True`, otherwise :obj:`None`.
 
         Raises:
             KeyError: If the experiment with `id` does not exist.
@@ -268,16 +729,34 @@ class MLDB(object):
         doc_fields['stop_time'] = doc_fields['heartbeat'] = datetime.utcnow()
         doc_fields['status'] = status
         await self.ensure_indexes()
-        return await self._update(id, doc_fields)
+        return await self._update(validate_experiment_id(id), doc_fields,
+                                  return_doc=return_doc,
+                                  projection=projection)
 
     async def _mark_delete(self, id):
-        ret = []
         result = await self.collection.update_one(
             {'_id': id}, {'$set': {'deleted': True}})
-        if result.matched_count > 0:
-            ret.append(id)
-            async for c in self.collection.find({'parent_id': id}, {'_id': 1}):
-                ret.extend(await self._mark_delete(c['_id']))
+        if result.matched_count < 1:
+            return []
+
+        # mark the subtree level by level, such that each level costs one
+        # `find` and one `update_many`, no matter how wide it is
+        ret = [id]
+        visited = {id}
+        level = [id]
+        while level:
+            children = []
+            cursor = self.collection.find(
+                {'parent_id': {'$in': level}}, {'_id': 1})
+            async for c in cursor:
+                if c['_id'] not in visited:
+                    visited.add(c['_id'])
+                    children.append(c['_id'])
+            if children:
+                await self.collection.update_many(
+                    {'_id': {'$in': children}}, {'$set': {'deleted': True}})
+                ret.extend(children)
+            level = children
         return ret
 
     async def mark_delete(self, id):
@@ -306,16 +785,234 @@ class MLDB(object):
         Returns:
             The actual number of experiments having been deleted.
         """
-        async def deletion_task(id):
-            return (await self.collection.delete_one({'_id': id})).deleted_count
+        id_list = list(set(validate_experiment_id(i) for i in id_list))
+        if not id_list:
+            return 0
+        await self.ensure_indexes()
+        result = await self.collection.delete_many({'_id': {'$in': id_list}})
+        return result.deleted_count
+
+    async def count_docs(self, filter=None, include_deleted=False,
+                         estimated=False, max_time_ms=None):
+        """
+        Count experiment documents.
+
+        Args:
+            filter: The filter for querying experiment documents.
+                If `None`, all experiments will be counted.
+            include_deleted (bool): Whether or not to include deleted
+                documents? (default :obj:`False`)
+            estimated (bool): Whether or not to use the collection metadata
+                to estimate the count, if `filter` is empty?  This is much
+                faster than counting the documents. (default :obj:`False`)
+            max_time_ms (int): The maximum time in milliseconds for MongoDB
+                to count the documents.
+
+        Returns:
+            int: The number of matched documents.
 
-        id_list = set(validate_experiment_id(i) for i in id_list)
-        tasks = [deletion_task(i) for i in id_list]
+        Raises:
+            pymongo.errors.ExecutionTimeout: If the counting takes longer
+                than `max_time_ms`.
+        """
+        kwargs = {}
+        if max_time_ms:
+            kwargs['maxTimeMS'] = max_time_ms
         await self.ensure_indexes()
-        return sum(await asyncio.gather(*tasks))
+
+        filter_ = dict(filter or ())
+        if estimated and not filter_:
+            count = await self.collection.estimated_document_count(**kwargs)
+            if not include_deleted:
+                # documents with deletion flag should be rare, since they
+                # will be removed once the storage has been deleted
+                count -= await self.collection.count_documents(
+                    {'deleted': True}, **kwargs)
+            return max(count, 0)
+
+        if not include_deleted:
+            filter_ = exclude_deleted(filter_)
+        return await self.collection.count_documents(filter_, **kwargs)
+
+    async def aggregate_metrics(self, metrics, filter=None, group_by=None,
+                                percentiles=(), max_groups=None,
+                                include_deleted=False,
+                                percentile_sample_size=10000):
+        """
+        Compute the statistics of numeric `metrics` over the matched
+        experiment documents, by a MongoDB ``$group`` pipeline.
+
+        Args:
+            metrics (list[str]): The dotted names of the metric fields,
+                e.g., "result.loss".  Non-numeric values are ignored.
+            filter: The filter for querying experiment documents.
+                If `None`, all experiments will be aggregated.
+            group_by (str): The dotted name of the field to group the
+                documents by, e.g., "config.lr".  If not specified, all
+                the matched documents will be aggregated as one group.
+            percentiles (Iterable[float]): The percentiles to compute,
+                within ``[0, 100]``.  See `percentile_sample_size`.
+            max_groups (int): Maximum number of groups to return.
+            include_deleted (bool): Whether or not to include deleted
+                documents? (default :obj:`False`)
+            percentile_sample_size (int): The percentiles of each group
+                are computed from at most this number of its metric values
+                (the first ones in the natural order of the documents),
+                such that the fetched values are bounded.  They are thus
+                exact only if the group has no more values than this
+                number, and the number of values actually used is returned
+                as "sampled". (default 10000)
+
+        Returns:
+            list[dict]: The statistics of each group, ordered by the group
+                key, ``{"group": ..., "count": ..., "metrics": {metric:
+                {"count": ..., "min": ..., "max": ..., "mean": ...,
+                "sampled": ..., "p50": ..., ...}}}``, where "sampled" and
+                the percentiles are included only if `percentiles` is
+                specified.
+        """
+        for key in [group_by] + list(metrics):
+            if key is not None and (not key or key.startswith('$')):
+                raise ValueError('Invalid field name: {!r}'.format(key))
+        percentiles = list(percentiles)
+        for q in percentiles:
+            if not (0 <= q <= 100):
+                raise ValueError('Invalid percentile: {!r}'.format(q))
+
+        # assemble the pipelines, where the non-numeric metric values are
+        # removed by the projection, and thus ignored by the accumulators
+        filter_ = dict(filter or ())
+        if not include_deleted:
+            filter_ = exclude_deleted(filter_)
+        numeric_types = ['double', 'int', 'long', 'decimal']
+        project = {'_id': 0,
+                   'g': '$' + group_by if group_by else {'$literal': None}}
+        group = {'_id': '$g', 'count': {'$sum': 1}}
+        values_group = {'_id': '$g'}
+        values_slice = {}
+        for i, key in enumerate(metrics):
+            m = 'm{}'.format(i)
+            project[m] = {'$cond': [
+                {'$in': [{'$type': '$' + key}, numeric_types]},
+                '$' + key,
+                '$$REMOVE'
+            ]}
+            group[m + '_count'] = {'$sum': {'$cond': [
+                {'$in': [{'$type': '$' + m}, numeric_types]}, 1, 0]}}
+            group[m + '_min'] = {'$min': '$' + m}
+            group[m + '_max'] = {'$max': '$' + m}
+            group[m + '_mean'] = {'$avg': '$' + m}
+            values_group[m] = {'$push': '$' + m}
+            values_slice[m] = {'$slice': ['$' + m, percentile_sample_size]}
+        pipeline = [
+            {'$match': filter_},
+            {'$project': project},
+            {'$group': group},
+            {'$sort': {'_id': pymongo.ASCENDING}},
+        ]
+        if max_groups:
+            pipeline.append({'$limit': max_groups})
+        values_pipeline = [
+            {'$match': filter_},
+            {'$project': project},
+            {'$group': values_group},
+            {'$sort': {'_id': pymongo.ASCENDING}},
+        ]
+        if max_groups:
+            values_pipeline.append({'$limit': max_groups})
+        values_pipeline.append({'$project': values_slice})
+
+        # execute the pipelines
+        await self.ensure_indexes()
+        groups = []
+        async for g in self.collection.aggregate(pipeline, allowDiskUse=True):
+            groups.append(g)
+
+        # the values of each group are capped after grouping, such that
+        # every group gets its own share of the values
+        values = {}  # encoded group key -> the capped values
+        if percentiles and groups:
+            async for g in self.collection.aggregate(
+                    values_pipeline, allowDiskUse=True):
+                values[BSON.encode({'g': g.pop('_id')})] = g
+
+        # compute the percentiles and gather the statistics
+        ret = []
+        for g in groups:
+            group_values = values.get(BSON.encode({'g': g['_id']}), {})
+            stats = {}
+            for i, key in enumerate(metrics):
+                m = 'm{}'.format(i)
+                s = {k: g[m + '_' + k]
+                     for k in ('count', 'min', 'max', 'mean')}
+                if percentiles:
+                    sorted_values = sorted(
+                        v for v in group_values.get(m, ()) if v is not None)
+                    s['sampled'] = len(sorted_values)
+                    for q in percentiles:
+                        s['p{:g}'.format(q)] = \
+                            percentile(sorted_values, q) \
+                            if sorted_values else None
+                stats[key] = s
+            ret.append({'group': g['_id'], 'count': g['count'],
+                        'metrics': stats})
+        return ret
+
+    async def facet_counts(self, facets, filter=None, include_deleted=False):
+        """
+        Count the most frequent values of each field in `facets` over the
+        matched experiment documents, by one ``$facet`` aggregation.
+
+        Args:
+            facets (dict[str, int]): The dotted field names, and the
+                maximum number of values to count for each of them.
+                Array fields (e.g., "tags") are counted per element.
+            filter: The filter for querying experiment documents.
+                If `None`, all experiments will be counted.
+            include_deleted (bool): Whether or not to include deleted
+                documents? (default :obj:`False`)
+
+        Returns:
+            dict[str, list[dict]]: The values and counts of each field,
+                in DESCENDING order of the counts, ``{field: [{"value": ...,
+                "count": ...}, ...]}``.
+        """
+        for key, limit in facets.items():
+            if not key or key.startswith('$'):
+                raise ValueError('Invalid field name: {!r}'.format(key))
+            if limit < 1:
+                raise ValueError('Invalid facet limit: {!r}'.format(limit))
+
+        filter_ = dict(filter or ())
+        if not include_deleted:
+            filter_ = exclude_deleted(filter_)
+        keys = list(facets)
+        pipeline = [
+            {'$match': filter_},
+            {'$facet': {
+                'f{}'.format(i): [
+                    {'$unwind': '$' + key},
+                    {'$group': {'_id': '$' + key, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': pymongo.DESCENDING,
+                               '_id': pymongo.ASCENDING}},
+                    {'$limit': facets[key]},
+                ]
+                for i, key in enumerate(keys)
+            }},
+        ]
+
+        await self.ensure_indexes()
+        ret = {key: [] for key in keys}
+        async for doc in self.collection.aggregate(pipeline,
+                                                   allowDiskUse=True):
+            for i, key in enumerate(keys):
+                ret[key] = [{'value': v['_id'], 'count': v['count']}
+                            for v in doc['f{}'.format(i)]]
+        return ret
 
     async def iter_docs(self, filter=None, skip=None, limit=None,
-                        sort_by=None, include_deleted=False):
+                        sort_by=None, include_deleted=False, after=None,
+                        projection=None, batch_size=None):
         """
         Iterate through experiment documents.
 
@@ -328,34 +1025,153 @@ class MLDB(object):
                 by the DESCENDING order of "heartbeat".
             include_deleted (bool): Whether or not to include deleted
                 documents? (default :obj:`False`)
+            after (str): The page token of the last document of previous
+                page, generated by :func:`encode_page_token`.  If specified,
+                only the documents after it will be queried, by a range
+                predicate on the sort keys instead of skipping documents.
+            projection (dict[str, int]): The MongoDB projection, selecting
+                the fields to be fetched.  If not specified, will fetch
+                the whole documents.
+            batch_size (int): The number of documents to fetch from MongoDB
+                in each batch.  If not specified, will use the server
+                default batch size.
 
         Yields:
             The matched documents, in DESCENDING order of "heartbeat".
+
+        Raises:
+            ValueError: If `after` is not a valid page token, or `sort_by`
+                contains a ``$meta`` sort key when `after` is specified.
         """
+        cursor = self._find(filter, skip, limit, sort_by, include_deleted,
+                            after, projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        await self.ensure_indexes()
+
+        # fetch the documents, and measure the time spent in MongoDB
+        elapsed = 0.
+        count = 0
+        start = time.perf_counter()
+        try:
+            async for doc in cursor:
+                elapsed += time.perf_counter() - start
+                count += 1
+                yield from_database_experiment_doc(doc)
+                start = time.perf_counter()
+            elapsed += time.perf_counter() - start
+        finally:
+            self._query_counter += 1
+            slow = self._slow_query_ms is not None and \
+                elapsed * 1000. > self._slow_query_ms
+            sampled = self._slow_query_ratio is not None and \
+                bool(self._slow_query_sample_every) and \
+                self._query_counter % self._slow_query_sample_every == 0
+            if slow:
+                getLogger(__name__).warning(
+                    'Slow query: %.0f ms, %d returned, filter %s, sort %s, '
+                    'skip %s, limit %s', elapsed * 1000., count, filter,
+                    sort_by, skip, limit
+                )
+            if slow or sampled:
+                self._explain_slow_query(
+                    filter, skip, limit, sort_by, include_deleted, after)
+
+    def _find(self, filter, skip, limit, sort_by, include_deleted, after,
+              projection):
         # assemble the query
         filter_ = dict(filter or ())
-        if not include_deleted:
+        sort_by = normalize_sort_by(sort_by or self.DEFAULT_SORT_BY)
+        if after is not None:
+            if any(isinstance(d, dict) for _, d in sort_by):
+                raise ValueError('`after` cannot be used with `$meta` sort.')
+            keyset_filter = build_keyset_filter(
+                sort_by, decode_page_token(after, sort_by))
             if not filter_:
-                filter_['deleted'] = {'$ne': True}
+                filter_ = keyset_filter
             else:
-                filter_ = {'$and': [filter_, {'deleted': {'$ne': True}}]}
-        if sort_by is None:
-            sort_by = [('heartbeat', pymongo.DESCENDING)]
+                filter_ = {'$and': [filter_, keyset_filter]}
+        if not include_deleted:
+            filter_ = exclude_deleted(filter_)
 
-        # open the cursor and fetch documents
+        # open the cursor
         cursor = self.collection.find(
             filter_,
+            projection=projection or None,
             sort=sort_by
         )
         if skip:
             cursor = cursor.skip(skip)
         if limit:
             cursor = cursor.limit(limit)
-        async for doc in cursor:
-            yield from_database_experiment_doc(doc)
+        return cursor
+
+    def _explain_slow_query(self, filter, skip, limit, sort_by,
+                            include_deleted, after):
+        # explaining re-runs the query, thus skip the recently explained
+        # query shapes (slow or sampled), and the queries beyond the
+        # concurrency limit
+        shape = get_query_shape(filter, sort_by)
+        if self._explained_shapes.get(shape) is not None or \
+                len(self._explain_tasks) >= self.SLOW_QUERY_MAX_EXPLAINS:
+            return
+        self._explained_shapes.put(shape, True)
+
+        async def explain():
+            try:
+                await self.explain_docs(
+                    filter, skip, limit, sort_by, include_deleted, after)
+            except Exception:
+                getLogger(__name__).debug(
+                    'Failed to explain the slow query.', exc_info=True)
+
+        task = asyncio.ensure_future(explain())
+        self._explain_tasks.add(task)
+        task.add_done_callback(self._explain_tasks.discard)
+
+    async def explain_docs(self, filter=None, skip=None, limit=None,
+                           sort_by=None, include_deleted=False, after=None,
+                           projection=None):
+        """
+        Explain the query plan of :meth:`iter_docs` with the same arguments.
+
+        Args:
+            filter: The filter for querying experiment documents.
+            skip: Number of documents to skip at front.
+            limit: Limiting the returned document by this number.
+            sort_by: The sort ordering.
+            include_deleted (bool): Whether or not to include deleted
+                documents? (default :obj:`False`)
+            after (str): The page token of the last document of previous
+                page, generated by :func:`encode_page_token`.
+            projection (dict[str, int]): The MongoDB projection.
+
+        Returns:
+            dict: The summary of the query plan, see
+                :func:`summarize_explain`.
+        """
+        cursor = self._find(filter, skip, limit, sort_by, include_deleted,
+                            after, projection)
+        await self.ensure_indexes()
+        ret = summarize_explain(await cursor.explain())
+
+        if self._slow_query_ratio is not None:
+            examined = max(ret['keys_examined'] or 0,
+                           ret['docs_examined'] or 0)
+            returned = max(ret['n_returned'] or 0, 1)
+            if examined > self._slow_query_ratio * returned:
+                getLogger(__name__).warning(
+                    'Inefficient query: %s keys and %s docs examined, %s '
+                    'returned, %s ms, indexes %s, filter %s, sort %s',
+                    ret['keys_examined'], ret['docs_examined'],
+                    ret['n_returned'], ret['execution_time_ms'],
+                    ret['indexes'], filter, sort_by
+                )
+        return ret
 
     async def fetch_docs(self, filter=None, skip=None, limit=None,
-                         sort_by=None, include_deleted=False):
+                         sort_by=None, include_deleted=False, after=None,
+                         projection=None):
         """
         Fetch experiment documents.
 
@@ -368,12 +1184,18 @@ class MLDB(object):
                 by the DESCENDING order of "heartbeat".
             include_deleted (bool): Whether or not to include deleted
                 documents? (default :obj:`False`)
+            after (str): The page token of the last document of previous
+                page, generated by :func:`encode_page_token`.
+            projection (dict[str, int]): The MongoDB projection, selecting
+                the fields to be fetched.  If not specified, will fetch
+                the whole documents.
 
         Returns:
             The matched documents list, in DESCENDING order of "heartbeat".
         """
         ret = []
         async for doc in self.iter_docs(filter, skip, limit, sort_by=sort_by,
-                                        include_deleted=include_deleted):
+                                        include_deleted=include_deleted,
+                                        after=after, projection=projection):
             ret.append(doc)
         return ret
@@ -44,7 +44,8 @@ else:
 
 
 def make_app(storage_root=None, mongo=None, db=None, collection=None,
-             debug=False):
+             debug=False, slow_query_ms=None, slow_query_ratio=None,
+             slow_query_sample_every=None, zip_index_max_entries=100000):
     if storage_root is None:
         storage_root = os.environ.get('MLSTORAGE_EXPERIMENT_ROOT')
     if mongo is None:
@@ -71,8 +72,11 @@ def make_app(storage_root=None, mongo=None, db=None, collection=None,
 
     loop = asyncio.get_event_loop()
     client = AsyncIOMotorClient(mongo)
-    mldb = MLDB(client[db][collection])
-    store_mgr = FileStoreManager(storage_root, loop)
+    mldb = MLDB(client[db][collection], slow_query_ms=slow_query_ms,
+                slow_query_ratio=slow_query_ratio,
+                slow_query_sample_every=slow_query_sample_every)
+    store_mgr = FileStoreManager(
+        storage_root, loop, zip_index_max_entries=zip_index_max_entries)
 
     app = web.Application()
     for handler_class in [ApiV1, WebUI]:
@@ -104,14 +108,38 @@ def make_app(storage_root=None, mongo=None, db=None, collection=None,
               help='MongoDB collection name.  If not specified, will use '
                    '``os.environ["MLSTORAGE_MONGO_COLL"]``.',
               default=os.environ.get('MLSTORAGE_MONGO_COLL') or None)
+@click.option('--slow-query-ms', default=1000., type=click.FLOAT,
+              help='Log the queries spending more than this number of '
+                   'milliseconds in MongoDB. (default 1000)')
+@click.option('--slow-query-ratio', default=100., type=click.FLOAT,
+              help='Log the explained queries examining more than this '
+                   'number of index keys or documents per returned '
+                   'document.  The slow queries, and one out of every '
+                   '"--slow-query-sample-every" queries, are explained. '
+                   '(default 100)')
+@click.option('--slow-query-sample-every', default=1000, type=click.INT,
+              help='Explain one out of every this number of queries, no '
+                   'matter how long they take, to check their examined/'
+                   'returned ratio.  Zero to explain only the slow '
+                   'queries. (default 1000)')
+@click.option('--zip-index-max-entries', default=100000, type=click.INT,
+              help='Maximum total number of zip archive entries whose '
+                   'parsed information is cached, by each worker. '
+                   '(default 100000)')
 @click.option('--debug', default=False, is_flag=True,
               help='Whether or not to enable debugging features?')
 def mlserver(host, port, workers, storage_root, mongo, db, collection,
-             debug):
+             slow_query_ms, slow_query_ratio, slow_query_sample_every,
+             zip_index_max_entries, debug):
     """
     MLStorage API and web UI server.
     """
-    app_factory = lambda: make_app(storage_root, mongo, db, collection, debug)
+    app_factory = lambda: make_app(
+        storage_root, mongo, db, collection, debug,
+        slow_query_ms=slow_query_ms, slow_query_ratio=slow_query_ratio,
+        slow_query_sample_every=slow_query_sample_every,
+        zip_index_max_entries=zip_index_max_entries
+    )
     if workers and workers > 1 and GUnicornWrapper is None:
         click.echo('GUnicorn is not installed!  Downgrade to single worker.',
                    err=True)
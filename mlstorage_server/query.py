@@ -1,11 +1,16 @@
+import copy
+import functools
 import re
+import threading
+import time
 from datetime import datetime
 
-import pyparsing as pp
 from bson import ObjectId
 from bson.errors import InvalidId
 from dateutil import parser as date_parser
 
+from mlstorage_server.cache import TTLCache
+
 UPPER_CASE = object()
 FIELD_TYPES = dict([
     ('id', ObjectId),
@@ -61,16 +66,26 @@ class BadQuery(object):
 
 class AllFieldQuery(Query):
 
-    def __init__(self, phrase):
+    def __init__(self, phrase, full_text=False):
         self.phrase = phrase
+        self.full_text = full_text
 
     def __repr__(self):
         return repr(self.phrase)
 
     def __eq__(self, other):
-        return isinstance(other, AllFieldQuery) and other.phrase == self.phrase
+        return (isinstance(other, AllFieldQuery) and
+                other.phrase == self.phrase and
+                other.full_text == self.full_text)
 
     def optimize(self):
+        if self.full_text:
+            if not self.phrase:
+                return NullQuery()
+            if ObjectId.is_valid(self.phrase):
+                return FieldQueryTerm('id', self.phrase)
+            return TextQuery([self.phrase])
+
         terms = []
         for key in FIELD_TYPES:
             t = FieldQueryTerm(key, self.phrase)
@@ -86,13 +101,51 @@ class AllFieldQuery(Query):
                            'Did you forget to call `optimize()`?')
 
 
+class TextQuery(Query):
+    """
+    Full-text search query over the text index of the collection.
+
+    Every phrase is quoted in the ``$search`` string, such that documents
+    must match all the phrases.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+
+    def __repr__(self):
+        return 'Text({})'.format(','.join(map(repr, self.phrases)))
+
+    def __eq__(self, other):
+        return isinstance(other, TextQuery) and other.phrases == self.phrases
+
+    def optimize(self):
+        return self
+
+    def mongo_filter(self):
+        search = ' '.join('"{}"'.format(p.replace('"', ' '))
+                          for p in self.phrases)
+        return {'$text': {'$search': search}}
+
+
 class FieldQueryTerm(Query):
 
-    def __init__(self, field, phrase):
+    #: Match strings by case-insensitive sub-string search, and others
+    #: by equality.  Neither can use the field index for strings.
+    DEFAULT = 'default'
+    #: Match strings by case-sensitive prefix search, which can use the
+    #: field index.  Not supported by non-string fields.
+    PREFIX = 'prefix'
+    #: Match by equality.
+    EXACT = 'exact'
+
+    def __init__(self, field, phrase, mode=DEFAULT):
+        type_ = FIELD_TYPES.get(field, None)
         if field == 'id':
             field = '_id'
+        bad_query = False
+        if mode == self.PREFIX and type_ not in (None, str, UPPER_CASE):
+            bad_query = True
         try:
-            type_ = FIELD_TYPES.get(field, None)
             if type_ is not None:
                 if type_ is str:
                     phrase = str(phrase)
@@ -111,17 +164,21 @@ class FieldQueryTerm(Query):
 
         self.field = str(field)
         self.phrase = phrase
-        self.bad_query = False
+        self.mode = mode
+        self.bad_query = bad_query
 
     def __repr__(self):
+        mode_flag = ',{}'.format(self.mode) if self.mode != self.DEFAULT \
+            else ''
         bad_flag = ',bad' if self.bad_query else ''
-        return 'FieldQuery({}:{}{})'.format(
-            self.field, repr(self.phrase), bad_flag)
+        return 'FieldQuery({}:{}{}{})'.format(
+            self.field, repr(self.phrase), mode_flag, bad_flag)
 
     def __eq__(self, other):
         return (isinstance(other, FieldQueryTerm) and
                 other.field == self.field and
                 other.phrase == self.phrase and
+                other.mode == self.mode and
                 other.bad_query == self.bad_query)
 
     def optimize(self):
@@ -134,7 +191,10 @@ class FieldQueryTerm(Query):
     def mongo_filter(self):
         if self.bad_query:
             raise RuntimeError('Bad query.')
-        if isinstance(self.phrase, str) and self.field in REGEX_FIELDS:
+        if self.mode == self.PREFIX:
+            return {self.field: {'$regex': '^' + re.escape(self.phrase)}}
+        if self.mode == self.DEFAULT and isinstance(self.phrase, str) and \
+                self.field in REGEX_FIELDS:
             return {self.field: {
                 '$regex': re.escape(self.phrase),
                 '$options': 'ism',
@@ -156,11 +216,19 @@ class AndQuery(Query):
     def optimize(self):
         terms = [t.optimize() for t in self.terms]
         terms2 = []
+        text_query = None
         for t in terms:
             if isinstance(t, AndQuery):
                 terms2.extend(t.terms)
             elif isinstance(t, BadQuery):
                 return BadQuery()
+            elif isinstance(t, TextQuery):
+                # MongoDB allows at most one "$text" in a query
+                if text_query is None:
+                    text_query = TextQuery(t.phrases)
+                    terms2.append(text_query)
+                else:
+                    text_query.phrases.extend(t.phrases)
             elif not isinstance(t, NullQuery):
                 terms2.append(t)
         if not terms2:
@@ -192,6 +260,10 @@ class OrQuery(Query):
                 terms2.extend(t.terms)
             elif not isinstance(t, (NullQuery, BadQuery)):
                 terms2.append(t)
+        if sum(isinstance(t, TextQuery) for t in terms2) > 1:
+            # MongoDB allows at most one "$text" in a query, and the text
+            # queries cannot be merged, since all their phrases must match
+            return BadQuery()
         if not terms2:
             return NullQuery()
         if len(terms2) == 1:
@@ -226,52 +298,232 @@ class NotQuery(Query):
 
 
 class QueryParser(object):
-    unicode_printables = ''.join(
-        pp.unichr(c) for c in range(65536) if not pp.unichr(c).isspace())
-    singlePhrase = pp.Word(unicode_printables). \
-        setParseAction(lambda s, l, t: t[0])
-    quotedPhrase = pp.QuotedString('"', unquoteResults=True, escChar='\\'). \
-        setParseAction(lambda s, l, t: t[0])
-    phrase = (quotedPhrase | singlePhrase).setParseAction(lambda s, l, t: t[0])
-    field_name = pp.Word(pp.alphanums + '._')
-    field_query = (field_name + pp.Literal(':') + phrase). \
-        setParseAction(lambda s, l, t: FieldQueryTerm(t[0], t[2]))
-    all_field_query = pp.Group(phrase). \
-        setParseAction(lambda s, l, t: AllFieldQuery(t[0][0]))
-
-    query_string = pp.OneOrMore(field_query | all_field_query). \
-        setParseAction(lambda s, l, t: AndQuery(t))
-
-
-def parse_query(query_string):
+    """
+    Hand-written parser of the query language.
+
+    A query string is a sequence of terms separated by white spaces.  Each
+    term is either a field query ``field:phrase``, or an all-field query
+    ``phrase``.  A phrase is either a double-quoted string, with "\\"
+    as the escape character, or a run of non-space characters.
+
+    A field query can also be an exact match ``field:=phrase``, or a prefix
+    match ``field:prefix*`` (where the phrase is not quoted).
+    """
+
+    whitespace = re.compile(r'\s*')
+    single_phrase = re.compile(r'\S+')
+    quoted_phrase = re.compile(r'"(?:[^"\n\r\\]|(?:\\.))*"')
+    field_name = re.compile(r'[A-Za-z0-9._]+')
+    escaped_char = re.compile(r'\\(.)')
+    escaped_whitespaces = [('\\t', '\t'), ('\\n', '\n'), ('\\f', '\f'),
+                           ('\\r', '\r')]
+
+    def __init__(self, query_string, full_text=False):
+        self.full_text = full_text
+        # tabs are expanded, to be compatible with the former pyparsing
+        # based parser
+        self.query_string = query_string.expandtabs()
+        self.pos = 0
+
+    def skip_whitespace(self):
+        self.pos = self.whitespace.match(self.query_string, self.pos).end()
+
+    def parse_phrase(self):
+        """Parse a phrase, returning ``(phrase, quoted)``."""
+        m = self.quoted_phrase.match(self.query_string, self.pos)
+        if m:
+            phrase = m.group()[1: -1]
+            if '\\' in phrase:
+                for escaped, char in self.escaped_whitespaces:
+                    phrase = phrase.replace(escaped, char)
+                phrase = self.escaped_char.sub(r'\g<1>', phrase)
+            quoted = True
+        else:
+            m = self.single_phrase.match(self.query_string, self.pos)
+            if not m:
+                return None, False
+            phrase = m.group()
+            quoted = False
+        self.pos = m.end()
+        return phrase, quoted
+
+    def parse_field_query(self):
+        start = self.pos
+        m = self.field_name.match(self.query_string, self.pos)
+        if m:
+            self.pos = m.end()
+            self.skip_whitespace()
+            if self.query_string.startswith(':', self.pos):
+                self.pos += 1
+                mode = FieldQueryTerm.DEFAULT
+                if self.query_string.startswith('=', self.pos):
+                    self.pos += 1
+                    mode = FieldQueryTerm.EXACT
+                self.skip_whitespace()
+                phrase, quoted = self.parse_phrase()
+                if phrase is not None:
+                    if mode == FieldQueryTerm.DEFAULT and not quoted and \
+                            len(phrase) > 1 and phrase.endswith('*'):
+                        phrase = phrase[:-1]
+                        mode = FieldQueryTerm.PREFIX
+                    return FieldQueryTerm(m.group(), phrase, mode=mode)
+        self.pos = start
+        return None
+
+    def parse_all_field_query(self):
+        phrase, _ = self.parse_phrase()
+        if phrase is not None:
+            return AllFieldQuery(phrase, full_text=self.full_text)
+        return None
+
+    def parse(self):
+        """
+        Parse the query string.
+
+        Returns:
+            AndQuery: The parsed query object.
+
+        Raises:
+            BadQueryError: If the query string cannot be parsed.
+        """
+        terms = []
+        self.skip_whitespace()
+        while self.pos < len(self.query_string):
+            term = self.parse_field_query() or self.parse_all_field_query()
+            if term is None:
+                raise BadQueryError()
+            terms.append(term)
+            self.skip_whitespace()
+        if not terms:
+            raise BadQueryError()
+        return AndQuery(terms)
+
+
+def parse_query(query_string, full_text=False):
     """
     Parse a query string into :class:`Query`.
 
     Args:
         query_string (str): The query string.
+        full_text (bool): Whether or not to search the all-field phrases
+            in the text index, instead of matching them against each field?
+            (default :obj:`False`)
 
     Returns:
         Query: The parsed query object.
+
+    Raises:
+        BadQueryError: If the query string cannot be parsed.
     """
-    try:
-        ret = QueryParser.query_string.parseString(query_string, parseAll=True)
-        ret = ret[0]
-        return ret
-    except pp.ParseBaseException:
-        raise BadQueryError()
+    return QueryParser(query_string, full_text=full_text).parse()
 
 
-def build_filter_dict_from_query_string(query_string):
+class QueryCache(object):
     """
-    Build a MongoDB filter dict from a simple string query.
+    Bounded LRU cache of query string to MongoDB filter dict.
 
-    Args:
-        query_string (str): The query string.
+    The filter dicts are deep-copied when put into and when got from the
+    cache, such that the callers are free to modify them.
 
-    Returns:
-        dict[str, any]: The filter dict.
+    The cached filter dicts expire after `ttl` seconds, since a date
+    phrase without an explicit date (e.g., ``start_time:10:00``) is
+    resolved against the current day when the filter dict is built.
     """
-    query = parse_query(query_string)
+
+    _BAD_QUERY = object()
+
+    def __init__(self, max_size=256, ttl=60., timer=time.monotonic):
+        """
+        Construct a new :class:`QueryCache`.
+
+        Args:
+            max_size (int): Maximum number of query strings to cache.
+                Zero to disable the cache. (default 256)
+            ttl (float): Time-to-live of the cached filter dicts,
+                in seconds. (default 60)
+            timer (() -> float): The clock for expiring the cached
+                filter dicts.
+        """
+        # `TTLCache` is not thread-safe, thus guarded by the lock
+        self._cache = TTLCache(max_size, ttl, timer=timer)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def max_size(self):
+        """Get the maximum number of query strings to cache."""
+        return self._cache.max_size
+
+    @property
+    def ttl(self):
+        """Get the time-to-live of the cached filter dicts, in seconds."""
+        return self._cache.ttl
+
+    @property
+    def hits(self):
+        """Get the number of cache hits."""
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """Get the number of cache misses."""
+        return self._cache.misses
+
+    def get_or_build(self, key, builder):
+        """
+        Get the filter dict of `key` from the cache, or build it by
+        `builder` and put it into the cache.
+
+        Args:
+            key: The query string, with the options for building the
+                filter dict.  Must be hashable.
+            builder (() -> dict[str, any]): The function to build the
+                filter dict.
+
+        Returns:
+            dict[str, any]: The filter dict.
+
+        Raises:
+            BadQueryError: If the query string is a bad query.
+        """
+        if self.max_size <= 0:
+            return builder()
+
+        with self._lock:
+            ret = self._cache.get(key)
+
+        if ret is None:
+            try:
+                ret = builder()
+            except BadQueryError:
+                ret = self._BAD_QUERY
+            with self._lock:
+                self._cache.put(key, self._copy(ret))
+
+        if ret is self._BAD_QUERY:
+            raise BadQueryError()
+        return self._copy(ret)
+
+    def _copy(self, value):
+        if value is self._BAD_QUERY:
+            return value
+        return copy.deepcopy(value)
+
+    def clear(self):
+        """Clear the cached query strings and the statistics."""
+        with self._lock:
+            self._cache.clear()
+            self._cache.hits = self._cache.misses = 0
+
+
+#: The cache for :func:`build_filter_dict_from_query_string`
+query_cache = QueryCache()
+
+
+def _build_filter_dict(query_string, full_text):
+    query = parse_query(query_string, full_text=full_text)
     query = query.optimize()
     if isinstance(query, NullQuery):
         return {}
@@ -281,6 +533,52 @@ def build_filter_dict_from_query_string(query_string):
         return query.mongo_filter()
 
 
+def build_filter_dict_from_query_string(query_string, use_cache=True,
+                                        full_text=False):
+    """
+    Build a MongoDB filter dict from a simple string query.
+
+    Args:
+        query_string (str): The query string.
+        use_cache (bool): Whether or not to use :data:`query_cache`?
+            (default :obj:`True`)
+        full_text (bool): Whether or not to compile the all-field phrases
+            into a ``$text`` search, which requires a text index on the
+            collection?  If :obj:`False`, they will be compiled into an
+            ``$or`` over all fields, which cannot use any index.
+            (default :obj:`False`)
+
+    Returns:
+        dict[str, any]: The filter dict.
+
+    Raises:
+        BadQueryError: If `query_string` is a bad query.
+    """
+    builder = functools.partial(_build_filter_dict, query_string, full_text)
+    if use_cache:
+        return query_cache.get_or_build((query_string, full_text), builder)
+    return builder()
+
+
+def is_text_search(filter_dict):
+    """
+    Check whether or not `filter_dict` contains a ``$text`` search, which
+    is either at the top-level, or in the top-level ``$and``.
+
+    Args:
+        filter_dict (dict[str, any]): The filter dict.
+
+    Returns:
+        bool: Whether or not `filter_dict` contains a ``$text`` search.
+    """
+    if not isinstance(filter_dict, dict):
+        return False
+    if '$text' in filter_dict:
+        return True
+    return any(isinstance(f, dict) and '$text' in f
+               for f in filter_dict.get('$and', ()))
+
+
 if __name__ == '__main__':
     query = parse_query('exit_code:0')
     print(query)
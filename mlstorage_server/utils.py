@@ -5,8 +5,12 @@ from aiohttp import web
 from bson import ObjectId
 from pytz import UTC
 
+# `TTLCache` lives in a module free of heavy imports, such that it can be
+# used by :mod:`mlstorage_server.query` without importing aiohttp
+from mlstorage_server.cache import TTLCache
+
 __all__ = [
-    'query_string_get', 'path_info_get', 'JsonEncoder',
+    'query_string_get', 'path_info_get', 'JsonEncoder', 'TTLCache',
 ]
 
 _NOT_SET = object()
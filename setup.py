@@ -55,6 +55,9 @@ setup(
     platforms='any',
     setup_requires=['setuptools'],
     install_requires=install_requires,
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     dependency_links=dependency_links,
     classifiers=[
         'Development Status :: 2 - Alpha',
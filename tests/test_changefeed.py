@@ -0,0 +1,170 @@
+import asyncio
+import unittest
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:  # pragma: no cover
+    AsyncMongoMockClient = None
+
+from mlstorage_server.changefeed import ChangeFeed, Subscription
+from mlstorage_server.mldb import MLDB
+
+POLL_INTERVAL = .05
+
+
+class SubscriptionTestCase(unittest.TestCase):
+
+    def test_overflow(self):
+        loop = asyncio.new_event_loop()
+        try:
+            async def run():
+                subscription = Subscription(max_queued=2)
+                for i in range(3):
+                    subscription.put({'id': i})
+                self.assertTrue(subscription.overflowed)
+                subscription.put({'id': 3})
+                self.assertIsNone(await subscription.get())
+                self.assertTrue(subscription._queue.empty())
+
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+
+@unittest.skipIf(AsyncMongoMockClient is None,
+                 '`mongomock-motor` is not installed')
+class ChangeFeedPollingTestCase(unittest.TestCase):
+
+    def run_feed(self, fn, max_queued=1000):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            async def run():
+                mldb = MLDB(AsyncMongoMockClient()['test']['experiments'])
+                feed = ChangeFeed(mldb, mode=ChangeFeed.POLLING,
+                                  poll_interval=POLL_INTERVAL,
+                                  max_queued=max_queued)
+                try:
+                    await fn(mldb, feed)
+                finally:
+                    await feed.close()
+
+            loop.run_until_complete(run())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    async def get_event(self, subscription):
+        return await asyncio.wait_for(
+            subscription.get(), POLL_INTERVAL * 20)
+
+    async def assert_no_event(self, subscription):
+        await asyncio.sleep(POLL_INTERVAL * 3)
+        self.assertTrue(subscription._queue.empty())
+
+    async def wait_polls(self):
+        await asyncio.sleep(POLL_INTERVAL * 3)
+
+    def test_seed_silently(self):
+        async def run(mldb, feed):
+            ids = [await mldb.create('exp{}'.format(i)) for i in range(3)]
+            all_subscription = feed.subscribe()
+            id_subscription = feed.subscribe(ids[:1])
+            await self.assert_no_event(all_subscription)
+            await self.assert_no_event(id_subscription)
+
+            # a newly watched experiment is not reported
+            late_subscription = feed.subscribe(ids[1:2])
+            await self.assert_no_event(late_subscription)
+            await self.assert_no_event(all_subscription)
+
+        self.run_feed(run)
+
+    def test_late_watch_all(self):
+        async def run(mldb, feed):
+            ids = [await mldb.create('exp{}'.format(i)) for i in range(3)]
+            id_subscription = feed.subscribe(ids[:1])
+            await self.wait_polls()
+
+            # the heartbeating experiments are not reported as inserted
+            # to a new subscriber of all experiments
+            all_subscription = feed.subscribe()
+            await self.assert_no_event(all_subscription)
+            await mldb.update(ids[1], {'progress': {'epoch': 1}})
+            event = await self.get_event(all_subscription)
+            self.assertEqual((event['op'], event['id']), ('update', ids[1]))
+            await self.assert_no_event(id_subscription)
+
+        self.run_feed(run)
+
+    def test_insert(self):
+        async def run(mldb, feed):
+            subscription = feed.subscribe()
+            await self.wait_polls()
+            id = await mldb.create('exp', {'config': {'lr': 0.1}})
+            event = await self.get_event(subscription)
+            self.assertEqual(event['op'], 'insert')
+            self.assertEqual(event['id'], id)
+            self.assertEqual(event['fields']['name'], 'exp')
+            # the excluded fields are not fetched for watch-all polls
+            self.assertNotIn('config', event['fields'])
+            await self.assert_no_event(subscription)
+
+        self.run_feed(run)
+
+    def test_update(self):
+        async def run(mldb, feed):
+            id = await mldb.create('exp')
+            other_id = await mldb.create('other')
+            subscription = feed.subscribe([id])
+            await self.wait_polls()
+
+            await mldb.update(id, {'progress': {'epoch': 3}})
+            await mldb.update(other_id, {'progress': {'epoch': 1}})
+            event = await self.get_event(subscription)
+            self.assertEqual(event, {
+                'op': 'update', 'id': id,
+                'fields': {'progress': {'epoch': 3}}, 'removed': [],
+            })
+            await self.assert_no_event(subscription)
+
+        self.run_feed(run)
+
+    def test_delete(self):
+        async def run(mldb, feed):
+            id = await mldb.create('exp')
+            id2 = await mldb.create('exp2')
+            subscription = feed.subscribe([id, id2])
+            await self.wait_polls()
+
+            # setting the deletion flag
+            await mldb.mark_delete(id)
+            event = await self.get_event(subscription)
+            self.assertEqual(event['op'], 'delete')
+            self.assertEqual(event['id'], id)
+
+            # removing the document
+            await mldb.collection.delete_one({'_id': id2})
+            event = await self.get_event(subscription)
+            self.assertEqual(event, {'op': 'delete', 'id': id2,
+                                     'fields': {}, 'removed': []})
+
+        self.run_feed(run)
+
+    def test_overflow(self):
+        async def run(mldb, feed):
+            ids = [await mldb.create('exp{}'.format(i)) for i in range(3)]
+            subscription = feed.subscribe(ids)
+            await self.wait_polls()
+
+            for id in ids:
+                await mldb.update(id, {'progress': {'epoch': 1}})
+            await self.wait_polls()
+            self.assertTrue(subscription.overflowed)
+            self.assertIsNone(await self.get_event(subscription))
+
+        self.run_feed(run, max_queued=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import random
+import unittest
+
+from bson import ObjectId
+
+from mlstorage_server.query import (AllFieldQuery, BadQuery, BadQueryError,
+                                    OrQuery, QueryCache, TextQuery,
+                                    build_filter_dict_from_query_string,
+                                    is_text_search, parse_query)
+
+# Query strings and the `repr` of their parsed trees, as produced by the
+# former pyparsing 2.4.7 grammar, which the hand-written parser must match.
+PYPARSING_PARITY_CASES = [
+    ('abc',
+     "And('abc')"),
+    ('  abc  ',
+     "And('abc')"),
+    ('abc def',
+     "And('abc','def')"),
+    ('name:foo',
+     "And(FieldQuery(name:'foo'))"),
+    ('name:"foo bar"',
+     "And(FieldQuery(name:'foo bar'))"),
+    ('"foo bar"',
+     "And('foo bar')"),
+    ('"a \\"quoted\\" b"',
+     'And(\'a "quoted" b\')'),
+    ('"back\\\\slash"',
+     "And('back\\\\slash')"),
+    ('"tab\there"',
+     "And('tab    here')"),
+    ('"new\\nline"',
+     "And('new\\nline')"),
+    ('status:running',
+     "And(FieldQuery(status:'RUNNING'))"),
+    ('exit_code:1',
+     'And(FieldQuery(exit_code:1))'),
+    ('exit_code:abc',
+     "And(FieldQuery(exit_code:'abc'))"),
+    ('id:bad',
+     "And(FieldQuery(_id:'bad'))"),
+    ('tags:x tags:y',
+     "And(FieldQuery(tags:'x'),FieldQuery(tags:'y'))"),
+    ('config.lr:0.1',
+     "And(FieldQuery(config.lr:'0.1'))"),
+    ('start_time:2018-08-01',
+     'And(FieldQuery(start_time:datetime.datetime(2018, 8, 1, 0, 0)))'),
+    ('name:a:b',
+     "And(FieldQuery(name:'a:b'))"),
+    (':x',
+     "And(':x')"),
+    ('x:',
+     "And('x:')"),
+    ('name:',
+     "And('name:')"),
+    ('"unterminated',
+     'And(\'"unterminated\')'),
+    ('a"b',
+     'And(\'a"b\')'),
+    ('héllo wörld',
+     "And('héllo','wörld')"),
+    ('name:中文',
+     "And(FieldQuery(name:'中文'))"),
+    ('description:"multi word desc"',
+     "And(FieldQuery(description:'multi word desc'))"),
+    ('args:--lr',
+     "And(FieldQuery(args:'--lr'))"),
+    ('storage_dir:/a/b',
+     "And(FieldQuery(storage_dir:'/a/b'))"),
+    ('exc_info.hostname:host1',
+     "And(FieldQuery(exc_info.hostname:'host1'))"),
+    ('result.loss:0.5',
+     "And(FieldQuery(result.loss:'0.5'))"),
+    ('a\tb\nc',
+     "And('a','b','c')"),
+    ('name:"x" status:done',
+     "And(FieldQuery(name:'x'),FieldQuery(status:'DONE'))"),
+    ('name:(a|b)',
+     "And(FieldQuery(name:'(a|b)'))"),
+    ('"a""b"',
+     "And('a','b')"),
+    ('name:"a"b',
+     "And(FieldQuery(name:'a'),'b')"),
+    ('na-me:x',
+     "And('na-me:x')"),
+    ('a.b_c:1',
+     "And(FieldQuery(a.b_c:'1'))"),
+    ('""',
+     "And('')"),
+    ('name:""',
+     "And(FieldQuery(name:''))"),
+    ('"\u3000"',
+     "And('\\u3000')"),
+    ('name:"a\\\\"b"',
+     'And(FieldQuery(name:\'a\\\\\'),\'b"\')'),
+    ('name:x"y z"',
+     'And(FieldQuery(name:\'x"y\'),\'z"\')'),
+]
+
+# Deliberate differences from the results of the pyparsing grammar.
+DEVIATION_CASES = [
+    # the former `FieldQueryTerm` looked up the field type after renaming
+    # "id" to "_id", thus never converted the phrase into an ObjectId
+    ('id:5b7e8e9a1a2b3c4d5e6f7a8b',
+     "And(FieldQuery(_id:ObjectId('5b7e8e9a1a2b3c4d5e6f7a8b')))"),
+    # pyparsing failed on runs of non-ASCII white spaces
+    ('x\u3000y', "And('x','y')"),
+]
+
+
+class QueryParserTestCase(unittest.TestCase):
+
+    def test_pyparsing_parity(self):
+        for query_string, expected in PYPARSING_PARITY_CASES:
+            self.assertEqual(
+                repr(parse_query(query_string)), expected, query_string)
+
+    def test_deviations(self):
+        for query_string, expected in DEVIATION_CASES:
+            self.assertEqual(
+                repr(parse_query(query_string)), expected, query_string)
+
+    def test_empty_query(self):
+        for query_string in ['', '   ', '\t\n']:
+            with self.assertRaises(BadQueryError):
+                parse_query(query_string)
+
+    def test_fuzz(self):
+        # any query string either parses, or raises `BadQueryError`
+        alphabet = 'ab:."\\ \t\u3000\u4e2d_-*=^'
+        rnd = random.Random(1234)
+        for _ in range(20000):
+            query_string = ''.join(
+                rnd.choice(alphabet) for _ in range(rnd.randint(0, 12)))
+            try:
+                parse_query(query_string)
+            except BadQueryError:
+                pass
+
+
+class FieldQueryModeTestCase(unittest.TestCase):
+
+    def build(self, query_string):
+        return build_filter_dict_from_query_string(
+            query_string, use_cache=False)
+
+    def test_prefix(self):
+        self.assertEqual(self.build('name:foo*'),
+                         {'name': {'$regex': '^foo'}})
+        self.assertEqual(self.build('name:a.b(c+*'),
+                         {'name': {'$regex': '^a\\.b\\(c\\+'}})
+        self.assertEqual(self.build('storage_dir:/a/b*'),
+                         {'storage_dir': {'$regex': '^/a/b'}})
+
+    def test_exact(self):
+        self.assertEqual(self.build('name:="x y"'), {'name': 'x y'})
+        self.assertEqual(self.build('name:=a.b'), {'name': 'a.b'})
+
+    def test_prefix_of_non_string_field(self):
+        for query_string in ['id:abc*', 'exit_code:1*',
+                             'start_time:2020*']:
+            self.assertIsInstance(
+                parse_query(query_string).optimize(), BadQuery)
+            with self.assertRaises(BadQueryError):
+                self.build(query_string)
+
+
+class FullTextQueryTestCase(unittest.TestCase):
+
+    def build(self, query_string):
+        return build_filter_dict_from_query_string(
+            query_string, use_cache=False, full_text=True)
+
+    def test_merge_text_clauses(self):
+        f = self.build('foo "x y" bar')
+        self.assertEqual(f, {'$text': {'$search': '"foo" "x y" "bar"'}})
+        self.assertTrue(is_text_search(f))
+
+        f = self.build('foo name:abc bar')
+        self.assertEqual(f, {'$and': [
+            {'$text': {'$search': '"foo" "bar"'}},
+            {'name': {'$regex': 'abc', '$options': 'ism'}},
+        ]})
+        self.assertTrue(is_text_search(f))
+
+    def test_object_id(self):
+        id = '5b4b0f0c2b6a4a1b2c3d4e5f'
+        f = self.build(id)
+        self.assertEqual(f, {'_id': ObjectId(id)})
+        self.assertFalse(is_text_search(f))
+        self.assertEqual(self.build('foo ' + id), {'$and': [
+            {'$text': {'$search': '"foo"'}},
+            {'_id': ObjectId(id)},
+        ]})
+
+    def test_regex_fallback(self):
+        f = build_filter_dict_from_query_string('foo', use_cache=False)
+        self.assertIn('$or', f)
+        self.assertFalse(is_text_search(f))
+
+    def test_text_clauses_under_or(self):
+        query = OrQuery([AllFieldQuery('foo', full_text=True),
+                         AllFieldQuery('bar', full_text=True)])
+        self.assertIsInstance(query.optimize(), BadQuery)
+        query = OrQuery([AllFieldQuery('foo', full_text=True),
+                         AllFieldQuery('', full_text=True)])
+        self.assertEqual(query.optimize(), TextQuery(['foo']))
+
+    def test_is_text_search(self):
+        self.assertTrue(is_text_search({'$text': {'$search': 'x'}}))
+        self.assertTrue(is_text_search(
+            {'$and': [{'a': 1}, {'$text': {'$search': 'x'}}]}))
+        self.assertFalse(is_text_search({'name': 'x'}))
+        self.assertFalse(is_text_search({}))
+        self.assertFalse(is_text_search(None))
+
+
+class QueryCacheTestCase(unittest.TestCase):
+
+    def test_hit_returns_copy(self):
+        cache = QueryCache()
+        built = []
+
+        def builder():
+            built.append(1)
+            return {'name': {'$in': ['a', 'b']}}
+
+        ret = cache.get_or_build('k', builder)
+        ret['name']['$in'].append('c')
+        ret = cache.get_or_build('k', builder)
+        self.assertEqual(ret, {'name': {'$in': ['a', 'b']}})
+        ret['name']['$in'].append('d')
+        self.assertEqual(cache.get_or_build('k', builder),
+                         {'name': {'$in': ['a', 'b']}})
+        self.assertEqual(len(built), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_bad_query(self):
+        cache = QueryCache()
+        built = []
+
+        def builder():
+            built.append(1)
+            raise BadQueryError()
+
+        for _ in range(2):
+            with self.assertRaises(BadQueryError):
+                cache.get_or_build('k', builder)
+        self.assertEqual(len(built), 1)
+
+    def test_expire(self):
+        now = [0.]
+        cache = QueryCache(ttl=10., timer=lambda: now[0])
+        built = []
+
+        def builder():
+            built.append(1)
+            return {'n': len(built)}
+
+        self.assertEqual(cache.get_or_build('k', builder), {'n': 1})
+        now[0] = 9.
+        self.assertEqual(cache.get_or_build('k', builder), {'n': 1})
+        now[0] = 10.
+        self.assertEqual(cache.get_or_build('k', builder), {'n': 2})
+
+    def test_max_size(self):
+        cache = QueryCache(max_size=2)
+        for key in 'abc':
+            cache.get_or_build(key, lambda: {key: 1})
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+        cache = QueryCache(max_size=0)
+        cache.get_or_build('a', lambda: {'a': 1})
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()